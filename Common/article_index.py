@@ -0,0 +1,84 @@
+# article_index.py
+
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# 処理済み記事インデックスの既定の保存先（リポジトリ直下の .cache/）
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache', 'article_index.sqlite3')
+
+_ARTICLE_ID_PATTERN = re.compile(r'/diary/detail/(\d+)')
+
+
+def article_id_from_url(url):
+    """記事 URL（/diary/detail/<id>）から数値の記事 ID を取り出す関数（見つからなければ None）"""
+    match = _ARTICLE_ID_PATTERN.search(url)
+    return int(match.group(1)) if match else None
+
+
+class ArticleIndex:
+    """
+    メンバーごとの処理済み記事 ID を保存する永続インデックス。
+    namespace で用途（感情分析・画像収集など）ごとに記録を分ける。
+    """
+
+    def __init__(self, namespace, path=DEFAULT_INDEX_PATH):
+        self.namespace = namespace
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS processed_articles (
+                namespace TEXT NOT NULL,
+                member TEXT NOT NULL,
+                article_id INTEGER NOT NULL,
+                processed_at REAL NOT NULL,
+                PRIMARY KEY (namespace, member, article_id)
+            )
+        """)
+        self._conn.commit()
+
+    def known_ids(self, member):
+        """メンバーの処理済み記事 ID の集合を返す"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT article_id FROM processed_articles WHERE namespace = ? AND member = ?',
+                (self.namespace, member)).fetchall()
+        return {row[0] for row in rows}
+
+    def mark_processed(self, member, article_id):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO processed_articles VALUES (?, ?, ?, ?)',
+                (self.namespace, member, article_id, time.time()))
+            self._conn.commit()
+
+    def mark_all_processed(self, member, article_ids):
+        """複数の記事 ID をまとめて処理済みにする（1回のコミットで記録する）"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO processed_articles VALUES (?, ?, ?, ?)',
+                [(self.namespace, member, article_id, now) for article_id in article_ids])
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def add_incremental_arguments(parser):
+    """差分取得（インクリメンタルモード）のオプションを argparse に追加する関数"""
+    parser.add_argument('--incremental', action='store_true',
+                        help='処理済みの記事だけが並ぶ一覧ページに達したら巡回を止め、新しい記事だけを処理する')
+    parser.add_argument('--index-path', type=str, default=DEFAULT_INDEX_PATH, help='処理済み記事インデックス（SQLite）の保存先')
+
+
+def index_from_args(args, namespace):
+    """argparse の結果から ArticleIndex を生成する関数（インクリメンタルモードでなければ None）"""
+    if not args.incremental:
+        return None
+    return ArticleIndex(namespace, args.index_path)
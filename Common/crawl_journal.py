@@ -0,0 +1,133 @@
+# crawl_journal.py
+
+import json
+import os
+import threading
+import time
+
+# ジャーナルの既定の保存先（リポジトリ直下の .cache/journals/）
+DEFAULT_JOURNAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache', 'journals')
+DEFAULT_SYNC_RECORDS = 64     # この件数の記録がたまったら fsync する
+DEFAULT_SYNC_SECONDS = 5.0    # 前回の fsync からこの秒数が経っていたら fsync する
+
+CHECKPOINT = 'checkpoint'
+
+
+class CrawlJournal:
+    """
+    完了した一覧ページ・記事・画像を1行1件の JSON で追記していくジャーナル。
+    記録はバッファにため、commit() で件数か時間のしきい値を超えたときにまとめて fsync する。
+    fsync のたびに末尾へチェックポイントの行を書き、再開時はチェックポイントまでの記録だけを信用する
+    （checkpoint_hook が返す値、例えば出力ファイルの書き込み位置もチェックポイントに保存する）。
+    """
+
+    def __init__(self, path, resume=False, sync_records=DEFAULT_SYNC_RECORDS, sync_seconds=DEFAULT_SYNC_SECONDS,
+                 checkpoint_hook=None):
+        self.path = path
+        self.sync_records = sync_records
+        self.sync_seconds = sync_seconds
+        self.checkpoint_hook = checkpoint_hook
+        self.records = []         # 再開時に読み込んだ（チェックポイント済みの）記録
+        self.last_checkpoint = None
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_sync = time.monotonic()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if resume and os.path.exists(path):
+            committed_bytes = self._replay()
+            # 最後のチェックポイントより後ろ（fsync されていない可能性のある行）は捨てる
+            os.truncate(path, committed_bytes)
+            self._file = open(path, 'a', encoding='utf-8')
+        else:
+            self._file = open(path, 'w', encoding='utf-8')
+
+    def _replay(self):
+        pending = []
+        committed_bytes = 0
+        position = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                position += len(line)
+                if not line.endswith(b'\n'):
+                    break  # 書きかけの行
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record.get('type') == CHECKPOINT:
+                    self.records.extend(pending)
+                    pending = []
+                    self.last_checkpoint = record
+                    committed_bytes = position
+                else:
+                    pending.append(record)
+        return committed_bytes
+
+    def done(self, kind, member):
+        """再開時に読み込んだ記録のうち、種類とメンバーが一致するもののキーの集合を返す"""
+        return {record['key'] for record in self.records if record['type'] == kind and record['member'] == member}
+
+    def restored(self, kind, member):
+        """再開時に読み込んだ記録のうち、種類とメンバーが一致するものを返す"""
+        return [record for record in self.records if record['type'] == kind and record['member'] == member]
+
+    def record(self, kind, member, key, **fields):
+        """完了した作業を1件記録する（ファイルへの書き込みは commit() で行う）"""
+        line = json.dumps({'type': kind, 'member': member, 'key': key, **fields}, ensure_ascii=False)
+        with self._lock:
+            self._buffer.append(line)
+
+    def commit(self, force=False):
+        """記録の件数か経過時間がしきい値を超えていれば、チェックポイントを書いて fsync する"""
+        with self._lock:
+            due = len(self._buffer) >= self.sync_records or time.monotonic() - self._last_sync >= self.sync_seconds
+            if (force or (due and self._buffer)) and self._file is not None:
+                self._sync()
+
+    def _sync(self):
+        state = self.checkpoint_hook() if self.checkpoint_hook is not None else None
+        checkpoint = {'type': CHECKPOINT, 'time': time.time(), 'state': state}
+        self._buffer.append(json.dumps(checkpoint, ensure_ascii=False))
+        self._file.write('\n'.join(self._buffer) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._buffer = []
+        self.last_checkpoint = checkpoint
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+
+def journal_path_for(namespace, member, journal_dir=DEFAULT_JOURNAL_DIR):
+    """用途（emotion / images）とメンバーごとのジャーナルのパスを返す関数"""
+    safe_member = ''.join(c if c.isalnum() else '_' for c in str(member))
+    return os.path.join(journal_dir, f"{namespace}-{safe_member}.jsonl")
+
+
+def add_journal_arguments(parser):
+    """ジャーナル関連のオプションを argparse に追加する関数"""
+    parser.add_argument('--resume', action='store_true',
+                        help='前回中断した実行のジャーナルを読み込み、集計を復元して続きから再開する')
+    parser.add_argument('--no-journal', action='store_true', help='ジャーナルを記録しない')
+    parser.add_argument('--journal-dir', type=str, default=DEFAULT_JOURNAL_DIR, help='ジャーナルの保存先ディレクトリ')
+    parser.add_argument('--journal-sync-records', type=int, default=DEFAULT_SYNC_RECORDS,
+                        help='この件数の記録がたまるごとにジャーナルを fsync する')
+    parser.add_argument('--journal-sync-seconds', type=float, default=DEFAULT_SYNC_SECONDS,
+                        help='前回からこの秒数が経つごとにジャーナルを fsync する')
+
+
+def journal_from_args(args, namespace, member, checkpoint_hook=None):
+    """argparse の結果からメンバーのジャーナルを開く関数（--no-journal なら None）"""
+    if args.no_journal:
+        return None
+    path = journal_path_for(namespace, member, args.journal_dir)
+    journal = CrawlJournal(path, args.resume, args.journal_sync_records, args.journal_sync_seconds, checkpoint_hook)
+    if args.resume:
+        print(f"ジャーナルから {len(journal.records)} 件の完了記録を読み込みました: {path}")
+    return journal
@@ -0,0 +1,253 @@
+# crawler.py
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from http_cache import add_cache_arguments, cache_from_args
+from instrumentation import metrics
+
+DEFAULT_HEADERS = {'User-Agent': 'Mozilla/5.0'}
+
+# 既定のアクセス方針（以前の「毎回2〜5秒スリープ」とほぼ同等の丁寧さ）
+DEFAULT_RATE = 0.4           # ホストごとの1秒あたりリクエスト数
+DEFAULT_BURST = 2            # 連続して送ってよいリクエスト数
+DEFAULT_MAX_IN_FLIGHT = 4    # 同時に処理中にできるリクエスト数
+DEFAULT_TIMEOUT = 10
+DEFAULT_MAX_RETRIES = 3
+SLOW_RESPONSE_SECONDS = 5.0  # これより遅い応答はサーバー負荷のサインとみなす
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # download で1回に書き込むバイト数
+
+# バックオフの対象とするステータスコード
+BACKOFF_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    ホスト単位のトークンバケット。
+    429/5xx や遅い応答で送信レートを半減させ、正常な応答が続くと設定値まで徐々に戻す。
+    """
+
+    def __init__(self, rate, burst, min_rate=None):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 16
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """トークンが1つ得られるまで待つ"""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self, retry_after=None):
+        """レートを半減させる（Retry-After があればその秒数だけ送信を止める）"""
+        with self.lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            if retry_after:
+                self.tokens = min(self.tokens, 1 - retry_after * self.rate)
+
+    def reward(self):
+        """正常な応答のたびに設定レートへ少しずつ戻す"""
+        with self.lock:
+            if self.rate < self.max_rate:
+                self._refill()
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+def _parse_retry_after(response):
+    value = response.headers.get('Retry-After')
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+class Crawler:
+    """
+    接続プールを共有する HTTP クライアント。
+    requests.Session で keep-alive を使い回し、ホストごとのトークンバケットと
+    同時実行数の上限でサーバーへの負荷を抑える。
+    cache（HttpCache）を渡すと、キャッシュ済みのページは条件付き GET で再検証する。
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES,
+                 slow_response_seconds=SLOW_RESPONSE_SECONDS, headers=None, cache=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.slow_response_seconds = slow_response_seconds
+        self.cache = cache
+
+        self.session = requests.Session()
+        self.session.headers.update(headers or DEFAULT_HEADERS)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_in_flight)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def bucket_for(self, url):
+        """URL のホストに対応するトークンバケットを返す"""
+        host = urlparse(url).netloc
+        with self._buckets_lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return self._buckets[host]
+
+    def get(self, url, **kwargs):
+        """キャッシュ・レート制限・リトライ付きで GET する（requests.get と同じく Response を返す）"""
+        cache = self.cache
+        if cache is None or kwargs.get('stream'):
+            return self._fetch(url, **kwargs)
+
+        entry = cache.lookup(url)
+        if entry is not None and (cache.cache_only or cache.is_fresh(url, entry)):
+            cache.count('hits')
+            metrics.increment('http.cache_hits')
+            return cache.to_response(url, entry)
+        if cache.cache_only:
+            cache.count('misses')
+            return cache.offline_miss(url)
+
+        if entry is not None:
+            headers = dict(kwargs.pop('headers', None) or {})
+            headers.update(cache.conditional_headers(entry))
+            kwargs['headers'] = headers
+
+        response = self._fetch(url, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            cache.count('revalidated')
+            cache.touch(url)
+            return cache.to_response(url, entry)
+        cache.count('misses')
+        if response.status_code == 200:
+            cache.store(url, response)
+        return response
+
+    def _fetch(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        bucket = self.bucket_for(url)
+        for attempt in range(self.max_retries + 1):
+            # レート制限による待ち時間と、リクエストそのものの時間を分けて計測する
+            with metrics.timed('http.rate_limit_wait'):
+                bucket.acquire()
+            with self._in_flight:
+                start = time.monotonic()
+                try:
+                    with metrics.timed('http.request'):
+                        response = self.session.get(url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout):
+                    bucket.penalize()
+                    if attempt == self.max_retries:
+                        raise
+                    metrics.increment('http.retries')
+                    continue
+                elapsed = time.monotonic() - start
+
+            if response.status_code in BACKOFF_STATUS_CODES:
+                bucket.penalize(_parse_retry_after(response))
+                if attempt < self.max_retries:
+                    metrics.increment('http.retries')
+                    print(f"サーバーが混雑しているため待機して再試行します（ステータスコード:{response.status_code}）: {url}")
+                    continue
+                return response
+
+            if elapsed > self.slow_response_seconds:
+                bucket.penalize()
+            else:
+                bucket.reward()
+            return response
+
+    def download(self, url, path, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """
+        URL の本文をデコードせずにそのまま path へストリーミングで保存し、(ステータスコード, バイト数) を返す。
+        書き終えてから置き換えるので、途中で止まっても壊れたファイルは残らない。
+        保存したファイルが控えになるので HTTP キャッシュには入れない（キャッシュ済みの場合はそこから書き出す）。
+        """
+        partial_path = f"{path}.part"
+        size = 0
+        try:
+            if self.cache is not None and (self.cache.cache_only or self.cache.lookup(url) is not None):
+                response = self.get(url)
+                if response.status_code != 200:
+                    return response.status_code, 0
+                with open(partial_path, 'wb') as f:
+                    f.write(response.content)
+                size = len(response.content)
+            else:
+                response = self._fetch(url, stream=True)
+                with response:
+                    if response.status_code != 200:
+                        return response.status_code, 0
+                    with open(partial_path, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size):
+                            f.write(chunk)
+                            size += len(chunk)
+            os.replace(partial_path, path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        metrics.increment('http.download_bytes', size)
+        return 200, size
+
+    def map(self, func, iterable):
+        """func を最大 max_in_flight 並列で実行し、入力順に結果を返すジェネレータ"""
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            yield from executor.map(func, iterable)
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            cache = self.cache
+            print(f"HTTP キャッシュ: ヒット {cache.hits} 件, 再検証 {cache.revalidated} 件, ミス {cache.misses} 件")
+            cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def add_crawler_arguments(parser):
+    """両スクレイパー共通のアクセス制御オプションを argparse に追加する関数"""
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help='ホストごとの1秒あたりリクエスト数の上限')
+    parser.add_argument('--burst', type=int, default=DEFAULT_BURST, help='連続して送ってよいリクエスト数')
+    parser.add_argument('--max-in-flight', type=int, default=DEFAULT_MAX_IN_FLIGHT, help='同時に処理中にできるリクエスト数')
+    add_cache_arguments(parser)
+
+
+def crawler_from_args(args, rate_share=1):
+    """
+    argparse の結果から Crawler を生成する関数。
+    複数プロセスで巡回する場合は rate_share にプロセス数を渡し、ホストあたりの合計レートを --rate に、
+    一度に送るリクエスト数の合計を --burst に保つ。
+    """
+    return Crawler(rate=args.rate / rate_share, burst=max(1, args.burst // rate_share),
+                   max_in_flight=args.max_in_flight, cache=cache_from_args(args))
@@ -0,0 +1,205 @@
+# extract.py
+
+import os
+from urllib.parse import parse_qs, urlparse
+
+# 環境変数 SAKURAZAKA_SITE_ROOT で接続先を差し替えられる（ベンチマーク用のローカルサーバーなど）
+SITE_ROOT = os.environ.get('SAKURAZAKA_SITE_ROOT', 'https://sakurazaka46.com').rstrip('/')
+
+# 両スクレイパーが参照する CSS セレクタ（サイト構造が変わったらここだけを直す）
+SELECTORS = {
+    'member_links': 'ul.com-blog-circle li a',   # メンバー一覧の各メンバーへのリンク
+    'member_name': 'p.name',                     # リンク内のメンバー名
+    'article_links': 'ul.com-blog-part li.box a',  # ブログ一覧の各記事へのリンク
+    'pager_links': 'div.com-pager a',            # ブログ一覧のページ送りのリンク
+    'article': 'article.post',                   # 記事本体
+    'article_body': 'div.box-article',           # 記事の本文
+    'article_images': 'div.box-article img',     # 本文中の画像
+    'date_year': 'span.ym-year',
+    'date_month': 'span.ym-month',
+    'date_day': 'p.date.wf-a',
+}
+
+# 対象を絞ったパース（SoupStrainer）で残す要素: (タグ名, クラス名)
+_TARGETS = {
+    'member_links': ('ul', 'com-blog-circle'),
+    'article_links': ('ul', 'com-blog-part'),
+    'pager_links': ('div', 'com-pager'),
+    'article': ('article', 'post'),
+}
+
+HTML_BACKENDS = ('auto', 'selectolax', 'lxml', 'html.parser')
+
+
+def absolute_url(path):
+    """サイト内のパスを絶対 URL にする関数"""
+    return f"{SITE_ROOT}{path}"
+
+
+def _page_numbers(hrefs):
+    """ページ送りのリンク（?page=N）からページ番号を昇順・重複なしで返す"""
+    pages = set()
+    for href in hrefs:
+        page = parse_qs(urlparse(href).query).get('page', [''])[0]
+        if page.isdigit():
+            pages.add(int(page))
+    return sorted(pages)
+
+
+def _format_date(year, month, day):
+    if year is None or month is None or day is None:
+        return None
+    return f"{year.strip()}/{month.strip().zfill(2)}/{day.strip().zfill(2)}"
+
+
+def _has_class(cls):
+    """
+    SoupStrainer 用に、class 属性に cls を含む要素を選ぶ関数を返す。
+    html.parser ではパース中の class 属性が分割前の文字列（'com-blog-circle fxpc'）なので、自分で分割して調べる。
+    """
+    def matches(value):
+        if value is None:
+            return False
+        return cls in (value.split() if isinstance(value, str) else value)
+    return matches
+
+
+class SoupExtractor:
+    """
+    BeautifulSoup による抽出。parser には 'html.parser' または 'lxml' を指定する。
+    targeted=True の場合は SoupStrainer で必要な要素だけを木に組み立てる。
+    """
+
+    def __init__(self, parser='html.parser', targeted=True):
+        from bs4 import BeautifulSoup, SoupStrainer
+
+        self._BeautifulSoup = BeautifulSoup
+        self.parser = parser
+        self.targeted = targeted
+        self._strainers = {key: SoupStrainer(tag, class_=_has_class(cls)) for key, (tag, cls) in _TARGETS.items()}
+        self.name = f"{parser}{'+targeted' if targeted else ''}"
+
+    def _soup(self, html, target):
+        parse_only = self._strainers[target] if self.targeted else None
+        return self._BeautifulSoup(html, self.parser, parse_only=parse_only)
+
+    def member_links(self, html):
+        """メンバー一覧ページから (メンバー名, パス) のリストを返す"""
+        member_links = []
+        for member in self._soup(html, 'member_links').select(SELECTORS['member_links']):
+            name_tag = member.select_one(SELECTORS['member_name'])
+            href = member.get('href')
+            if not name_tag or not href:
+                continue
+            member_links.append((name_tag.get_text().strip(), href))
+        return member_links
+
+    def article_links(self, html):
+        """ブログ一覧ページから記事へのパスのリストを返す"""
+        soup = self._soup(html, 'article_links')
+        return [a.get('href') for a in soup.select(SELECTORS['article_links']) if a.get('href')]
+
+    def pager_pages(self, html):
+        """ブログ一覧ページのページ送りに載っているページ番号のリストを返す"""
+        soup = self._soup(html, 'pager_links')
+        return _page_numbers(a.get('href') for a in soup.select(SELECTORS['pager_links']) if a.get('href'))
+
+    def articles(self, html):
+        """記事ページから記事ごとの本文・日付・画像パスを辞書のリストで返す（本文が無ければ text は None）"""
+        articles = []
+        for article in self._soup(html, 'article').select(SELECTORS['article']):
+            body = article.select_one(SELECTORS['article_body'])
+            parts = [article.select_one(SELECTORS[key]) for key in ('date_year', 'date_month', 'date_day')]
+            articles.append({
+                'text': body.get_text(separator="\n", strip=True) if body else None,
+                'date': _format_date(*[part.get_text() if part else None for part in parts]),
+                'images': [img.get('src') for img in article.select(SELECTORS['article_images']) if img.get('src')],
+            })
+        return articles
+
+
+class SelectolaxExtractor:
+    """selectolax（C 実装の HTML パーサ）による抽出"""
+
+    name = 'selectolax'
+
+    def __init__(self):
+        from selectolax.parser import HTMLParser
+
+        self._HTMLParser = HTMLParser
+
+    @staticmethod
+    def _text(node, separator):
+        # BeautifulSoup の get_text(separator, strip=True) と同じく、空白だけのテキストは捨てる
+        parts = []
+        for child in node.traverse(include_text=True):
+            if child.tag == '-text' and child.parent is not None and child.parent.tag not in ('script', 'style'):
+                text = child.text_content.strip()
+                if text:
+                    parts.append(text)
+        return separator.join(parts)
+
+    def member_links(self, html):
+        member_links = []
+        for member in self._HTMLParser(html).css(SELECTORS['member_links']):
+            name_tag = member.css_first(SELECTORS['member_name'])
+            href = member.attributes.get('href')
+            if not name_tag or not href:
+                continue
+            member_links.append((name_tag.text().strip(), href))
+        return member_links
+
+    def article_links(self, html):
+        links = (a.attributes.get('href') for a in self._HTMLParser(html).css(SELECTORS['article_links']))
+        return [href for href in links if href]
+
+    def pager_pages(self, html):
+        links = (a.attributes.get('href') for a in self._HTMLParser(html).css(SELECTORS['pager_links']))
+        return _page_numbers(href for href in links if href)
+
+    def articles(self, html):
+        articles = []
+        for article in self._HTMLParser(html).css(SELECTORS['article']):
+            body = article.css_first(SELECTORS['article_body'])
+            parts = [article.css_first(SELECTORS[key]) for key in ('date_year', 'date_month', 'date_day')]
+            images = (img.attributes.get('src') for img in article.css(SELECTORS['article_images']))
+            articles.append({
+                'text': self._text(body, "\n") if body else None,
+                'date': _format_date(*[part.text() if part else None for part in parts]),
+                'images': [src for src in images if src],
+            })
+        return articles
+
+
+def get_extractor(backend='auto', targeted=True):
+    """HTML 抽出バックエンドを返す関数（'auto' は selectolax → lxml → html.parser の順に使えるものを選ぶ）"""
+    if backend == 'auto':
+        for candidate in ('selectolax', 'lxml'):
+            try:
+                return get_extractor(candidate, targeted)
+            except ImportError:
+                continue
+        return SoupExtractor('html.parser', targeted)
+    if backend == 'selectolax':
+        return SelectolaxExtractor()
+    if backend == 'lxml':
+        import lxml  # noqa: F401  未インストールなら ImportError にする
+        return SoupExtractor('lxml', targeted)
+    if backend == 'html.parser':
+        return SoupExtractor('html.parser', targeted)
+    raise ValueError(f"未対応の HTML 抽出バックエンドです: {backend}（{', '.join(HTML_BACKENDS)} のいずれか）")
+
+
+def add_extract_arguments(parser):
+    """HTML 抽出関連のオプションを argparse に追加する関数"""
+    parser.add_argument('--html-backend', choices=HTML_BACKENDS, default='auto',
+                        help='HTML の抽出に使うパーサ（auto: selectolax → lxml → html.parser の順に利用可能なもの）')
+    parser.add_argument('--full-parse', action='store_true',
+                        help='BeautifulSoup で DOM 全体を組み立てる（既定では必要な要素だけをパースする）')
+
+
+def extractor_from_args(args):
+    """argparse の結果から抽出バックエンドを生成する関数"""
+    extractor = get_extractor(args.html_backend, targeted=not args.full_parse)
+    print(f"HTML 抽出バックエンド: {extractor.name}")
+    return extractor
@@ -0,0 +1,204 @@
+# http_cache.py
+
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# 両スクレイパーで共有するキャッシュの既定の保存先（リポジトリ直下の .cache/）
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache', 'http_cache.sqlite3')
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1GB
+
+# URL の種類ごとの有効期限（秒）。None は無期限（再検証しない）
+TTL_RULES = [
+    (re.compile(r'/diary/blog/list'), 60 * 60),                        # 一覧ページ: 新着記事があるので短め
+    (re.compile(r'/diary/detail/'), None),                             # 記事ページ: 公開後はほぼ変わらない
+    (re.compile(r'\.(?:jpe?g|png|gif|webp)(?:\?|$)', re.IGNORECASE), None),  # 画像
+]
+DEFAULT_TTL = 24 * 60 * 60
+
+OFFLINE_MISS = 'OFFLINE-MISS'  # cache-only モードでキャッシュに無かった応答の X-Cache ヘッダー
+ACCESS_FLUSH_COUNT = 256  # 参照時刻の更新をこの件数ためてからまとめて書き込む
+
+
+def ttl_for(url):
+    """URL に対応する有効期限（秒、無期限なら None）を返す関数"""
+    for pattern, ttl in TTL_RULES:
+        if pattern.search(url):
+            return ttl
+    return DEFAULT_TTL
+
+
+def is_offline_miss(response):
+    """応答が cache-only モードでキャッシュに無かったことを示すもの（サーバーの応答ではない）かを返す関数"""
+    return response.headers.get('X-Cache') == OFFLINE_MISS
+
+
+class HttpCache:
+    """
+    URL をキーに本文・ETag・Last-Modified を保存する SQLite ベースの HTTP キャッシュ。
+    合計サイズが上限を超えると、最後に参照された時刻が古いものから削除する。
+    参照時刻はキャッシュヒットのたびに書き込まず、メモリにためて保存・一定件数ごと・close() のときにまとめて書き込む。
+    cache_only=True の場合はネットワークに一切アクセスせず、キャッシュだけで応答する。
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, cache_only=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.cache_only = cache_only
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                encoding TEXT,
+                content_type TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)')
+        self._conn.commit()
+        self._total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        self._accessed = {}  # まだ書き込んでいない URL -> 参照時刻
+
+    def lookup(self, url):
+        """キャッシュ済みのエントリを辞書で返す（無ければ None）"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT body, encoding, content_type, etag, last_modified, fetched_at FROM entries WHERE url = ?',
+                (url,)).fetchone()
+            if row is None:
+                return None
+            self._accessed[url] = time.time()
+            if len(self._accessed) >= ACCESS_FLUSH_COUNT:
+                self._flush_accessed()
+                self._conn.commit()
+        body, encoding, content_type, etag, last_modified, fetched_at = row
+        return {'body': body, 'encoding': encoding, 'content_type': content_type,
+                'etag': etag, 'last_modified': last_modified, 'fetched_at': fetched_at}
+
+    def count(self, outcome):
+        """'hits'・'revalidated'・'misses' のいずれかの件数を1つ増やす（複数のスレッドから呼ばれるのでロックの中で数える）"""
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def is_fresh(self, url, entry):
+        ttl = ttl_for(url)
+        return ttl is None or time.time() - entry['fetched_at'] < ttl
+
+    def conditional_headers(self, entry):
+        """条件付き GET 用のヘッダーを返す"""
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url, response):
+        """200 応答を保存する"""
+        body = response.content
+        now = time.time()
+        with self._lock:
+            # 削除する順番が正しくなるよう、ためていた参照時刻も同じコミットで書き込む
+            self._flush_accessed()
+            previous = self._conn.execute('SELECT size FROM entries WHERE url = ?', (url,)).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, body, response.encoding, response.headers.get('Content-Type'),
+                 response.headers.get('ETag'), response.headers.get('Last-Modified'), now, now, len(body)))
+            self._total_bytes += len(body) - (previous[0] if previous else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def touch(self, url):
+        """304 で再検証できたエントリの取得時刻を更新する"""
+        with self._lock:
+            self._conn.execute('UPDATE entries SET fetched_at = ? WHERE url = ?', (time.time(), url))
+            self._conn.commit()
+
+    def _flush_accessed(self):
+        # ロックの中で呼び、コミットは呼び出し元で行う
+        if self._accessed:
+            self._conn.executemany('UPDATE entries SET accessed_at = ? WHERE url = ?',
+                                   [(accessed_at, url) for url, accessed_at in self._accessed.items()])
+            self._accessed = {}
+
+    def _evict(self):
+        # 上限の9割まで、参照が古い順に削除する
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute('SELECT url, size FROM entries ORDER BY accessed_at').fetchall()
+        for url, size in rows:
+            if self._total_bytes <= target:
+                break
+            self._conn.execute('DELETE FROM entries WHERE url = ?', (url,))
+            self._total_bytes -= size
+
+    def to_response(self, url, entry):
+        """エントリを requests.Response として組み立てる"""
+        response = requests.Response()
+        response.url = url
+        response.status_code = 200
+        response.reason = 'OK'
+        response._content = entry['body']
+        response.encoding = entry['encoding']
+        headers = CaseInsensitiveDict({'X-Cache': 'HIT'})
+        for name, key in (('Content-Type', 'content_type'), ('ETag', 'etag'), ('Last-Modified', 'last_modified')):
+            if entry[key]:
+                headers[name] = entry[key]
+        response.headers = headers
+        return response
+
+    def offline_miss(self, url):
+        """
+        cache-only モードでキャッシュに無い URL への応答（only-if-cached と同じく 504）。
+        サーバーが返した 504 と区別できるよう X-Cache: OFFLINE-MISS を付ける（is_offline_miss で判定する）
+        """
+        response = requests.Response()
+        response.url = url
+        response.status_code = 504
+        response.reason = 'Not Cached'
+        response._content = b''
+        response.headers = CaseInsensitiveDict({'X-Cache': OFFLINE_MISS})
+        return response
+
+    def close(self):
+        with self._lock:
+            self._flush_accessed()
+            self._conn.commit()
+            self._conn.close()
+
+
+def add_cache_arguments(parser):
+    """HTTP キャッシュ関連のオプションを argparse に追加する関数"""
+    parser.add_argument('--cache-path', type=str, default=DEFAULT_CACHE_PATH, help='HTTP キャッシュ（SQLite）の保存先')
+    parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help='HTTP キャッシュの最大サイズ（MB）')
+    parser.add_argument('--no-cache', action='store_true', help='HTTP キャッシュを使用しない')
+    parser.add_argument('--cache-only', action='store_true',
+                        help='ネットワークにアクセスせず、キャッシュ済みのページだけで処理する')
+
+
+def cache_from_args(args):
+    """argparse の結果から HttpCache を生成する関数（無効化されていれば None）"""
+    if args.no_cache:
+        if args.cache_only:
+            raise ValueError('--no-cache と --cache-only は同時に指定できません。')
+        return None
+    return HttpCache(args.cache_path, max_bytes=args.cache_max_mb * 1024 * 1024, cache_only=args.cache_only)
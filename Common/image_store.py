@@ -0,0 +1,310 @@
+# image_store.py
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+# 画像ストアの既定の保存先（実行したディレクトリの image_store/）
+DEFAULT_STORE_DIR = 'image_store'
+MANIFEST_NAME = 'manifest.sqlite3'
+DEFAULT_MAX_HASH_DISTANCE = 5  # dHash（64ビット）のハミング距離がこれ以下なら似た画像とみなす
+HASH_SIZE = 8
+
+_FACE_SUFFIX_PATTERN = re.compile(r'_face_\d+$')
+
+# add() の結果。new は新しく保存した画像か、duplicate_of は似た画像とみなした既存の画像の SHA-256
+StoredImage = namedtuple('StoredImage', ['sha256', 'path', 'name', 'new', 'duplicate_of'])
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    """ファイルの内容の SHA-256 を返す関数"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dhash(path, hash_size=HASH_SIZE):
+    """
+    画像の dHash（隣り合う画素の明暗の差を並べた hash_size² ビットの知覚ハッシュ）を返す関数。
+    拡大縮小・再圧縮された同じ写真は、ハミング距離の小さいハッシュになる。
+    """
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img.draft('L', (hash_size * 4, hash_size * 4))  # JPEG は縮小しながらデコードする
+        small = img.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = small.tobytes()  # 'L' は1画素1バイト
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            offset = row * (hash_size + 1) + col
+            value = (value << 1) | int(pixels[offset] > pixels[offset + 1])
+    return value
+
+
+def _to_signed(value):
+    # SQLite の INTEGER は符号付き64ビットなので、上位ビットが立つハッシュは負の値として保存する
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value):
+    return value & ((1 << 64) - 1)
+
+
+class ImageStore:
+    """
+    画像を内容の SHA-256 をキーに保存するストア。
+    画像本体は blobs/<先頭2文字>/<SHA-256><拡張子> に1つだけ置き、取得元の URL・メンバー・記事・日付と
+    画像の対応は manifest.sqlite3 にまとめる。取得済みかどうかはファイルではなくマニフェストで判定する。
+    near_duplicates=True なら dHash を求め、既存の画像と max_distance 以内のものを似た画像として記録する。
+    """
+
+    def __init__(self, root=DEFAULT_STORE_DIR, near_duplicates=False, max_distance=DEFAULT_MAX_HASH_DISTANCE):
+        self.root = root
+        self.near_duplicates = near_duplicates
+        self.max_distance = max_distance
+        self.new_images = 0
+        self.exact_duplicates = 0
+        self.near_duplicate_images = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, MANIFEST_NAME), timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                name TEXT NOT NULL,
+                member TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                dhash INTEGER,
+                duplicate_of TEXT,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sources (
+                url TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                member TEXT NOT NULL,
+                article_id INTEGER,
+                date TEXT,
+                name TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS blobs_by_name ON blobs (name)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS blobs_by_member ON blobs (member)')
+        self._conn.commit()
+
+        self._hashes = []  # (SHA-256, dHash) の一覧（似た画像の検索用、重複でない画像だけ）
+        if near_duplicates:
+            self._load_hashes()
+
+    def _load_hashes(self):
+        # dHash を求めていない画像（以前 near_duplicates なしで保存したもの）は古い順に求めて判定し直す
+        rows = self._conn.execute(
+            'SELECT sha256, path, dhash, duplicate_of FROM blobs ORDER BY created_at').fetchall()
+        for sha256, path, value, duplicate_of in rows:
+            if value is None:
+                try:
+                    value = dhash(path)
+                except Exception as e:
+                    print(f"画像のハッシュを求められませんでした: {path}, エラー: {e}")
+                    continue
+                duplicate_of = self._find_similar(value)
+                self._conn.execute('UPDATE blobs SET dhash = ?, duplicate_of = ? WHERE sha256 = ?',
+                                   (_to_signed(value), duplicate_of, sha256))
+            else:
+                value = _to_unsigned(value)
+            if duplicate_of is None:
+                self._hashes.append((sha256, value))
+        self._conn.commit()
+
+    def _find_similar(self, value):
+        for sha256, other in self._hashes:
+            if (value ^ other).bit_count() <= self.max_distance:
+                return sha256
+        return None
+
+    def temp_path(self, extension=''):
+        """ダウンロード中のファイルを置くパス（add() で blobs/ へ移す）"""
+        return os.path.join(self.root, 'tmp', f"{uuid.uuid4().hex}{extension}")
+
+    def has_source(self, url):
+        """URL の画像を取得済みか（マニフェストに記録があるか）を返す"""
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM sources WHERE url = ?', (url,)).fetchone()
+        return row is not None
+
+    def add(self, temp_path, url, member, article_id, date, name):
+        """
+        ダウンロードしたファイルを内容の SHA-256 で保存し、取得元を記録して StoredImage を返す。
+        同じ内容の画像が既にあればファイルは捨て、取得元だけを既存の画像に結び付ける。
+        """
+        sha256 = sha256_file(temp_path)
+        extension = os.path.splitext(temp_path)[1]
+        value = None
+        with self._lock:
+            row = self._conn.execute('SELECT path, name, duplicate_of FROM blobs WHERE sha256 = ?',
+                                     (sha256,)).fetchone()
+        if row is None and self.near_duplicates:
+            # 画像のデコードはロックの外で行う
+            try:
+                value = dhash(temp_path)
+            except Exception as e:
+                print(f"画像のハッシュを求められませんでした: {url}, エラー: {e}")
+
+        with self._lock:
+            now = time.time()
+            # ロックを外している間に別のスレッドが同じ画像を保存した場合も、ここで既存の画像として扱う
+            row = row or self._conn.execute('SELECT path, name, duplicate_of FROM blobs WHERE sha256 = ?',
+                                            (sha256,)).fetchone()
+            if row is not None:
+                os.remove(temp_path)
+                path, blob_name, duplicate_of = row
+                new = False
+                self.exact_duplicates += 1
+            else:
+                path = os.path.join(self.root, 'blobs', sha256[:2], f"{sha256}{extension}")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+                blob_name = name
+                duplicate_of = self._find_similar(value) if value is not None else None
+                new = True
+                if duplicate_of is None:
+                    self.new_images += 1
+                    if value is not None:
+                        self._hashes.append((sha256, value))
+                else:
+                    self.near_duplicate_images += 1
+                self._conn.execute(
+                    'INSERT INTO blobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (sha256, path, name, member, os.path.getsize(path),
+                     _to_signed(value) if value is not None else None, duplicate_of, now))
+            self._conn.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (url, sha256, member, article_id, date, name, now))
+            self._conn.commit()
+        return StoredImage(sha256, path, blob_name, new, duplicate_of)
+
+    def unique_images(self, member=None):
+        """重複でない画像の (名前, パス) のリストを返す（member を指定するとそのメンバーが最初に保存した画像だけ）"""
+        query = 'SELECT name, path FROM blobs WHERE duplicate_of IS NULL'
+        params = ()
+        if member is not None:
+            query += ' AND member = ?'
+            params = (member,)
+        with self._lock:
+            return self._conn.execute(query + ' ORDER BY created_at', params).fetchall()
+
+    def members(self):
+        """画像を保存したメンバー名のリストを返す"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute('SELECT DISTINCT member FROM blobs ORDER BY member')]
+
+    def is_duplicate_name(self, name):
+        """名前（拡張子なしのファイル名）の画像が、似た画像として記録されているかを返す"""
+        with self._lock:
+            row = self._conn.execute('SELECT duplicate_of FROM blobs WHERE name = ?', (name,)).fetchone()
+        return row is not None and row[0] is not None
+
+    def content_by_name(self):
+        """
+        名前（拡張子なし）から (SHA-256, 似た画像とみなした既存の画像の SHA-256) への辞書を返す。
+        blobs と sources の名前を1回の問い合わせで読み、同じ名前で内容が異なる画像は含めない。
+        """
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT names.name, blobs.sha256, blobs.duplicate_of
+                FROM (SELECT name, sha256 FROM blobs UNION SELECT name, sha256 FROM sources) AS names
+                JOIN blobs ON blobs.sha256 = names.sha256
+            """).fetchall()
+        contents = {}
+        ambiguous = set()
+        for name, sha256, duplicate_of in rows:
+            if contents.setdefault(name, (sha256, duplicate_of))[0] != sha256:
+                ambiguous.add(name)
+        for name in ambiguous:
+            del contents[name]
+        return contents
+
+    def source_count(self):
+        """記録した取得元（画像の URL）の数を返す"""
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM sources').fetchone()[0]
+
+    def summary(self):
+        return (f"画像ストア: 新しい画像 {self.new_images} 件, 同じ内容の画像 {self.exact_duplicates} 件, "
+                f"似た画像 {self.near_duplicate_images} 件")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_store(root):
+    """保存済みの画像ストアを開く関数（root が None か、マニフェストが無ければ None）"""
+    if root is None:
+        return None
+    if not os.path.exists(os.path.join(root, MANIFEST_NAME)):
+        print(f"画像ストアのマニフェストが見つからないため、似た画像の判定は行いません: {root}")
+        return None
+    return ImageStore(root)
+
+
+def unique_image_names(directory, store=None):
+    """
+    ディレクトリ内の画像ファイル名のうち、内容が同じファイルの2つ目以降と、
+    store で似た画像として記録された画像（切り抜いた顔 <名前>_face_<番号> も含む）を除いたものを返す関数。
+    マニフェストにある名前のファイルは読まずに、元画像の SHA-256 と名前の残り（顔の番号）で同じ内容かを判定し、
+    SHA-256 を求めるのはマニフェストに無いファイルだけにする。
+    """
+    contents = store.content_by_name() if store is not None else {}
+    names = []
+    seen = set()
+    skipped = 0
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            continue
+        base = os.path.splitext(name)[0]
+        stem = _FACE_SUFFIX_PATTERN.sub('', base)
+        content = contents.get(stem)
+        if content is None:
+            key = sha256_file(path)
+        else:
+            sha256, duplicate_of = content
+            if duplicate_of is not None:
+                skipped += 1
+                continue
+            key = (sha256, base[len(stem):])
+        if key in seen:
+            skipped += 1
+            continue
+        seen.add(key)
+        names.append(name)
+    if skipped:
+        print(f"重複している画像 {skipped} 件は処理しません: {directory}")
+    return names
+
+
+def add_store_arguments(parser):
+    """画像ストア関連のオプションを argparse に追加する関数"""
+    parser.add_argument('--image-store', type=str, default=DEFAULT_STORE_DIR,
+                        help='画像を内容の SHA-256 で保存するディレクトリ（マニフェスト manifest.sqlite3 を含む）')
+    parser.add_argument('--near-duplicates', action='store_true',
+                        help='知覚ハッシュ（dHash）で似た画像を判定し、拡大・顔の切り抜きの対象から外す')
+    parser.add_argument('--max-hash-distance', type=int, default=DEFAULT_MAX_HASH_DISTANCE,
+                        help='似た画像とみなす dHash のハミング距離（64ビット中）の上限')
+
+
+def store_from_args(args):
+    """argparse の結果から ImageStore を生成する関数"""
+    return ImageStore(args.image_store, args.near_duplicates, args.max_hash_distance)
@@ -0,0 +1,232 @@
+# instrumentation.py
+
+import functools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from stage_pipeline import percentile
+
+# ヒストグラムの区切り（ミリ秒）
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+LATENCY_SAMPLES = 10_000  # 段ごとに保持する処理時間の件数（パーセンタイル計算用）
+
+DEFAULT_PROFILE_OUTPUT = 'profile_metrics.json'
+TRACERS = ('cprofile', 'pyinstrument')
+
+
+class Histogram:
+    """1つの段の処理時間の分布（件数・合計・最小・最大・区間ごとの件数・直近の値）"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        milliseconds = seconds * 1000
+        index = len(BUCKET_BOUNDS_MS)
+        for i, bound in enumerate(BUCKET_BOUNDS_MS):
+            if milliseconds <= bound:
+                index = i
+                break
+        self.buckets[index] += 1
+        self.samples.append(seconds)
+
+    def merge(self, data):
+        """to_dict() の形式の値を足し込む（ワーカープロセスの計測結果をまとめる用）"""
+        self.count += data['count']
+        self.total += data['total_seconds']
+        if data['min_seconds'] is not None:
+            self.min = data['min_seconds'] if self.min is None else min(self.min, data['min_seconds'])
+        self.max = max(self.max, data['max_seconds'])
+        self.buckets = [a + b for a, b in zip(self.buckets, data['buckets'])]
+        self.samples.extend(data['samples'])
+
+    def to_dict(self, include_samples=False):
+        samples = list(self.samples)
+        data = {
+            'count': self.count,
+            'total_seconds': self.total,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'min_seconds': self.min,
+            'max_seconds': self.max,
+            'p50_ms': percentile(samples, 50) * 1000,
+            'p95_ms': percentile(samples, 95) * 1000,
+            'p99_ms': percentile(samples, 99) * 1000,
+            'bucket_bounds_ms': list(BUCKET_BOUNDS_MS),
+            'buckets': list(self.buckets),
+        }
+        if include_samples:
+            data['samples'] = samples
+        return data
+
+
+class Metrics:
+    """
+    段ごとのカウンタと処理時間のヒストグラムを集める計測器。
+    enabled が False の間は何も記録しないので、--profile なしの実行ではほぼ負荷がかからない。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            self.histograms[stage].observe(seconds)
+
+    @contextmanager
+    def timed(self, stage):
+        """with ブロックの処理時間を stage に記録する（例外が出たら '<stage>.errors' を数える）"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.increment(f"{stage}.errors")
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def instrument(self, stage):
+        """関数の処理時間を stage に記録するデコレータ"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timed(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self, reset=False):
+        """現在の計測結果を（プロセス間で受け渡せる）辞書で返す"""
+        with self._lock:
+            data = {'counters': dict(self.counters),
+                    'histograms': {stage: h.to_dict(include_samples=True) for stage, h in self.histograms.items()}}
+            if reset:
+                self.counters = {}
+                self.histograms = {}
+        return data
+
+    def merge(self, data):
+        """snapshot() の結果を足し込む"""
+        with self._lock:
+            for name, value in data['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for stage, histogram in data['histograms'].items():
+                if stage not in self.histograms:
+                    self.histograms[stage] = Histogram()
+                self.histograms[stage].merge(histogram)
+
+    def to_dict(self):
+        with self._lock:
+            return {'counters': dict(self.counters),
+                    'histograms': {stage: h.to_dict() for stage, h in self.histograms.items()}}
+
+    def summary_table(self):
+        """段ごとの件数・合計時間・平均/p50/p95/最大を、合計時間の多い順に並べた表を返す"""
+        data = self.to_dict()
+        lines = [f"{'段':<28}{'件数':>8}{'合計(秒)':>11}{'平均(ms)':>11}{'p50(ms)':>10}{'p95(ms)':>10}{'最大(ms)':>11}"]
+        ordered = sorted(data['histograms'].items(), key=lambda item: item[1]['total_seconds'], reverse=True)
+        for stage, h in ordered:
+            lines.append(f"{stage:<28}{h['count']:>8}{h['total_seconds']:>11.2f}{h['mean_ms']:>11.1f}"
+                         f"{h['p50_ms']:>10.1f}{h['p95_ms']:>10.1f}{h['max_seconds'] * 1000:>11.1f}")
+        if data['counters']:
+            lines.append('')
+            lines.append('カウンタ:')
+            for name, value in sorted(data['counters'].items()):
+                lines.append(f"  {name}: {value}")
+        return '\n'.join(lines)
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+# プロセス内で共有する計測器
+metrics = Metrics()
+
+
+class Profiler:
+    """--profile の開始・終了をまとめるクラス（終了時に表と JSON を出力し、必要ならトレースを保存する）"""
+
+    def __init__(self, output=DEFAULT_PROFILE_OUTPUT, tracer=None, trace_output=None):
+        self.output = output
+        self.tracer = tracer
+        self.trace_output = trace_output or ('profile_trace.prof' if tracer == 'cprofile' else 'profile_trace.html')
+        self._trace = None
+
+    def start(self):
+        metrics.enabled = True
+        if self.tracer == 'cprofile':
+            import cProfile
+            self._trace = cProfile.Profile()
+            self._trace.enable()
+        elif self.tracer == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler as PyinstrumentProfiler
+            except ImportError:
+                print("pyinstrument がインストールされていないため、トレースは取得しません: pip install pyinstrument")
+                self.tracer = None
+            else:
+                self._trace = PyinstrumentProfiler()
+                self._trace.start()
+
+    def stop(self):
+        if self.tracer == 'cprofile' and self._trace is not None:
+            self._trace.disable()
+            self._trace.dump_stats(self.trace_output)
+            print(f"cProfile のトレースを '{self.trace_output}' に保存しました（python -m pstats で確認できます）。")
+        elif self.tracer == 'pyinstrument' and self._trace is not None:
+            self._trace.stop()
+            with open(self.trace_output, 'w', encoding='utf-8') as f:
+                f.write(self._trace.output_html())
+            print(f"pyinstrument のトレースを '{self.trace_output}' に保存しました。")
+
+        print("\n段ごとの計測結果:")
+        print(metrics.summary_table())
+        metrics.write_json(self.output)
+        print(f"計測結果を '{self.output}' に保存しました。")
+
+
+def add_profile_arguments(parser):
+    """計測関連のオプションを argparse に追加する関数"""
+    parser.add_argument('--profile', action='store_true',
+                        help='段ごとの件数・処理時間を計測し、終了時に表と JSON を出力する')
+    parser.add_argument('--profile-output', type=str, default=DEFAULT_PROFILE_OUTPUT, help='計測結果の JSON ファイル')
+    parser.add_argument('--profile-trace', choices=TRACERS, default=None,
+                        help='--profile と合わせて cProfile / pyinstrument のトレースも取得する')
+    parser.add_argument('--profile-trace-output', type=str, default=None, help='トレースの保存先')
+
+
+def profiler_from_args(args):
+    """argparse の結果から Profiler を生成して開始する関数（--profile なしなら None）"""
+    if not args.profile:
+        return None
+    profiler = Profiler(args.profile_output, args.profile_trace, args.profile_trace_output)
+    profiler.start()
+    return profiler
@@ -0,0 +1,147 @@
+# pagination.py
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import parse_qs, urlparse
+
+from crawler import BACKOFF_STATUS_CODES
+from extract import absolute_url
+from http_cache import is_offline_miss
+from instrumentation import metrics
+
+LIST_PATH = '/s/s46/diary/blog/list'
+
+
+def member_query(member_url):
+    """メンバーのブログ URL から ct（メンバーコード）と ima の値を取り出す関数"""
+    query_params = parse_qs(urlparse(member_url).query)
+    return query_params.get('ct', [''])[0], query_params.get('ima', ['0000'])[0]
+
+
+def list_page_url(ima_value, ct_value, page_num):
+    """メンバーのブログ一覧ページの URL を返す関数"""
+    return absolute_url(f"{LIST_PATH}?ima={ima_value}&page={page_num}&ct={ct_value}")
+
+
+def fetch_list_page(page_url, crawler, extractor):
+    """
+    一覧ページを取得し、(記事のパスのリスト, HTML) を返す関数（ページが無い場合は ([], None)）。
+    再試行しても取得できなかった場合（通信エラーや混雑を示すステータスコード）は例外をそのまま送出し、
+    取得できなかったページを「ページが無い」とは扱わない。
+    --cache-only でキャッシュに無いページは、キャッシュ済みの範囲の終わりとして「ページが無い」と扱う。
+    """
+    response = crawler.get(page_url)
+    if response.status_code in BACKOFF_STATUS_CODES and not is_offline_miss(response):
+        response.raise_for_status()
+    if response.status_code != 200:
+        return [], None
+    return extractor.article_links(response.text), response.text
+
+
+def bisect_last_page(has_page, low, high):
+    """low に記事があり high に無いとき、その間を二分探索して記事のある最後のページ番号を返す関数"""
+    while high - low > 1:
+        middle = (low + high) // 2
+        if has_page(middle):
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def find_last_page(has_page, known_page=0):
+    """
+    known_page に記事があるとき、記事のある最後のページ番号を返す関数。
+    known_page + 1, +2, +4, ... と間隔を倍にして記事の無いページを見つけ、その間を二分探索する。
+    has_page(n) はページ n に記事があるかを返す関数で、呼び出し回数は O(log ページ数) になる。
+    """
+    low = known_page  # 記事があると分かっている最大のページ
+    step = 1
+    while has_page(low + step):
+        low += step
+        step *= 2
+    return bisect_last_page(has_page, low, low + step)
+
+
+class ListPageDiscovery:
+    """
+    メンバーの一覧ページの数を調べ、全ページを並列に取得して記事 URL を返すクラス。
+    最後のページは1ページ目のページ送りのリンクから推定し、その先にページが続く場合
+    （ページ送りが一部しか表示されていない場合など）は find_last_page で探す。
+    調べる途中で取得したページは結果を覚えておき、もう一度取得しない
+    （取得に失敗したページは覚えずに例外を送出するので、途中で打ち切られた巡回を最後のページと取り違えない）。
+    journal（CrawlJournal）を渡すと取得したページを記録し、再開時は記録済みのページを取得し直さない
+    （新しい記事が載る1ページ目だけは毎回取得する）。
+    """
+
+    def __init__(self, crawler, extractor, ima_value, ct_value, journal=None):
+        self.crawler = crawler
+        self.extractor = extractor
+        self.ima_value = ima_value
+        self.ct_value = ct_value
+        self.journal = journal
+        self.pages = {}  # ページ番号 -> 記事のパスのリスト
+        if journal is not None:
+            for record in journal.restored('list_page', ct_value):
+                self.pages[record['key']] = record['links']
+
+    def _fetch(self, page_num):
+        if page_num not in self.pages:
+            links, _ = fetch_list_page(list_page_url(self.ima_value, self.ct_value, page_num),
+                                       self.crawler, self.extractor)
+            metrics.increment('list_pages.fetched')
+            self.pages[page_num] = links
+            if links and self.journal is not None:
+                self.journal.record('list_page', self.ct_value, page_num, links=links)
+        return self.pages[page_num]
+
+    def _has_page(self, page_num):
+        metrics.increment('list_pages.probes')
+        return bool(self._fetch(page_num))
+
+    @metrics.instrument('list_pages.discovery')
+    def last_page(self):
+        """記事のある最後のページ番号を返す（1ページ目から記事が無ければ -1）"""
+        first_url = list_page_url(self.ima_value, self.ct_value, 0)
+        links, html = fetch_list_page(first_url, self.crawler, self.extractor)
+        metrics.increment('list_pages.fetched')
+        self.pages[0] = links
+        if not links:
+            return -1
+
+        pager_pages = self.extractor.pager_pages(html)
+        candidate = max(pager_pages) if pager_pages else 0
+        if candidate > 0 and not self._has_page(candidate):
+            # ページ送りの最後のページに記事が無い場合は、その手前までを二分探索する
+            return bisect_last_page(self._has_page, 0, candidate)
+        return find_last_page(self._has_page, candidate)
+
+    def iter_links(self):
+        """全一覧ページを並列に取得し、記事の URL を取得できたページから順に返すジェネレータ"""
+        last_page = self.last_page()
+        if last_page < 0:
+            print(f"ブログ記事が見つかりませんでした: {list_page_url(self.ima_value, self.ct_value, 0)}")
+            return
+        print(f"一覧ページは {last_page + 1} ページあります（ct={self.ct_value}）。並列に取得します。")
+
+        # 調べる途中で取得済みのページから先に流し、記事の処理をすぐに始める
+        for page_num in sorted(self.pages):
+            if page_num <= last_page:
+                yield from (absolute_url(href) for href in self.pages[page_num])
+
+        remaining = [page_num for page_num in range(last_page + 1) if page_num not in self.pages]
+        if not remaining:
+            return
+        # 同時実行数とアクセス間隔は crawler が制御する
+        with ThreadPoolExecutor(max_workers=self.crawler.max_in_flight) as executor:
+            futures = {executor.submit(self._fetch, page_num): page_num for page_num in remaining}
+            for future in as_completed(futures):
+                links = future.result()
+                if not links:
+                    print(f"ブログ記事が見つかりませんでした: "
+                          f"{list_page_url(self.ima_value, self.ct_value, futures[future])}")
+                yield from (absolute_url(href) for href in links)
+
+
+def iter_all_article_links(crawler, extractor, ima_value, ct_value, journal=None):
+    """メンバーの全一覧ページを並列に取得し、記事の URL を1件ずつ返すジェネレータ"""
+    return ListPageDiscovery(crawler, extractor, ima_value, ct_value, journal).iter_links()
@@ -0,0 +1,168 @@
+# stage_pipeline.py
+
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+
+DEFAULT_QUEUE_SIZE = 8
+LATENCY_SAMPLES = 10_000  # 段ごとに保持する処理時間の件数（新しいものから）
+
+# キューの終端を表す目印
+_END = object()
+
+
+def percentile(values, q):
+    """values の q パーセンタイル（最近傍法、空なら 0.0）を返す関数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class Stage:
+    """
+    パイプラインの1段。func は入力1件を受け取り出力1件を返す（None を返すとその要素は捨てる）。
+    workers 個のスレッドで並列に実行する。
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.items = 0
+        self.dropped = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self._depth_total = 0
+        self._depth_samples = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+
+    def record(self, busy_seconds, depth, dropped):
+        with self._lock:
+            self.items += 1
+            self.dropped += dropped
+            self.busy_seconds += busy_seconds
+            self.latencies.append(busy_seconds)
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+            self._depth_total += depth
+            self._depth_samples += 1
+
+    @property
+    def mean_queue_depth(self):
+        return self._depth_total / self._depth_samples if self._depth_samples else 0.0
+
+
+class StagePipeline:
+    """
+    段と段を上限付きキューでつないだストリーミングパイプライン。
+    後段が詰まると前段が待たされる（バックプレッシャー）ので、取得・解析・推論が並行して進んでもメモリは増え続けない。
+    """
+
+    def __init__(self, stages, queue_size=DEFAULT_QUEUE_SIZE):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.elapsed_seconds = 0.0
+
+    def run(self, source):
+        """source の要素を各段に流し、最終段の出力を完了した順に返すジェネレータ"""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        remaining = [stage.workers for stage in self.stages]
+        remaining_lock = threading.Lock()
+        start = time.perf_counter()
+
+        def feed():
+            try:
+                for item in source:
+                    queues[0].put(item)
+            except Exception:
+                print("パイプラインへの入力中にエラーが発生しました。")
+                traceback.print_exc()
+            finally:
+                for _ in range(self.stages[0].workers):
+                    queues[0].put(_END)
+
+        def work(index):
+            stage = self.stages[index]
+            in_queue, out_queue = queues[index], queues[index + 1]
+            while True:
+                depth = in_queue.qsize()
+                item = in_queue.get()
+                if item is _END:
+                    break
+                busy_start = time.perf_counter()
+                try:
+                    result = stage.func(item)
+                except Exception:
+                    print(f"パイプラインの段 '{stage.name}' でエラーが発生しました。")
+                    traceback.print_exc()
+                    result = None
+                stage.record(time.perf_counter() - busy_start, depth, result is None)
+                if result is not None:
+                    out_queue.put(result)
+
+            # その段の最後のスレッドが、次の段のスレッド数だけ終端を流す
+            with remaining_lock:
+                remaining[index] -= 1
+                last = remaining[index] == 0
+            if last:
+                next_workers = self.stages[index + 1].workers if index + 1 < len(self.stages) else 1
+                for _ in range(next_workers):
+                    out_queue.put(_END)
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=work, args=(index,), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _END:
+                    break
+                yield item
+        finally:
+            self.elapsed_seconds = time.perf_counter() - start
+
+    def stats(self):
+        """段ごとの統計を辞書のリストで返す（ベンチマークの JSON 出力用）"""
+        stats = []
+        for stage in self.stages:
+            latencies = list(stage.latencies)
+            stats.append({
+                'name': stage.name,
+                'workers': stage.workers,
+                'items': stage.items,
+                'dropped': stage.dropped,
+                'busy_seconds': stage.busy_seconds,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p95_ms': percentile(latencies, 95) * 1000,
+                'mean_queue_depth': stage.mean_queue_depth,
+                'max_queue_depth': stage.max_queue_depth,
+            })
+        return stats
+
+    def report(self):
+        """段ごとの処理件数・稼働率・処理時間・キューの深さを表にした文字列を返す"""
+        lines = [f"{'段':<10}{'並列数':>6}{'件数':>8}{'破棄':>6}{'稼働時間(秒)':>14}{'稼働率':>8}"
+                 f"{'p50(ms)':>10}{'p95(ms)':>10}{'平均キュー':>10}{'最大キュー':>10}"]
+        for stage, stat in zip(self.stages, self.stats()):
+            capacity = self.elapsed_seconds * stage.workers
+            utilization = stage.busy_seconds / capacity * 100 if capacity else 0.0
+            lines.append(f"{stage.name:<10}{stage.workers:>6}{stage.items:>8}{stage.dropped:>6}"
+                         f"{stage.busy_seconds:>14.2f}{utilization:>7.1f}%{stat['p50_ms']:>10.1f}{stat['p95_ms']:>10.1f}"
+                         f"{stage.mean_queue_depth:>10.2f}{stage.max_queue_depth:>10}")
+        lines.append(f"全体の経過時間: {self.elapsed_seconds:.2f} 秒")
+        return '\n'.join(lines)
+
+
+def add_pipeline_arguments(parser):
+    """パイプラインの並列数・キューの長さのオプションを argparse に追加する関数"""
+    parser.add_argument('--fetch-workers', type=int, default=None,
+                        help='記事ページを取得するスレッド数（既定: --max-in-flight と同じ）')
+    parser.add_argument('--parse-workers', type=int, default=2, help='HTML を解析するスレッド数')
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE, help='段と段の間のキューの長さ（上限）')
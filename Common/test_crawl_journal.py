@@ -0,0 +1,38 @@
+# test_crawl_journal.py
+
+from crawl_journal import CrawlJournal
+
+
+def test_resume_keeps_only_checkpointed_records(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    positions = iter(range(100))
+    journal = CrawlJournal(path, sync_records=2, sync_seconds=3600, checkpoint_hook=lambda: next(positions))
+    journal.commit(force=True)
+    for article_id in range(5):
+        journal.record('article', '01', article_id, date='2024/11/03')
+        journal.commit()
+    # 中断を再現する: 5件目は fsync されておらず、書きかけの行が残っている
+    journal._file.write('{"type": "article", "mem')
+    journal._file.flush()
+
+    resumed = CrawlJournal(path, resume=True)
+    assert resumed.done('article', '01') == {0, 1, 2, 3}
+    assert resumed.done('article', '02') == set()
+    assert resumed.last_checkpoint['state'] == 2
+    assert resumed.restored('article', '01')[0]['date'] == '2024/11/03'
+
+    # 再開後の記録は既存の記録に続けて追記される
+    resumed.record('article', '01', 4)
+    resumed.close()
+    assert CrawlJournal(path, resume=True).done('article', '01') == {0, 1, 2, 3, 4}
+
+
+def test_new_run_starts_an_empty_journal(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = CrawlJournal(path)
+    journal.record('list_page', '01', 0, links=['/s/s46/diary/detail/1'])
+    journal.close()
+
+    assert CrawlJournal(path, resume=True).restored('list_page', '01')[0]['links'] == ['/s/s46/diary/detail/1']
+    CrawlJournal(path).close()
+    assert CrawlJournal(path, resume=True).records == []
@@ -0,0 +1,102 @@
+# test_extract_parity.py
+
+import os
+
+import pytest
+
+pytest.importorskip('bs4')
+from bs4 import BeautifulSoup
+
+from extract import HTML_BACKENDS, get_extractor
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURE_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+
+# 以下は抽出レイヤー導入前にスクレイパーが html.parser で行っていた処理（比較の基準）
+def legacy_member_links(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    member_links = []
+    for member in soup.select('ul.com-blog-circle li a'):
+        name_tag = member.select_one('p.name')
+        if not name_tag:
+            continue
+        member_links.append((name_tag.get_text().strip(), member['href']))
+    return member_links
+
+
+def legacy_article_links(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    return [a.get('href', '') for a in soup.select('ul.com-blog-part li.box a') if a.get('href', '')]
+
+
+def legacy_articles(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    articles = []
+    for article in soup.select('article.post'):
+        year_element = article.find('span', {'class': 'ym-year'})
+        month_element = article.find('span', {'class': 'ym-month'})
+        day_element = article.find('p', {'class': 'date wf-a'})
+        if year_element and month_element and day_element:
+            year = year_element.get_text().strip()
+            month = month_element.get_text().strip().zfill(2)
+            day = day_element.get_text().strip().zfill(2)
+            date = f"{year}/{month}/{day}"
+        else:
+            date = None
+        content_div = article.select_one('div.box-article')
+        articles.append({
+            'text': content_div.get_text(separator="\n", strip=True) if content_div else None,
+            'date': date,
+            'images': [img.get('src') for img in article.select('div.box-article img') if img.get('src')],
+        })
+    return articles
+
+
+def available_extractors():
+    extractors = []
+    for backend in HTML_BACKENDS:
+        if backend == 'auto':
+            continue
+        for targeted in (False, True):
+            try:
+                extractors.append(get_extractor(backend, targeted))
+            except ImportError:
+                continue
+    return extractors
+
+
+@pytest.mark.parametrize('extractor', available_extractors(), ids=lambda extractor: extractor.name)
+def test_member_links_match_legacy(extractor):
+    html = read_fixture('member_list.html')
+    assert extractor.member_links(html) == legacy_member_links(html)
+
+
+@pytest.mark.parametrize('extractor', available_extractors(), ids=lambda extractor: extractor.name)
+def test_article_links_match_legacy(extractor):
+    html = read_fixture('blog_list.html')
+    assert extractor.article_links(html) == legacy_article_links(html)
+
+
+@pytest.mark.parametrize('extractor', available_extractors(), ids=lambda extractor: extractor.name)
+def test_articles_match_legacy(extractor):
+    html = read_fixture('blog_detail.html')
+    assert extractor.articles(html) == legacy_articles(html)
+
+
+def test_fixtures_are_not_trivial():
+    assert len(legacy_member_links(read_fixture('member_list.html'))) == 3
+    assert len(legacy_article_links(read_fixture('blog_list.html'))) == 3
+    article, = legacy_articles(read_fixture('blog_detail.html'))
+    assert article['date'] == '2024/11/03'
+    assert len(article['images']) == 2
+
+
+@pytest.mark.parametrize('extractor', available_extractors(), ids=lambda extractor: extractor.name)
+def test_pager_pages(extractor):
+    assert extractor.pager_pages(read_fixture('blog_list.html')) == [0, 1, 2]
+    assert extractor.pager_pages(read_fixture('blog_detail.html')) == []
@@ -0,0 +1,30 @@
+# test_http_cache.py
+
+import requests
+
+from http_cache import HttpCache
+
+
+def _response(body):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = body
+    response.encoding = 'utf-8'
+    return response
+
+
+def test_hits_do_not_write_but_still_order_eviction(tmp_path):
+    cache = HttpCache(str(tmp_path / 'http_cache.sqlite3'), max_bytes=250)
+    cache.store('http://example/a', _response(b'a' * 100))
+    cache.store('http://example/b', _response(b'b' * 100))
+
+    # キャッシュヒットのたびには書き込まない
+    changes = cache._conn.total_changes
+    assert cache.lookup('http://example/a')['body'] == b'a' * 100
+    assert cache._conn.total_changes == changes
+
+    # ためていた参照時刻は次の保存で書き込まれ、最近参照した a ではなく b が削除される
+    cache.store('http://example/c', _response(b'c' * 100))
+    assert cache.lookup('http://example/a') is not None
+    assert cache.lookup('http://example/b') is None
+    cache.close()
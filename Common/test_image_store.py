@@ -0,0 +1,76 @@
+# test_image_store.py
+
+import os
+
+import pytest
+
+import image_store
+from image_store import ImageStore, unique_image_names
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def _download(store, data, extension='.jpg'):
+    return _write(store.temp_path(extension), data)
+
+
+def test_identical_images_share_one_blob(tmp_path):
+    store = ImageStore(str(tmp_path / 'store'))
+    first = store.add(_download(store, b'photo'), 'http://example/1.jpg', '井上 梨名', 1, '2024/12/25', 'a_1')
+    second = store.add(_download(store, b'photo'), 'http://example/2.jpg', '井上 梨名', 2, '2024/12/26', 'b_1')
+
+    assert first.new and not second.new
+    assert second.sha256 == first.sha256 and second.name == 'a_1'
+    assert os.listdir(os.path.join(store.root, 'tmp')) == []
+    assert store.has_source('http://example/2.jpg') and not store.has_source('http://example/3.jpg')
+    assert store.source_count() == 2
+    assert store.unique_images('井上 梨名') == [('a_1', first.path)]
+    assert store.content_by_name() == {'a_1': (first.sha256, None), 'b_1': (first.sha256, None)}
+    store.close()
+
+    # マニフェストは次の実行でもそのまま使える
+    reopened = ImageStore(str(tmp_path / 'store'))
+    assert reopened.has_source('http://example/1.jpg')
+    assert reopened.members() == ['井上 梨名']
+    reopened.close()
+
+
+def test_near_duplicates_are_flagged(tmp_path, monkeypatch):
+    Image = pytest.importorskip('PIL.Image')
+
+    def photo(path, size, reverse):
+        image = Image.new('L', (64, 48))
+        image.putdata([(255 - x * 4 if reverse else x * 4) for y in range(48) for x in range(64)])
+        image.resize(size).save(path, format='JPEG', quality=90)
+        return path
+
+    store = ImageStore(str(tmp_path / 'store'), near_duplicates=True)
+    original = store.add(photo(store.temp_path('.jpg'), (64, 48), False), 'http://example/1.jpg', 'm', 1, None, 'a')
+    resized = store.add(photo(store.temp_path('.jpg'), (128, 96), False), 'http://example/2.jpg', 'm', 2, None, 'b')
+    other = store.add(photo(store.temp_path('.jpg'), (64, 48), True), 'http://example/3.jpg', 'm', 3, None, 'c')
+
+    assert resized.new and resized.duplicate_of == original.sha256
+    assert other.duplicate_of is None
+    assert [name for name, _ in store.unique_images()] == ['a', 'c']
+    assert store.is_duplicate_name('b') and not store.is_duplicate_name('a')
+
+    # 後続の処理では、似た画像から作った PNG や切り抜いた顔も同じ内容のファイルも除く
+    data_dir = tmp_path / 'faces'
+    data_dir.mkdir()
+    _write(str(data_dir / 'a_face_0.jpg'), b'face')
+    _write(str(data_dir / 'a_face_1.jpg'), b'face')
+    _write(str(data_dir / 'b_face_0.jpg'), b'other face')
+    _write(str(data_dir / 'x_face_0.jpg'), b'unknown face')
+    _write(str(data_dir / 'y_face_0.jpg'), b'unknown face')
+
+    # SHA-256 を求めるのはマニフェストに無い名前のファイルだけ
+    hashed = []
+    sha256_file = image_store.sha256_file
+    monkeypatch.setattr(image_store, 'sha256_file', lambda path: hashed.append(path) or sha256_file(path))
+    assert unique_image_names(str(data_dir), store) == ['a_face_0.jpg', 'a_face_1.jpg', 'x_face_0.jpg']
+    assert sorted(os.path.basename(path) for path in hashed) == ['x_face_0.jpg', 'y_face_0.jpg']
+    store.close()
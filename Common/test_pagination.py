@@ -0,0 +1,119 @@
+# test_pagination.py
+
+import pytest
+import requests
+
+from crawler import Crawler
+from http_cache import HttpCache
+from pagination import ListPageDiscovery, find_last_page, list_page_url
+
+
+@pytest.mark.parametrize('last_page, known_page', [
+    (last_page, known_page)
+    for last_page in [0, 1, 2, 3, 7, 8, 100, 1234]
+    for known_page in [0, 3]
+    if known_page <= last_page  # known_page には記事があることが前提
+])
+def test_find_last_page(last_page, known_page):
+    probes = []
+
+    def has_page(page_num):
+        probes.append(page_num)
+        return page_num <= last_page
+
+    assert find_last_page(has_page, known_page) == last_page
+    # 1ページずつ調べるのではなく O(log ページ数) 回で見つける
+    assert len(probes) <= 2 * (last_page + 2).bit_length() + 1
+
+
+class FakeResponse:
+    def __init__(self, status_code, text=''):
+        self.status_code = status_code
+        self.text = text
+        self.headers = {}
+
+    def raise_for_status(self):
+        raise requests.HTTPError(f"{self.status_code} Error")
+
+
+class FakeCrawler:
+    """ページ番号 0..last_page に記事がある一覧を返す crawler。failing のページは混雑（503）を返す"""
+
+    max_in_flight = 2
+
+    def __init__(self, last_page, pager_pages=(), failing=()):
+        self.last_page = last_page
+        self.pager_pages = pager_pages
+        self.failing = set(failing)
+        self.requested = []
+
+    def get(self, url):
+        page_num = int(url.split('page=')[1].split('&')[0])
+        self.requested.append(page_num)
+        if page_num in self.failing:
+            return FakeResponse(503)
+        if page_num > self.last_page:
+            return FakeResponse(404)
+        return FakeResponse(200, f"{page_num}|{','.join(map(str, self.pager_pages))}")
+
+
+class FakeExtractor:
+    def article_links(self, html):
+        return [f"/s/s46/diary/detail/{html.split('|')[0]}"]
+
+    def pager_pages(self, html):
+        pages = html.split('|')[1]
+        return [int(page) for page in pages.split(',')] if pages else []
+
+
+def _article_ids(links):
+    return sorted(int(link.rsplit('/', 1)[1]) for link in links)
+
+
+def test_pager_links_give_last_page():
+    # ページ送りに最後のページまで表示されていれば、その先を1回確かめるだけで済む
+    crawler = FakeCrawler(last_page=5, pager_pages=[1, 2, 3, 4, 5])
+    discovery = ListPageDiscovery(crawler, FakeExtractor(), '0000', '01')
+    assert discovery.last_page() == 5
+    assert crawler.requested == [0, 5, 6]
+    assert _article_ids(discovery.iter_links()) == list(range(6))
+
+
+def test_pager_beyond_archive_falls_back_to_bisect():
+    # ページ送りの最後のページに記事が無い場合は、その手前までを二分探索する
+    crawler = FakeCrawler(last_page=6, pager_pages=[1, 2, 20])
+    discovery = ListPageDiscovery(crawler, FakeExtractor(), '0000', '01')
+    assert discovery.last_page() == 6
+    assert crawler.requested[:2] == [0, 20]
+    assert len(crawler.requested) <= 2 + (20).bit_length()
+
+
+def test_failing_probe_is_not_treated_as_missing_page():
+    # 二分探索の途中で取得に失敗しても、そのページを「記事が無い」として覚えない
+    crawler = FakeCrawler(last_page=6, pager_pages=[1, 2, 20], failing={10})
+    discovery = ListPageDiscovery(crawler, FakeExtractor(), '0000', '01')
+    with pytest.raises(requests.HTTPError):
+        discovery.last_page()
+    assert 10 in crawler.requested and 10 not in discovery.pages
+
+    crawler.failing.clear()
+    assert discovery.last_page() == 6
+    assert crawler.requested.count(10) == 2
+
+
+def test_cache_only_stops_at_uncached_page(tmp_path):
+    # --cache-only ではキャッシュに無いページ（最後のページの次など）を「ページが無い」として扱い、例外にしない
+    cache = HttpCache(str(tmp_path / 'http_cache.sqlite3'))
+    for page_num in range(6):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = f"{page_num}|1,2".encode('utf-8')
+        response.encoding = 'utf-8'
+        cache.store(list_page_url('0000', '01', page_num), response)
+    cache.cache_only = True
+
+    crawler = Crawler(cache=cache)
+    discovery = ListPageDiscovery(crawler, FakeExtractor(), '0000', '01')
+    assert _article_ids(discovery.iter_links()) == list(range(6))
+    assert cache.misses > 0
+    crawler.close()
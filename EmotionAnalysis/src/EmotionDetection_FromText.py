@@ -1,99 +1,50 @@
 # EmotionDetection_FromText.py
 
 import os
+import sys
 import requests
-from bs4 import BeautifulSoup
-import time
-import random
 import argparse
-from urllib.parse import urlparse, parse_qs
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
-from dotenv import load_dotenv
+import multiprocessing
 import re
+import time
 import traceback
-from fugashi import Tagger  # fugashiをインポート
-import torch  # torchをインポート
-import matplotlib.pyplot as plt  # matplotlib をインポート
+from sentence_splitter import SentenceSplitter, MODES as SPLIT_MODES
+from inference_cache import DEFAULT_CACHE_PATH as DEFAULT_INFERENCE_CACHE_PATH
+# モデル（torch / transformers）は初めて感情分析を行うときに emotion_model がロードする
+from emotion_model import (
+    DEFAULT_BATCH_SIZE, DEFAULT_MAX_TOKENS_PER_BATCH, DEFAULT_WINDOW_OVERLAP, POOLING_METHODS, backend_report,
+    cascade_report, classify_article, classify_emotions, close_inference_cache, configure_backend, configure_cascade,
+    configure_inference_cache, configure_model_snapshot, load_model, model_name,
+)
+from inference_backends import BACKENDS, DEFAULT_BACKEND, add_compile_arguments, compile_options_from_args
+from model_snapshot import add_snapshot_arguments, snapshot_from_args
+from ngram_cascade import add_cascade_arguments, cascade_from_args
+from results_sink import (
+    add_output_arguments, has_results, load_results, open_sink, output_path_for, rollback_sink, sentence_rows,
+)
+from emotion_aggregator import EmotionAggregator, aggregate_results
+
+# 共通モジュール（リポジトリ直下の Common/）を読み込めるようにする
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from crawler import add_crawler_arguments, crawler_from_args
+from stage_pipeline import DEFAULT_QUEUE_SIZE, Stage, StagePipeline, add_pipeline_arguments
+from article_index import add_incremental_arguments, article_id_from_url, index_from_args
+from extract import absolute_url, add_extract_arguments, extractor_from_args
+from pagination import iter_all_article_links, list_page_url, member_query
+from crawl_journal import add_journal_arguments, journal_from_args
+from instrumentation import add_profile_arguments, metrics, profiler_from_args
 
 # TensorFlow のログを抑制
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
-# .envファイルを読み込む
-load_dotenv()
-
-# 環境変数からアクセストークンを取得（必要な場合）
-access_token = os.getenv('HF_ACCESS_TOKEN')
-
-# 使用する感情分析モデル
-model_name = "koshin2001/Japanese-to-emotions"
-
-# モデルとトークナイザーをロード
-try:
-    print("モデルとトークナイザーをロード中...")
-    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
-    model = AutoModelForSequenceClassification.from_pretrained(model_name)
-    model.eval()  # 評価モードに設定
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model.to(device)
-    print("モデルとトークナイザーのロードに成功しました。")
-except Exception as e:
-    print("感情分析モデルのロードに失敗しました。環境・ネットワーク状態を確認してください。")
-    traceback.print_exc()
-    exit(1)
-
-# モデルのラベル一覧を表示
-labels = model.config.id2label
-print("\nモデルのラベル一覧:")
-for idx, label in labels.items():
-    print(f"{idx}: {label}")
-
-# 感情ラベルの意味を定義
-label_meanings = {
-    'LABEL_0': '喜び',
-    'LABEL_1': '怒り',
-    'LABEL_2': '悲しみ',
-    'LABEL_3': '驚き',
-    'LABEL_4': '中立',
-    'LABEL_5': '恐れ',
-    'LABEL_6': '疲労',
-    'LABEL_7': 'その他'
-}
-
-# 感情分析関数の定義
-def classify_emotion(sentence):
-    try:
-        # トークナイズ（token_type_ids を生成しない）
-        inputs = tokenizer(sentence, return_tensors="pt", truncation=True, max_length=512, padding=True)
-        # 'token_type_ids' を除外
-        inputs = {k: v.to(device) for k, v in inputs.items() if k != 'token_type_ids'}
-
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits = outputs.logits
-            probabilities = torch.softmax(logits, dim=1)
-            scores, predicted = torch.max(probabilities, dim=1)
-            label = labels[predicted.item()]
-            meaning = label_meanings.get(label, 'その他')
-            score = scores.item()
-            return {'label': meaning, 'score': score}
-    except Exception as e:
-        print(f"感情分析中にエラーが発生しました: 文: {sentence}")
-        traceback.print_exc()
-        return None
+# 文分割関数の定義（モードごとの分割エンジンを使い回す）
+_splitters = {}
 
-# 文分割関数の定義（fugashiを使用）
-def split_sentences(text):
-    tagger = Tagger()
-    sentences = []
-    current_sentence = ""
-    for word in tagger(text):
-        current_sentence += word.surface
-        if word.surface in '。！？':  # 句点、感嘆符、疑問符で文を分割
-            sentences.append(current_sentence)
-            current_sentence = ""
-    if current_sentence:
-        sentences.append(current_sentence)
-    return sentences
+def split_sentences(text, mode='regex'):
+    """文を1つずつ返すジェネレータ（'morph' モードのみ fugashi を使用）"""
+    if mode not in _splitters:
+        _splitters[mode] = SentenceSplitter(mode)
+    return _splitters[mode].split(text)
 
 def clean_text(text):
     text = text.replace('\u3000', ' ')
@@ -101,28 +52,15 @@ def clean_text(text):
     text = text.strip()
     return text
 
-def get_member_list(base_url):
+@metrics.instrument('get_member_list')
+def get_member_list(base_url, crawler, extractor):
     try:
-        headers = {'User-Agent': 'Mozilla/5.0'}
         print(f"\nメンバー一覧ページを取得中: {base_url}")
-        response = requests.get(base_url, headers=headers, timeout=10)
+        response = crawler.get(base_url)
         response.raise_for_status()
 
-        soup = BeautifulSoup(response.text, 'html.parser')
-        members = soup.select('ul.com-blog-circle li a')
-
-        if not members:
-            print("メンバーリストが取得できませんでした。サイト構造が変わった可能性があります。")
-            return []
-
-        member_links = []
-        for member in members:
-            name_tag = member.select_one('p.name')
-            if not name_tag:
-                continue
-            member_name = name_tag.get_text().strip()
-            member_url = f"https://sakurazaka46.com{member['href']}"
-            member_links.append((member_name, member_url))
+        member_links = [(member_name, absolute_url(href))
+                        for member_name, href in extractor.member_links(response.text)]
 
         if not member_links:
             print("メンバー名とURLが取得できませんでした。サイト構造が変わった可能性があります。")
@@ -143,163 +81,230 @@ def get_member_list(base_url):
         traceback.print_exc()
         return []
 
-def scrape_blog_page(blog_url, output_file):
+@metrics.instrument('fetch_blog_page')
+def fetch_blog_page(blog_url, crawler):
+    """記事ページの HTML を取得する関数（失敗時は None）"""
     try:
-        headers = {'User-Agent': 'Mozilla/5.0'}
         print(f"\nブログページを取得中: {blog_url}")
-        response = requests.get(blog_url, headers=headers, timeout=10)
+        response = crawler.get(blog_url)
         response.raise_for_status()
+        return response.text
+    except requests.RequestException as e:
+        print(f"記事ページの取得中にネットワークエラーが発生しました: {blog_url}")
+        traceback.print_exc()
+        return None
 
-        bs4_blog = BeautifulSoup(response.text, 'html.parser')
-        article = bs4_blog.select_one('article.post')
-
-        if not article:
-            print(f"記事が見つかりませんでした: {blog_url}")
-            return []
-
-        content_div = article.select_one('div.box-article')
-        if not content_div:
-            print(f"本文が見つかりませんでした: {blog_url}")
-            return []
-
-        content_text = content_div.get_text(separator="\n", strip=True)
-        content_text = clean_text(content_text)
-
-        try:
-            sentences = split_sentences(content_text)
-        except Exception as e:
-            print(f"文分割中にエラーが発生しました: {blog_url}")
-            traceback.print_exc()
-            return []
+@metrics.instrument('parse_html')
+def extract_blog_article(blog_url, html, extractor):
+    """記事ページの HTML から (整形した本文, 投稿日) を取り出す関数（本文が見つからなければ None）"""
+    articles = extractor.articles(html)
 
-        if not sentences:
-            print(f"この記事は本文が空か分割できませんでした: {blog_url}")
-            return []
+    if not articles:
+        print(f"記事が見つかりませんでした: {blog_url}")
+        return None
 
-        # 各文について感情分析を実行
-        results = []
-        for sentence in sentences:
-            if not sentence.strip():
-                continue
-            try:
-                res = classify_emotion(sentence)
-                if res:
-                    results.append(res)
-                    # ファイルに書き込む
-                    output_file.write(f"文: {sentence}\n")
-                    output_file.write(f"感情: {res['label']}, スコア: {res['score']}\n\n")
-            except Exception as e:
-                print(f"感情分析中にエラーが発生しました: {blog_url}, 文: {sentence}")
-                traceback.print_exc()
-                continue
+    content_text = articles[0]['text']
+    if content_text is None:
+        print(f"本文が見つかりませんでした: {blog_url}")
+        return None
 
-        return results
+    return clean_text(content_text), articles[0]['date']
 
-    except requests.RequestException as e:
-        print(f"記事ページの取得中にネットワークエラーが発生しました: {blog_url}")
-        traceback.print_exc()
-        return []
+@metrics.instrument('split_sentences')
+def segment_blog_text(blog_url, content_text, split_mode='regex'):
+    """本文を文に分割する関数（空の文を除いたリスト、分割できなければ None）"""
+    try:
+        # 空の文を除きつつ、記事ごとに1回だけリスト化する
+        sentences = [sentence for sentence in split_sentences(content_text, split_mode) if sentence.strip()]
     except Exception as e:
-        print(f"記事解析中に予期せぬエラーが発生しました: {blog_url}")
+        print(f"文分割中にエラーが発生しました: {blog_url}")
         traceback.print_exc()
-        return []
+        return None
 
-def scrape_all_blogs(member_url, output_file):
-    parsed_url = urlparse(member_url)
-    query_params = parse_qs(parsed_url.query)
-    ct_value = query_params.get('ct', [''])[0]
-    ima_value = query_params.get('ima', ['0000'])[0]
+    if not sentences:
+        print(f"この記事は本文が空か分割できませんでした: {blog_url}")
+        return None
+    return sentences
 
-    # 感情ラベル -> ポジ・ネガ・中立マッピング
-    # 使用するモデルに応じてラベルを確認し、マッピングを調整してください
-    # 以下はテスト結果に基づく仮のマッピングです。実際のラベルに基づいて調整してください。
-    positive_labels = {'LABEL_0'}    # 喜び、幸福
-    negative_labels = {'LABEL_1', 'LABEL_2'}    # 怒り、悲しみ
-    neutral_labels = {'LABEL_3', 'LABEL_4', 'LABEL_5', 'LABEL_6', 'LABEL_7'}  # 驚き、中立、恐れ、疲労、その他
+@metrics.instrument('classify_emotion')
+def classify_blog_sentences(blog_url, sentences, batch_size=DEFAULT_BATCH_SIZE,
+                            max_tokens_per_batch=DEFAULT_MAX_TOKENS_PER_BATCH):
+    """記事内の文をまとめてバッチで感情分析する関数（失敗時は None）"""
+    try:
+        return classify_emotions(sentences, batch_size, max_tokens_per_batch)
+    except Exception as e:
+        print(f"感情分析中にエラーが発生しました: {blog_url}")
+        traceback.print_exc()
+        return None
 
-    # 集計用
-    total_positive = 0.0
-    total_negative = 0.0
-    total_neutral = 0.0
+@metrics.instrument('classify_article')
+def classify_blog_article(blog_url, sentences, batch_size=DEFAULT_BATCH_SIZE,
+                          max_tokens_per_batch=DEFAULT_MAX_TOKENS_PER_BATCH, window_overlap=DEFAULT_WINDOW_OVERLAP,
+                          window_pooling='mean'):
+    """記事全体をウィンドウに分けて感情分析し、記事1件分の結果を返す関数（失敗時は None）"""
+    try:
+        return classify_article(sentences, batch_size, max_tokens_per_batch, window_overlap, window_pooling)
+    except Exception as e:
+        print(f"感情分析中にエラーが発生しました: {blog_url}")
+        traceback.print_exc()
+        return None
 
-    # 全ての結果を保存（オプション）
-    all_results = []
+def write_blog_results(sink, member_name, blog_url, date, sentences, emotions):
+    """感情分析の結果を1文1行でシンクに書き込み、成功した文の結果のリストを返す関数"""
+    with metrics.timed('write_results'):
+        sink.write_rows(sentence_rows(member_name, article_id_from_url(blog_url), blog_url, date, sentences, emotions))
+    metrics.increment('articles')
+    return [res for res in emotions if res]
+
+def iter_blog_links(member_url, crawler, extractor, article_index=None, journal=None):
+    """
+    記事の URL を1件ずつ返すジェネレータ。通常は最後の一覧ページを調べてから全ページを並列に取得し、
+    インクリメンタルモードでは処理済みの記事に当たった時点で止められるよう1ページずつたどる。
+    """
+    ct_value, ima_value = member_query(member_url)
+    if article_index is None:
+        yield from iter_all_article_links(crawler, extractor, ima_value, ct_value, journal)
+        return
 
     page_num = 0
     while True:
-        page_url = f"https://sakurazaka46.com/s/s46/diary/blog/list?ima={ima_value}&page={page_num}&ct={ct_value}"
+        page_url = list_page_url(ima_value, ct_value, page_num)
         print(f"\nページをスクレイピング中: {page_url}")
 
         try:
-            headers = {'User-Agent': 'Mozilla/5.0'}
-            response = requests.get(page_url, headers=headers, timeout=10)
+            response = crawler.get(page_url)
             if response.status_code != 200:
                 print(f"ページが存在しませんでした（ステータスコード:{response.status_code}）: {page_url}")
-                break
+                return
         except requests.RequestException as e:
             print(f"ブログ一覧ページ取得中にネットワークエラーが発生しました: {page_url}")
             traceback.print_exc()
-            break
+            return
         except Exception as e:
             print(f"ブログ一覧ページ取得中に予期せぬエラーが発生しました: {page_url}")
             traceback.print_exc()
-            break
+            return
 
         try:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            articles = soup.select('ul.com-blog-part li.box a')
-            if not articles:
+            blog_links = [absolute_url(href) for href in extractor.article_links(response.text)]
+            if not blog_links:
                 print(f"ブログ記事が見つかりませんでした: {page_url}")
-                break
-
-            blog_links = []
-            for article in articles:
-                href = article.get('href', '')
-                if href:
-                    blog_link = f"https://sakurazaka46.com{href}"
-                    blog_links.append(blog_link)
+                return
 
+            # 処理済みの記事を除き、1ページすべて処理済みなら巡回を終える
+            known_ids = article_index.known_ids(ct_value)
+            blog_links = [blog_url for blog_url in blog_links if article_id_from_url(blog_url) not in known_ids]
             if not blog_links:
-                print(f"このページにはブログ記事がありません: {page_url}")
-                break
-
-            # 各ブログ記事を解析
-            for blog_url in blog_links:
-                print(f"\nブログをスクレイピング中: {blog_url}")
-                results = scrape_blog_page(blog_url, output_file)
-                # results: [{'label': emotion_label, 'score': score}, ...]
-                all_results.extend(results)
-
-                for res in results:
-                    label = res['label'].upper()  # ラベルを大文字に統一
-                    score = res['score']
-                    if label in positive_labels:
-                        total_positive += score
-                    elif label in negative_labels:
-                        total_negative += score
-                    elif label in neutral_labels:
-                        total_neutral += score
-                    else:
-                        # 不明なラベルは中立として扱う
-                        total_neutral += score
-
-                # 過剰なアクセス防止のためのスリープ
-                time.sleep(random.uniform(2, 5))
-
-            page_num += 1
-            # 次のページへ行く前にスリープ
-            time.sleep(random.uniform(2, 5))
+                print(f"このページの記事はすべて処理済みのため、巡回を終了します: {page_url}")
+                return
 
         except Exception as e:
             print(f"ブログ一覧解析中に予期せぬエラーが発生しました: {page_url}")
             traceback.print_exc()
-            break
-
-    return total_positive, total_negative, total_neutral
+            return
+
+        yield from blog_links
+        page_num += 1
+
+def scrape_all_blogs(member_url, sink, member_name, crawler, extractor, aggregator, batch_size=DEFAULT_BATCH_SIZE,
+                     max_tokens_per_batch=DEFAULT_MAX_TOKENS_PER_BATCH, split_mode='regex', article_index=None,
+                     fetch_workers=None, parse_workers=2, queue_size=DEFAULT_QUEUE_SIZE, granularity='sentence',
+                     window_overlap=DEFAULT_WINDOW_OVERLAP, window_pooling='mean', journal=None):
+    """
+    メンバーの全記事を解析して aggregator に加算し、(ポジ, ネガ, 中立) の合計を返す関数。
+    granularity='article' の場合は記事全体を1つの結果にまとめ、シンクにも記事ごとに1行だけ書き込む。
+    journal（CrawlJournal）を渡すと完了した記事と集計を記録し、記録済みの記事は処理しない。
+    """
+    ct_value, _ = member_query(member_url)
+    done_ids = journal.done('article', ct_value) if journal is not None else set()
+
+    # 記事ページの取得と解析にかかった時間（キューでの待ち時間を除く）を記事ごとに 'scrape_blog_page' に記録する
+    fetch_seconds = {}
+
+    # 各段は (URL, 投稿日, 値) の組を受け取り、失敗した記事は None を返して後段に流さない
+    def fetch(blog_url):
+        start = time.perf_counter()
+        html = fetch_blog_page(blog_url, crawler)
+        if html is None:
+            return None
+        fetch_seconds[blog_url] = time.perf_counter() - start
+        return blog_url, None, html
+
+    def parse(item):
+        blog_url, _, html = item
+        start = time.perf_counter()
+        article = extract_blog_article(blog_url, html, extractor)
+        metrics.observe('scrape_blog_page', fetch_seconds.pop(blog_url, 0.0) + time.perf_counter() - start)
+        return None if article is None else (blog_url, article[1], article[0])
+
+    def segment(item):
+        blog_url, date, content_text = item
+        sentences = segment_blog_text(blog_url, content_text, split_mode)
+        return None if sentences is None else (blog_url, date, sentences)
+
+    def infer(item):
+        blog_url, date, sentences = item
+        if granularity == 'article':
+            result = classify_blog_article(
+                blog_url, sentences, batch_size, max_tokens_per_batch, window_overlap, window_pooling)
+            return None if result is None else (blog_url, date, [''.join(sentences)], [result])
+        emotions = classify_blog_sentences(blog_url, sentences, batch_size, max_tokens_per_batch)
+        return None if emotions is None else (blog_url, date, sentences, emotions)
+
+    # 取得 → 解析 → 文分割 → 推論 を上限付きキューでつなぎ、ネットワーク待ちと推論を並行させる
+    pipeline = StagePipeline([
+        Stage('fetch', fetch, fetch_workers or crawler.max_in_flight),
+        Stage('parse', parse, parse_workers),
+        Stage('segment', segment),
+        Stage('infer', infer),
+    ], queue_size)
+
+    # ファイルへの書き込みと集計は呼び出し元のスレッドだけで行う
+    blog_links = iter_blog_links(member_url, crawler, extractor, article_index, journal)
+    if done_ids:
+        print(f"ジャーナルに記録済みの {len(done_ids)} 記事はスキップします。")
+        blog_links = (blog_url for blog_url in blog_links if article_id_from_url(blog_url) not in done_ids)
+    for blog_url, date, sentences, emotions in pipeline.run(blog_links):
+        print(f"\nブログを解析しました: {blog_url}")
+        # results: [{'label': emotion_label, 'label_id': id, 'score': score, 'probabilities': ndarray}, ...]
+        results = write_blog_results(sink, member_name, blog_url, date, sentences, emotions)
+        article_id = article_id_from_url(blog_url)
+        # 結果は記事ごとの合計に畳み込み、文ごとの結果はメモリに残さない
+        summary = aggregator.add_results(member_name, article_id, date, results)
+        if article_index is not None and article_id is not None:
+            article_index.mark_processed(ct_value, article_id)
+        if journal is not None and summary is not None and article_id is not None:
+            # 再開時に集計を復元できるよう、記事ごとの合計も記録する
+            journal.record('article', ct_value, article_id, date=date, sentences=summary['sentences'],
+                           probabilities=summary['probabilities'].tolist(),
+                           polarity_scores=summary['polarity_scores'].tolist())
+            journal.commit()
+
+    print("\nパイプラインの段ごとの統計:")
+    print(pipeline.report())
+
+    return aggregator.totals(member_name)
+
+def trend_path_for(member_name):
+    """メンバー名から月ごとの感情の推移を書き出すファイル名を返す関数"""
+    return f"{member_name.replace(' ', '')}_EmotionTrend.tsv"
+
+def reaggregate(paths, trend_filename='Reaggregated_EmotionTrend.tsv'):
+    """保存済みの結果（JSONL / Parquet）だけから集計し直す関数（モデルは使わない）"""
+    aggregator = aggregate_results(paths)
+    print(f"{aggregator.articles} 記事分の結果を集計しました。")
+    for member_name, running_sum in aggregator.members.items():
+        print(f"\n{member_name}（{running_sum.sentences} 文）")
+        print_sentiment_totals(*aggregator.totals(member_name))
+    aggregator.write_trend(trend_filename)
+    print(f"\n月ごとの感情の推移を '{trend_filename}' に保存しました。")
+    return aggregator.totals()
 
 # Plotting the sentiment scores
 def plot_sentiment(positive, negative, neutral):
     try:
+        import matplotlib.pyplot as plt  # グラフを描くときだけ読み込む
+
         labels_plot = ['ポジティブ', 'ネガティブ', 'ニュートラル']
         scores = [positive, negative, neutral]
         colors = ['green', 'red', 'gray']
@@ -324,54 +329,268 @@ def plot_sentiment(positive, negative, neutral):
         print("感情分析結果のグラフ描画中にエラーが発生しました。")
         traceback.print_exc()
 
+def print_sentiment_totals(total_positive, total_negative, total_neutral):
+    total = total_positive + total_negative + total_neutral
+    print(f"ポジティブスコア合計: {total_positive:.2f}")
+    print(f"ネガティブスコア合計: {total_negative:.2f}")
+    print(f"ニュートラルスコア合計: {total_neutral:.2f}")
+
+    if total > 0:
+        positive_ratio = (total_positive / total) * 100
+        negative_ratio = (total_negative / total) * 100
+        neutral_ratio = (total_neutral / total) * 100
+        print(f"ポジティブ割合: {positive_ratio:.2f}%")
+        print(f"ネガティブ割合: {negative_ratio:.2f}%")
+        print(f"ニュートラル割合: {neutral_ratio:.2f}%")
+    else:
+        print("スコアの合計が0のため、割合を計算できません。")
+
+def load_previous_results(output_filename, ct_value, article_index):
+    """
+    追記先の出力にある過去の実行の結果を集計した EmotionAggregator を返す関数。
+    出力にある記事は処理済みインデックスにも登録し、インデックスの無い通常の実行のあとで
+    初めてインクリメンタルモードを使う場合でも、同じ記事を処理し直して行を重複させない。
+    """
+    frame = load_results(output_filename)
+    aggregator = EmotionAggregator()
+    aggregator.add_frame(frame)
+    print(f"{aggregator.articles} 記事分の過去の結果を '{output_filename}' から集計しました。")
+
+    article_ids = {int(article_id) for article_id in frame['article_id'].dropna()}
+    missing = article_ids - article_index.known_ids(ct_value)
+    if missing:
+        article_index.mark_all_processed(ct_value, sorted(missing))
+        print(f"出力にある {len(missing)} 記事を処理済みとしてインデックスに登録しました。")
+    return aggregator
+
+def analyze_member(member_name, member_url, crawler, extractor, article_index, args):
+    """1人のメンバーの全ブログを解析し、出力ファイル名と (ポジ, ネガ, 中立) の合計を返す関数"""
+    print(f"\nメンバーのブログを解析開始: {member_name}")
+
+    # 出力ファイル名を生成
+    output_filename = output_path_for(member_name, args.output_format)
+    ct_value, _ = member_query(member_url)
+    journal = journal_from_args(args, 'emotion', ct_value)
+    resume = journal is not None and args.resume
+    aggregator = EmotionAggregator()
+    if resume:
+        # 最後のチェックポイントより後に書かれた行を取り除く
+        rollback_sink(output_filename, args.output_format, (journal.last_checkpoint or {}).get('state'))
+    if article_index is not None and has_results(output_filename, args.output_format):
+        # インクリメンタルモードでは今回の記事だけでなく、追記先の過去の実行の結果も合わせて推移と合計を求める
+        aggregator = load_previous_results(output_filename, ct_value, article_index)
+    elif resume:
+        # 記録済みの記事の集計をジャーナルから復元する
+        for record in journal.restored('article', ct_value):
+            aggregator.restore_article(member_name, record['date'], record['sentences'], record['probabilities'],
+                                       record['polarity_scores'])
+        print(f"{aggregator.articles} 記事分の集計をジャーナルから復元しました。")
+
+    # インクリメンタルモードと再開時は過去の結果を残したまま追記する
+    sink = open_sink(output_filename, args.output_format, append=article_index is not None or resume)
+    if journal is not None:
+        # チェックポイントごとにシンクをディスクまで書き出し、その位置をジャーナルに残す
+        journal.checkpoint_hook = sink.checkpoint
+        journal.commit(force=True)
+    try:
+        totals = scrape_all_blogs(
+            member_url, sink, member_name, crawler, extractor, aggregator, args.batch_size,
+            args.max_tokens_per_batch, args.split_mode, article_index, args.fetch_workers, args.parse_workers,
+            args.queue_size, granularity=args.granularity, window_overlap=args.window_overlap,
+            window_pooling=args.window_pooling, journal=journal)
+    finally:
+        if journal is not None:
+            journal.close()
+        sink.close()
+    print(f"{sink.rows_written} 文の結果を '{output_filename}' に書き込みました。")
+
+    trend_filename = trend_path_for(member_name)
+    aggregator.write_trend(trend_filename, member_name)
+    print(f"月ごとの感情の推移を '{trend_filename}' に保存しました。")
+    return output_filename, totals
+
+# --all-members のワーカープロセスごとの状態（モデルは各ワーカーで1回だけロードする）
+_worker_state = {}
+
+def _init_member_worker(args, torch_threads, num_workers):
+    # torch をインポートする前にスレッド数を決め、ワーカー同士でコアを奪い合わないようにする
+    os.environ['OMP_NUM_THREADS'] = str(torch_threads)
+    os.environ['MKL_NUM_THREADS'] = str(torch_threads)
+    metrics.enabled = args.profile
+    configure_backend(args.backend, args.onnx_path, **compile_options_from_args(args))
+    configure_inference_cache(None if args.no_inference_cache else args.inference_cache)
+    configure_model_snapshot(snapshot_from_args(args, model_name))
+    configure_cascade(cascade_from_args(args, model_name))
+    load_model()
+
+    import torch
+    torch.set_num_threads(torch_threads)
+
+    _worker_state['args'] = args
+    _worker_state['crawler'] = crawler_from_args(args, rate_share=num_workers)
+    _worker_state['extractor'] = extractor_from_args(args)
+    _worker_state['article_index'] = index_from_args(args, 'emotion')
+
+def _analyze_member_in_worker(member):
+    member_name, member_url = member
+    try:
+        output_filename, totals = analyze_member(
+            member_name, member_url, _worker_state['crawler'], _worker_state['extractor'],
+            _worker_state['article_index'], _worker_state['args'])
+    except Exception as e:
+        print(f"メンバーの解析中にエラーが発生しました: {member_name}")
+        traceback.print_exc()
+        output_filename, totals = None, None
+    report = backend_report()
+    if report:
+        print(f"推論バックエンドの統計（{member_name} まで）:\n{report}")
+    report = cascade_report()
+    if report:
+        print(f"{report}（{member_name} まで）")
+    # 計測結果はメンバーごとに親プロセスへ渡してまとめる
+    return member_name, output_filename, totals, metrics.snapshot(reset=True)
+
+def default_worker_count(member_count):
+    """--workers 未指定時のワーカー数（1ワーカーあたり4コアを目安にする）"""
+    return max(1, min(member_count, (os.cpu_count() or 1) // 4))
+
+def analyze_all_members(member_list, args, summary_filename='AllMembers_EmotionSummary.txt'):
+    """全メンバーをワーカープロセスに振り分けて解析し、メンバーごとの合計を1つのサマリーにまとめる関数"""
+    num_workers = args.workers or default_worker_count(len(member_list))
+    torch_threads = args.torch_threads or max(1, (os.cpu_count() or 1) // num_workers)
+    print(f"\n{len(member_list)} 人のメンバーを {num_workers} プロセス（各 {torch_threads} スレッド）で解析します。")
+
+    member_totals = {}
+    failed_members = []
+    # torch はスレッドを持つので fork ではなく spawn でワーカーを起動する
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(num_workers, initializer=_init_member_worker, initargs=(args, torch_threads, num_workers)) as pool:
+        for member_name, output_filename, totals, worker_metrics in pool.imap_unordered(
+                _analyze_member_in_worker, member_list):
+            metrics.merge(worker_metrics)
+            if totals is None:
+                failed_members.append(member_name)
+                continue
+            member_totals[member_name] = totals
+            print(f"\nメンバーの解析が完了しました: {member_name}（出力: {output_filename}）")
+
+    overall = [sum(totals[i] for totals in member_totals.values()) for i in range(3)]
+    with open(summary_filename, 'w', encoding='utf-8') as summary_file:
+        summary_file.write("メンバー\tポジティブ\tネガティブ\tニュートラル\n")
+        # メンバー一覧の順に書き出す
+        for member_name, _ in member_list:
+            if member_name in member_totals:
+                positive, negative, neutral = member_totals[member_name]
+                summary_file.write(f"{member_name}\t{positive:.4f}\t{negative:.4f}\t{neutral:.4f}\n")
+        summary_file.write(f"合計\t{overall[0]:.4f}\t{overall[1]:.4f}\t{overall[2]:.4f}\n")
+    print(f"\nメンバーごとの集計を '{summary_filename}' に保存しました。")
+
+    if failed_members:
+        print(f"解析に失敗したメンバー: {', '.join(failed_members)}")
+    return overall
+
 # メイン処理
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='指定されたメンバーのブログから感情分析を行います。')
     parser.add_argument('--member', type=str, help='メンバーの名前（漢字）を指定してください。')
+    parser.add_argument('--all-members', action='store_true',
+                        help='全メンバーのブログを複数プロセスで解析します。')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='--all-members で使うワーカープロセス数（既定: CPU コア数 / 4）')
+    parser.add_argument('--list-members', action='store_true', help='メンバー一覧を表示して終了します（モデルはロードしません）。')
+    parser.add_argument('--check-member', type=str, metavar='NAME',
+                        help='メンバー名が存在するかを確認して終了します（モデルはロードしません）。')
+    parser.add_argument('--reaggregate', type=str, nargs='+', metavar='PATH',
+                        help='保存済みの結果（JSONL / Parquet）から集計し直して終了します（モデル・ネットワークは使いません）。')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='1回の推論でまとめて処理する最大文数')
+    parser.add_argument('--max-tokens-per-batch', type=int, default=DEFAULT_MAX_TOKENS_PER_BATCH,
+                        help='1バッチあたりのパディング込みトークン数の上限')
+    parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND,
+                        help="推論バックエンド（'torch': fp32, 'quantized': 動的 int8 量子化, 'onnx': ONNX Runtime, "
+                             "'compiled': 系列長ごとに固定形状でコンパイル）")
+    parser.add_argument('--onnx-path', type=str, default=None,
+                        help='ONNX バックエンドで使うモデルファイル（存在しなければエクスポートして保存）')
+    parser.add_argument('--split-mode', choices=SPLIT_MODES, default='regex',
+                        help="文分割の方式（'regex': 文末記号で高速に分割, 'morph': fugashi の形態素解析で分割）")
+    parser.add_argument('--granularity', choices=('sentence', 'article'), default='sentence',
+                        help="感情分析の単位（'sentence': 文ごと, 'article': 記事を最大長のウィンドウに分けて推論し1つにまとめる）")
+    parser.add_argument('--window-overlap', type=int, default=DEFAULT_WINDOW_OVERLAP,
+                        help='記事単位モードで隣り合うウィンドウに重ねる文のトークン数の上限')
+    parser.add_argument('--window-pooling', choices=POOLING_METHODS, default='mean',
+                        help="記事単位モードでウィンドウの確率をまとめる方法（'mean': トークン数で重み付け平均, 'max': 最大値）")
+    add_compile_arguments(parser)
+    add_snapshot_arguments(parser)
+    add_cascade_arguments(parser)
+    add_crawler_arguments(parser)
+    add_pipeline_arguments(parser)
+    add_incremental_arguments(parser)
+    add_journal_arguments(parser)
+    add_extract_arguments(parser)
+    add_output_arguments(parser)
+    add_profile_arguments(parser)
+    parser.add_argument('--inference-cache', type=str, default=DEFAULT_INFERENCE_CACHE_PATH,
+                        help='文ごとの推論結果（確率ベクトル）を保存する SQLite ファイル')
+    parser.add_argument('--no-inference-cache', action='store_true', help='推論キャッシュを使用しない')
     args = parser.parse_args()
 
-    base_url = 'https://sakurazaka46.com/s/s46/diary/blog/list?ima=0000'
-    member_list = get_member_list(base_url)
+    if args.reaggregate:
+        plot_sentiment(*reaggregate(args.reaggregate))
+        sys.exit(0)
+
+    configure_backend(args.backend, args.onnx_path, **compile_options_from_args(args))
+    configure_inference_cache(None if args.no_inference_cache else args.inference_cache)
+    configure_model_snapshot(snapshot_from_args(args, model_name))
+    configure_cascade(cascade_from_args(args, model_name))
+    profiler = profiler_from_args(args)
+
+    crawler = crawler_from_args(args)
+    article_index = index_from_args(args, 'emotion')
+    extractor = extractor_from_args(args)
+
+    base_url = absolute_url('/s/s46/diary/blog/list?ima=0000')
+    member_list = get_member_list(base_url, crawler, extractor)
 
     if not member_list:
         print("メンバー一覧が取得できず、処理を中断します。")
         exit(1)
 
+    # モデルを使わないサブコマンド
+    if args.list_members:
+        for member_name, member_url in member_list:
+            print(member_name)
+        crawler.close()
+        sys.exit(0)
+    if args.check_member:
+        found = any(member_name == args.check_member for member_name, _ in member_list)
+        if found:
+            print(f"メンバー名 '{args.check_member}' は存在します。")
+        else:
+            print(f"指定されたメンバー名 '{args.check_member}' が見つかりませんでした。")
+        crawler.close()
+        sys.exit(0 if found else 1)
+
     print("\n取得したメンバー一覧:", member_list)
 
-    if args.member:
+    if args.all_members:
+        overall = analyze_all_members(member_list, args)
+        print("\n全メンバーの感情分析結果：")
+        print_sentiment_totals(*overall)
+        plot_sentiment(*overall)
+    elif args.member:
         member_found = False
         for member_name, member_url in member_list:
             if member_name == args.member:
                 member_found = True
-                print(f"\nメンバーのブログを解析開始: {member_name}")
-
-                # 出力ファイル名を生成
-                output_filename = f"{member_name.replace(' ', '')}_EmotionAnalysis.txt"
                 try:
-                    with open(output_filename, 'w', encoding='utf-8') as output_file:
-                        # scrape_all_blogsにoutput_fileを渡す
-                        total_positive, total_negative, total_neutral = scrape_all_blogs(member_url, output_file)
+                    total_positive, total_negative, total_neutral = analyze_member(
+                        member_name, member_url, crawler, extractor, article_index, args)[1]
                 except Exception as e:
-                    print(f"出力ファイルの作成中にエラーが発生しました: {output_filename}")
+                    print(f"出力ファイルの作成中にエラーが発生しました: {output_path_for(member_name, args.output_format)}")
                     traceback.print_exc()
                     exit(1)
 
-                total = total_positive + total_negative + total_neutral
                 print("\n感情分析結果：")
-                print(f"ポジティブスコア合計: {total_positive:.2f}")
-                print(f"ネガティブスコア合計: {total_negative:.2f}")
-                print(f"ニュートラルスコア合計: {total_neutral:.2f}")
-
-                if total > 0:
-                    positive_ratio = (total_positive / total) * 100
-                    negative_ratio = (total_negative / total) * 100
-                    neutral_ratio = (total_neutral / total) * 100
-                    print(f"ポジティブ割合: {positive_ratio:.2f}%")
-                    print(f"ネガティブ割合: {negative_ratio:.2f}%")
-                    print(f"ニュートラル割合: {neutral_ratio:.2f}%")
-                else:
-                    print("スコアの合計が0のため、割合を計算できません。")
+                print_sentiment_totals(total_positive, total_negative, total_neutral)
 
                 # グラフを描画
                 plot_sentiment(total_positive, total_negative, total_neutral)
@@ -379,4 +598,17 @@ if __name__ == "__main__":
         if not member_found:
             print(f"指定されたメンバー名 '{args.member}' が見つかりませんでした。")
     else:
-        print("メンバー名が指定されていません。--member 引数を使用してください。")
+        print("メンバー名が指定されていません。--member または --all-members 引数を使用してください。")
+
+    crawler.close()
+    if article_index is not None:
+        article_index.close()
+    close_inference_cache()
+    report = backend_report()
+    if report:
+        print(f"推論バックエンドの統計:\n{report}")
+    report = cascade_report()
+    if report:
+        print(report)
+    if profiler is not None:
+        profiler.stop()
@@ -0,0 +1,54 @@
+# check_import_time.py
+
+import argparse
+import os
+import subprocess
+import sys
+
+# EmotionDetection_FromText の import にかけてよい時間（秒）
+IMPORT_TIME_BUDGET_SECONDS = 1.0
+
+# import 時に読み込まれてはいけない重いモジュール
+LAZY_MODULES = ('torch', 'transformers', 'matplotlib', 'fugashi')
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def measure_import(module_name):
+    """別プロセスで -X importtime を使って import 時間を測る関数（秒と読み込まれたモジュール一覧を返す）"""
+    code = f"import sys, {module_name}; print('\\n'.join(sorted(sys.modules)))"
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=SRC_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith('import time:')]
+        raise RuntimeError(f"{module_name} の import に失敗しました:\n" + '\n'.join(errors))
+
+    total_us = 0
+    for line in result.stderr.splitlines():
+        # 形式: "import time: self [us] | cumulative | imported package"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # インデントのないトップレベルの import だけを合計する
+        if not name.startswith('  '):
+            total_us += int(cumulative)
+    return total_us / 1_000_000, set(result.stdout.split())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='EmotionDetection_FromText の import 時間が予算内かを確認します。')
+    parser.add_argument('--budget', type=float, default=IMPORT_TIME_BUDGET_SECONDS, help='import 時間の上限（秒）')
+    args = parser.parse_args()
+
+    try:
+        seconds, modules = measure_import('EmotionDetection_FromText')
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+    loaded_heavy = [name for name in LAZY_MODULES if name in modules]
+
+    print(f"import 時間: {seconds:.3f} 秒（予算 {args.budget:.3f} 秒）")
+    if loaded_heavy:
+        print(f"import 時に読み込まれてはいけないモジュールが読み込まれています: {', '.join(loaded_heavy)}")
+    if seconds > args.budget or loaded_heavy:
+        sys.exit(1)
+    print("import 時間は予算内です。")
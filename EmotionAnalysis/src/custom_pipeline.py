@@ -1,38 +1,94 @@
 # custom_pipeline.py
 
+import torch
 from transformers import TextClassificationPipeline
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+from inference_backends import MODEL_INPUT_NAMES
 
 class CustomTextClassificationPipeline(TextClassificationPipeline):
-    def _sanitize_parameters(
+    """
+    Text classification pipeline used for every emotion inference in this project.
+
+    Inputs may be a single sentence, a list, a generator or a dataset of sentences, or
+    already tokenized features ({'input_ids': [...], 'attention_mask': [...]}). Use
+    `batch_size` to pad and run several inputs per forward pass and `num_workers` to
+    tokenize ahead of the model in DataLoader workers (for generators the DataLoader
+    allows a single worker). Each output is a dict with 'label', 'label_id',
+    'meaning', 'score', 'scores' and 'probabilities'.
+    """
+
+    def __init__(
         self,
-        task: str,
+        *args,
+        inference_backend: Optional[Callable[[Dict[str, torch.Tensor]], Any]] = None,
+        label_meanings: Optional[Mapping[str, str]] = None,
         **kwargs
+    ):
+        # Set before super().__init__, which already calls _sanitize_parameters.
+        self.inference_backend = inference_backend
+        self.label_meanings = dict(label_meanings or {})
+        super().__init__(*args, **kwargs)
+
+    def _sanitize_parameters(
+        self,
+        max_length: Optional[int] = None,
+        **tokenizer_kwargs
     ) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
         """
-        Override the _sanitize_parameters method to modify tokenizer_kwargs.
+        Truncate to the model's maximum length. Padding is left to the batch collator,
+        so each batch is only padded to its own longest input.
+        """
+        if max_length is None:
+            max_length = getattr(self.model.config, 'max_position_embeddings', None) or self.tokenizer.model_max_length
+        preprocess_params = {'truncation': True, 'max_length': max_length, **tokenizer_kwargs}
+        preprocess_params['return_token_type_ids'] = False
+        return preprocess_params, {}, {}
+
+    @staticmethod
+    def _model_inputs(inputs: Mapping[str, Any]) -> Dict[str, Any]:
+        """
+        Keep only the inputs the model is fed (drops 'token_type_ids'). This is the only
+        place where tokenizer output is filtered before reaching the model.
         """
-        tokenizer_kwargs = kwargs.pop("tokenizer_kwargs", {})
-        tokenizer_kwargs['return_token_type_ids'] = False
-        kwargs["tokenizer_kwargs"] = tokenizer_kwargs
-        return super()._sanitize_parameters(task, **kwargs)
+        return {name: inputs[name] for name in MODEL_INPUT_NAMES}
 
-    def preprocess(self, text: str, **kwargs) -> Dict[str, Any]:
+    def preprocess(self, inputs: Any, **tokenizer_kwargs) -> Dict[str, torch.Tensor]:
         """
-        Preprocess the input text by tokenizing it.
+        Tokenize one sentence, or wrap already tokenized features, as a batch of one.
         """
-        return self.tokenizer(text, **kwargs)
+        if isinstance(inputs, Mapping):
+            features = self._model_inputs(inputs)
+            return {name: torch.as_tensor(values, dtype=torch.long).reshape(1, -1) for name, values in features.items()}
+        encoded = self.tokenizer(inputs, return_tensors=self.framework, **tokenizer_kwargs)
+        return self._model_inputs(encoded)
 
-    def _forward(self, model_inputs: Dict[str, Any], **kwargs) -> Any:
+    def _forward(self, model_inputs: Dict[str, torch.Tensor], **kwargs) -> Dict[str, Any]:
         """
-        Forward pass: Remove 'token_type_ids' if present and pass inputs to the model.
+        Run the padded batch through the inference backend (or the model itself) and
+        return the softmax probabilities as a (batch, labels) array.
         """
-        if 'token_type_ids' in model_inputs:
-            del model_inputs['token_type_ids']
-        return self.model(**model_inputs)
+        model_inputs = self._model_inputs(model_inputs)
+        if self.inference_backend is not None:
+            probabilities = self.inference_backend(model_inputs)
+        else:
+            logits = self.model(**model_inputs).logits
+            probabilities = torch.softmax(logits, dim=-1).float().cpu().numpy()
+        return {'probabilities': probabilities}
 
-    def postprocess(self, model_outputs: Any, **kwargs) -> List[Dict[str, Any]]:
+    def postprocess(self, model_outputs: Dict[str, Any], **kwargs) -> Dict[str, Any]:
         """
-        Postprocess the model outputs.
+        Turn the probabilities of one input into the label, its meaning and all scores.
         """
-        return self.task.postprocess(model_outputs, **kwargs)
+        probabilities = model_outputs['probabilities'][0]
+        id2label = self.model.config.id2label
+        predicted = int(probabilities.argmax())
+        label = id2label[predicted]
+        return {
+            'label': label,
+            'label_id': predicted,
+            'meaning': self.label_meanings.get(label, label),
+            'score': float(probabilities[predicted]),
+            'scores': {id2label[i]: float(p) for i, p in enumerate(probabilities)},
+            'probabilities': probabilities,
+        }
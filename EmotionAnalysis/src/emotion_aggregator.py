@@ -0,0 +1,141 @@
+# emotion_aggregator.py
+
+import numpy as np
+
+from emotion_model import label_meanings
+
+# 感情ラベル（ラベル ID 順）
+EMOTION_LABELS = [label_meanings[f'LABEL_{i}'] for i in range(len(label_meanings))]
+
+# ラベル ID -> ポジ・ネガ・中立のマッピング
+# 使用するモデルに応じてラベルを確認し、マッピングを調整してください
+POSITIVE_LABEL_IDS = {0}      # 喜び
+NEGATIVE_LABEL_IDS = {1, 2}   # 怒り、悲しみ
+# それ以外（驚き、中立、恐れ、疲労、その他）は中立として扱う
+POLARITIES = ('positive', 'negative', 'neutral')
+
+UNKNOWN_MONTH = 'unknown'
+
+
+def _polarity_of_labels(num_labels):
+    polarity = np.full(num_labels, 2, dtype=np.int64)
+    polarity[list(POSITIVE_LABEL_IDS)] = 0
+    polarity[list(NEGATIVE_LABEL_IDS)] = 1
+    return polarity
+
+
+def month_of(date):
+    """'YYYY/MM/DD' 形式の投稿日から 'YYYY/MM' を返す関数（日付が無ければ 'unknown'）"""
+    return date[:7] if isinstance(date, str) and date else UNKNOWN_MONTH
+
+
+class RunningSum:
+    """文数・確率ベクトルの合計・ポジ/ネガ/中立ごとのスコア合計を持つ集計値"""
+
+    def __init__(self, num_labels):
+        self.sentences = 0
+        self.probabilities = np.zeros(num_labels, dtype=np.float64)
+        self.polarity_scores = np.zeros(len(POLARITIES), dtype=np.float64)
+
+    def add(self, sentences, probabilities, polarity_scores):
+        self.sentences += sentences
+        self.probabilities += probabilities
+        self.polarity_scores += polarity_scores
+
+    def mean_probabilities(self):
+        return self.probabilities / self.sentences if self.sentences else self.probabilities
+
+    def polarity_ratios(self):
+        total = self.polarity_scores.sum()
+        return self.polarity_scores / total if total > 0 else np.zeros_like(self.polarity_scores)
+
+
+class EmotionAggregator:
+    """
+    文ごとの確率ベクトルを記事単位で受け取り、メンバー別・月別の合計を逐次更新する集計器。
+    保持するのは (メンバー, 月) ごとの固定長の合計だけなので、記事や文が増えてもメモリはほぼ増えない。
+    ポジ・ネガ・中立には、各文の最も確率の高いラベルのスコアを加算する（従来の合計と同じ定義）。
+    """
+
+    def __init__(self, num_labels=len(EMOTION_LABELS)):
+        self.num_labels = num_labels
+        self._polarity = _polarity_of_labels(num_labels)
+        self.members = {}
+        self.months = {}
+        self.articles = 0
+
+    def _sum_for(self, table, key):
+        if key not in table:
+            table[key] = RunningSum(self.num_labels)
+        return table[key]
+
+    def add_article(self, member, article_id, date, probabilities):
+        """1記事分の確率ベクトル（文数 × ラベル数）を加算し、その記事の集計を辞書で返す"""
+        probabilities = np.asarray(probabilities, dtype=np.float64).reshape(-1, self.num_labels)
+        predicted = probabilities.argmax(axis=1)
+        scores = probabilities[np.arange(len(predicted)), predicted]
+        polarity_scores = np.bincount(self._polarity[predicted], weights=scores, minlength=len(POLARITIES))
+        probability_sum = probabilities.sum(axis=0)
+
+        self._sum_for(self.members, member).add(len(predicted), probability_sum, polarity_scores)
+        self._sum_for(self.months, (member, month_of(date))).add(len(predicted), probability_sum, polarity_scores)
+        self.articles += 1
+        return {'member': member, 'article_id': article_id, 'date': date, 'sentences': len(predicted),
+                'probabilities': probability_sum, 'polarity_scores': polarity_scores}
+
+    def restore_article(self, member, date, sentences, probabilities, polarity_scores):
+        """add_article が返した1記事分の集計（ジャーナルに保存したもの）をそのまま加算する"""
+        probability_sum = np.asarray(probabilities, dtype=np.float64)
+        polarity_scores = np.asarray(polarity_scores, dtype=np.float64)
+        self._sum_for(self.members, member).add(sentences, probability_sum, polarity_scores)
+        self._sum_for(self.months, (member, month_of(date))).add(sentences, probability_sum, polarity_scores)
+        self.articles += 1
+
+    def add_results(self, member, article_id, date, results):
+        """classify_emotions の結果（失敗した文は None）を1記事分加算する"""
+        probabilities = [res['probabilities'] for res in results if res]
+        if probabilities:
+            return self.add_article(member, article_id, date, np.stack(probabilities))
+        return None
+
+    def add_frame(self, frame):
+        """結果シンク（JSONL / Parquet）を読み込んだ DataFrame を記事ごとにまとめて加算する"""
+        for (member, article_id), rows in frame.groupby(['member', 'article_id'], sort=False, dropna=False):
+            self.add_article(member, article_id, rows['date'].iloc[0], np.stack(rows['probabilities'].to_numpy()))
+
+    def totals(self, member=None):
+        """(ポジティブ, ネガティブ, ニュートラル) のスコア合計を返す（member 省略時は全メンバー）"""
+        if member is None:
+            sums = list(self.members.values())
+        else:
+            # 解析できた記事が1件も無いメンバーは合計 0 とする
+            sums = [self.members[member]] if member in self.members else []
+        totals = np.zeros(len(POLARITIES), dtype=np.float64)
+        for running_sum in sums:
+            totals += running_sum.polarity_scores
+        return tuple(float(total) for total in totals)
+
+    def monthly(self, member=None):
+        """(メンバー, 月, RunningSum) を月の昇順に返す"""
+        keys = sorted(key for key in self.months if member is None or key[0] == member)
+        return [(key[0], key[1], self.months[key]) for key in keys]
+
+    def write_trend(self, path, member=None):
+        """月ごとのポジ/ネガ/中立の割合と感情ごとの平均確率をタブ区切りで書き出す"""
+        with open(path, 'w', encoding='utf-8') as f:
+            header = ['メンバー', '月', '文数', 'ポジティブ', 'ネガティブ', 'ニュートラル'] + EMOTION_LABELS[:self.num_labels]
+            f.write('\t'.join(header) + '\n')
+            for member_name, month, running_sum in self.monthly(member):
+                values = list(running_sum.polarity_ratios()) + list(running_sum.mean_probabilities())
+                f.write('\t'.join([member_name, month, str(running_sum.sentences)] + [f"{v:.4f}" for v in values])
+                        + '\n')
+
+
+def aggregate_results(paths):
+    """結果シンクのファイル群を読み込み、モデルを使わずに集計し直す関数"""
+    from results_sink import load_results
+
+    aggregator = EmotionAggregator()
+    for path in paths:
+        aggregator.add_frame(load_results(path))
+    return aggregator
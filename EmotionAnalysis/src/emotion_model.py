@@ -0,0 +1,437 @@
+# emotion_model.py
+
+import os
+import sys
+import traceback
+import numpy as np
+from dotenv import load_dotenv
+from inference_cache import InferenceCache
+from inference_backends import DEFAULT_BACKEND, create_backend, default_onnx_path, load_model_for_backend
+from model_snapshot import default_snapshot_path, is_snapshot, load_snapshot_model, read_label_map, read_manifest
+from ngram_cascade import load_cascade
+
+# 共通モジュール（リポジトリ直下の Common/）を読み込めるようにする
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from instrumentation import metrics
+
+# torch / transformers は読み込みに数秒かかるため、モデルを初めて使うときにインポートする
+
+# .envファイルを読み込む
+load_dotenv()
+
+# 環境変数からアクセストークンを取得（必要な場合）
+access_token = os.getenv('HF_ACCESS_TOKEN')
+
+# 使用する感情分析モデル（環境変数 EMOTION_MODEL_NAME でローカルのモデルなどに差し替えられる）
+model_name = os.getenv('EMOTION_MODEL_NAME', "koshin2001/Japanese-to-emotions")
+
+# モデル・トークナイザーは load_model() の初回呼び出しでロードする
+tokenizer = None
+model = None
+device = None
+labels = None
+model_revision = None  # モデルのリビジョン（推論キャッシュのキーに使用）
+backend = None  # 推論バックエンド（inference_backends を参照）
+pipeline = None  # backend で推論する CustomTextClassificationPipeline（推論はすべてこれを通す）
+backend_name = DEFAULT_BACKEND
+_onnx_path = None
+_backend_options = {}
+# ローカルのスナップショット（model_snapshot.py snapshot で作成）があれば、Hub ではなくそこからロードする
+_snapshot_path = default_snapshot_path(model_name)
+
+# n-gram モデルによるカスケード（configure_cascade で設定するとモデルのロード時に読み込む）
+cascade = None
+_cascade_options = None
+
+# 文ごとの推論結果のキャッシュ（configure_inference_cache で保存先を指定するとモデルのロード時に生成）
+inference_cache = None
+_inference_cache_path = None
+
+def configure_inference_cache(path):
+    """推論キャッシュの保存先を設定する関数（None で無効化）"""
+    global _inference_cache_path
+    _inference_cache_path = path
+
+def configure_backend(name, onnx_path=None, **options):
+    """推論バックエンドを設定する関数（モデルのロード前に呼ぶ、options は compiled バックエンドの設定）"""
+    global backend_name, _onnx_path, _backend_options
+    backend_name = name
+    _onnx_path = onnx_path
+    _backend_options = options
+
+def configure_model_snapshot(path):
+    """モデルのスナップショットの場所を設定する関数（None なら常に Hub からロードする）"""
+    global _snapshot_path
+    _snapshot_path = path
+
+def configure_cascade(options):
+    """カスケードの (n-gram モデルのパス, しきい値, 監査の割合) を設定する関数（None で無効化）"""
+    global _cascade_options
+    _cascade_options = options
+
+def cascade_report():
+    """カスケードで n-gram モデル・感情分析モデルに回した文の割合と監査での一致率を返す関数（無効なら None）"""
+    return cascade.summary() if cascade is not None else None
+
+def backend_report():
+    """推論バックエンドの統計（compiled バックエンドの系列長ごとの推論時間など）を返す関数（無ければ None）"""
+    report = getattr(backend, 'report', None)
+    return report() if report is not None else None
+
+def close_inference_cache():
+    """推論キャッシュの統計を表示して閉じる関数"""
+    global inference_cache
+    if inference_cache is not None:
+        print(inference_cache.summary())
+        inference_cache.close()
+        inference_cache = None
+
+def load_model():
+    """初回呼び出し時にモデルとトークナイザーをロードする関数（2回目以降は何もしない）"""
+    global tokenizer, model, device, labels, model_revision, backend, pipeline, inference_cache, cascade
+    if model is not None:
+        return
+
+    import torch
+    from transformers import AutoTokenizer
+
+    snapshot = _usable_snapshot()
+    try:
+        if snapshot:
+            # 重みをメモリマップするので、同じホストのワーカー同士でページキャッシュを共有できる
+            print(f"スナップショットからモデルとトークナイザーをロード中: {snapshot}")
+            tokenizer = AutoTokenizer.from_pretrained(snapshot, use_fast=True)
+            loaded_model = load_model_for_backend(snapshot, backend_name, load_snapshot_model)
+        else:
+            print("モデルとトークナイザーをロード中...")
+            tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+            loaded_model = load_model_for_backend(model_name, backend_name)
+        loaded_model.eval()  # 評価モードに設定
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        loaded_model.to(device)
+        model = loaded_model
+        print("モデルとトークナイザーのロードに成功しました。")
+    except Exception as e:
+        print("感情分析モデルのロードに失敗しました。環境・ネットワーク状態を確認してください。")
+        traceback.print_exc()
+        sys.exit(1)
+
+    if snapshot:
+        model_revision = read_manifest(snapshot)['revision']
+    else:
+        model_revision = getattr(model.config, '_commit_hash', None) or 'main'
+
+    try:
+        onnx_path = _onnx_path or default_onnx_path(model_name, model_revision)
+        backend = create_backend(backend_name, model, device, onnx_path, **_backend_options)
+        pipeline = create_pipeline(backend)
+        print(f"推論バックエンド: {backend_name}")
+    except Exception as e:
+        print(f"推論バックエンド '{backend_name}' の初期化に失敗しました。")
+        traceback.print_exc()
+        sys.exit(1)
+
+    # モデルのラベル一覧を表示
+    labels = model.config.id2label
+    print("\nモデルのラベル一覧:")
+    for idx, label in labels.items():
+        print(f"{idx}: {label}")
+
+    if _inference_cache_path:
+        # 量子化・ONNX では出力がわずかに変わるので、fp32 の結果とはキャッシュを分ける
+        cache_revision = model_revision if backend_name == DEFAULT_BACKEND else f"{model_revision}+{backend_name}"
+        inference_cache = InferenceCache(model_name, cache_revision, _inference_cache_path)
+
+    if _cascade_options:
+        cascade_path, threshold, audit_rate = _cascade_options
+        cascade = load_cascade(cascade_path, model_name, model_revision, threshold, audit_rate)
+
+def _usable_snapshot():
+    """設定されたスナップショットが使えればそのパスを、無い・別のモデルやラベルの対応のものなら None を返す"""
+    if not is_snapshot(_snapshot_path):
+        return None
+    try:
+        manifest = read_manifest(_snapshot_path)
+        if manifest['model_name'] != model_name:
+            print(f"スナップショットのモデル（{manifest['model_name']}）が {model_name} と異なるため使いません。")
+            return None
+        if read_label_map(_snapshot_path)['label_meanings'] != label_meanings:
+            print("スナップショットのラベルの対応が現在の定義と異なるため使いません。スナップショットを作り直してください。")
+            return None
+    except Exception as e:
+        print(f"スナップショットを読み込めないため、Hub からロードします: {_snapshot_path}")
+        traceback.print_exc()
+        return None
+    return _snapshot_path
+
+def create_pipeline(inference_backend):
+    """推論バックエンドで推論する CustomTextClassificationPipeline を生成する関数"""
+    from custom_pipeline import CustomTextClassificationPipeline
+
+    return CustomTextClassificationPipeline(
+        model=model, tokenizer=tokenizer, device=device, inference_backend=inference_backend,
+        label_meanings=label_meanings, max_length=MAX_LENGTH)
+
+# 感情ラベルの意味を定義
+label_meanings = {
+    'LABEL_0': '喜び',
+    'LABEL_1': '怒り',
+    'LABEL_2': '悲しみ',
+    'LABEL_3': '驚き',
+    'LABEL_4': '中立',
+    'LABEL_5': '恐れ',
+    'LABEL_6': '疲労',
+    'LABEL_7': 'その他'
+}
+
+# バッチ推論の既定値
+MAX_LENGTH = 512  # モデルが受け付ける最大トークン長
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_MAX_TOKENS_PER_BATCH = 8192  # 1バッチあたりのパディング込みトークン数の上限
+WINDOW_BATCHES = 16  # 長さでまとめる単位（バッチ何個分の文を一度に並べ替えるか）
+
+def make_length_buckets(lengths, batch_size, max_tokens_per_batch):
+    """トークン長順に並べ、バッチサイズとトークン予算に収まるインデックスのバッチに分ける関数"""
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    current = []
+    for i in order:
+        # 昇順に並べているので、追加する文がそのバッチの最長文になる
+        padded_tokens = lengths[i] * (len(current) + 1)
+        if current and (len(current) >= batch_size or padded_tokens > max_tokens_per_batch):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+def _result_from_probabilities(probabilities):
+    predicted = int(probabilities.argmax())
+    label = labels[predicted]
+    return {'label': label_meanings.get(label, 'その他'), 'label_id': predicted,
+            'score': float(probabilities[predicted]), 'probabilities': probabilities}
+
+def infer_probabilities(sentences, batch_size=DEFAULT_BATCH_SIZE, max_tokens_per_batch=DEFAULT_MAX_TOKENS_PER_BATCH,
+                        inference_backend=None):
+    """
+    推論バックエンドで文ごとの確率ベクトルを求める関数（キャッシュは使わない、失敗した文は None）。
+    inference_backend を省略すると設定済みのバックエンドを使う。
+    """
+    load_model()
+    inference_pipeline = pipeline if inference_backend is None else create_pipeline(inference_backend)
+
+    probabilities = [None] * len(sentences)
+    try:
+        # パディングせずにトークナイズし、長さだけ先に求める
+        with metrics.timed('tokenize'):
+            encodings = tokenizer(sentences, truncation=True, max_length=MAX_LENGTH, return_token_type_ids=False)
+    except Exception as e:
+        print(f"トークナイズ中にエラーが発生しました（{len(sentences)}文）")
+        traceback.print_exc()
+        return probabilities
+
+    return _infer_encoded(sentences, encodings['input_ids'], encodings['attention_mask'], batch_size,
+                          max_tokens_per_batch, inference_pipeline)
+
+def _infer_encoded(sentences, input_ids, attention_mask, batch_size, max_tokens_per_batch, inference_pipeline):
+    """トークナイズ済みの入力を長さでバッチにまとめ、パイプラインで推論する関数（sentences はエラー表示用）"""
+    probabilities = [None] * len(input_ids)
+    lengths = [len(ids) for ids in input_ids]
+
+    for batch in make_length_buckets(lengths, batch_size, max_tokens_per_batch):
+        try:
+            features = [{'input_ids': input_ids[i], 'attention_mask': attention_mask[i]} for i in batch]
+            # 1バケットを1バッチとして渡し、バッチ内の最長文に合わせてパディングさせる
+            with metrics.timed('forward'):
+                outputs = inference_pipeline(features, batch_size=len(batch))
+            metrics.increment('forward.sentences', len(batch))
+            for i, output in zip(batch, outputs):
+                probabilities[i] = output['probabilities']
+        except Exception as e:
+            print(f"感情分析中にエラーが発生しました: 文: {sentences[batch[0]]} ほか{len(batch) - 1}文")
+            traceback.print_exc()
+
+    return probabilities
+
+def _infer_uncached(sentences, batch_size, max_tokens_per_batch):
+    """
+    キャッシュに無い文の確率ベクトルと、そのうち感情分析モデルで推論した文の番号を返す関数。
+    カスケードが有効なら、n-gram モデルが十分に自信のある文はモデルに渡さない。
+    """
+    if cascade is None:
+        return infer_probabilities(sentences, batch_size, max_tokens_per_batch), range(len(sentences))
+
+    with metrics.timed('cascade'):
+        probabilities, uncertain = cascade.route(sentences)
+    metrics.increment('cascade.ngram', len(sentences) - len(uncertain))
+    if uncertain:
+        computed = infer_probabilities([sentences[i] for i in uncertain], batch_size, max_tokens_per_batch)
+        cascade.audit([probabilities[i] for i in uncertain], computed)
+        for i, probs in zip(uncertain, computed):
+            probabilities[i] = probs
+    return probabilities, uncertain
+
+def _classify_window(sentences, batch_size, max_tokens_per_batch):
+    metrics.increment('classify.sentences', len(sentences))
+    if inference_cache is None:
+        probabilities, _ = _infer_uncached(sentences, batch_size, max_tokens_per_batch)
+    else:
+        probabilities = inference_cache.get_many(sentences)
+        # キャッシュに無い文だけを、同じ文は1回にまとめてモデルに渡す
+        pending = {}
+        for i, probs in enumerate(probabilities):
+            if probs is None:
+                pending.setdefault(inference_cache.key_for(sentences[i]), []).append(i)
+        if pending:
+            indices = list(pending.values())
+            computed, inferred = _infer_uncached([sentences[group[0]] for group in indices], batch_size,
+                                                 max_tokens_per_batch)
+            for group, probs in zip(indices, computed):
+                for i in group:
+                    probabilities[i] = probs
+            # キャッシュには感情分析モデルの結果だけを保存する（n-gram モデルの結果は蒸留の教師にしない）
+            inference_cache.put_many(
+                (sentences[indices[j][0]], computed[j]) for j in inferred if computed[j] is not None)
+
+    return [_result_from_probabilities(probs) if probs is not None else None for probs in probabilities]
+
+def classify_emotions(sentences, batch_size=DEFAULT_BATCH_SIZE, max_tokens_per_batch=DEFAULT_MAX_TOKENS_PER_BATCH):
+    """
+    文のリストまたはイテレータをまとめて感情分析する関数。
+    トークン長の近い文同士でバッチを組み、バッチごとに1回だけ順伝播する。
+    結果は入力と同じ順序のリストで返す（失敗した文は None）。
+    """
+    load_model()
+
+    results = []
+    window = []
+    window_size = max(1, batch_size) * WINDOW_BATCHES
+    for sentence in sentences:
+        window.append(sentence)
+        if len(window) >= window_size:
+            results.extend(_classify_window(window, batch_size, max_tokens_per_batch))
+            window = []
+    if window:
+        results.extend(_classify_window(window, batch_size, max_tokens_per_batch))
+    return results
+
+def stream_emotions(sentences, batch_size=DEFAULT_BATCH_SIZE, num_workers=0, inference_backend=None):
+    """
+    文のイテレータを入力順のままパイプラインに流し、結果（label, label_id, meaning, score, scores,
+    probabilities の辞書）を1件ずつ返すジェネレータ。num_workers を指定すると、トークナイズを
+    DataLoader のワーカーで先行して行う。キャッシュと長さによる並べ替えは使わない。
+    """
+    load_model()
+    inference_pipeline = pipeline if inference_backend is None else create_pipeline(inference_backend)
+    # transformers のパイプラインはジェネレータ（GeneratorType）のときだけ逐次処理するので包み直す
+    generator = (sentence for sentence in sentences)
+    for output in inference_pipeline(generator, batch_size=batch_size, num_workers=num_workers):
+        metrics.increment('forward.sentences')
+        yield output
+
+# 記事単位モード（スライディングウィンドウ）の既定値
+DEFAULT_WINDOW_OVERLAP = 64  # 隣り合うウィンドウで重ねるトークン数の上限
+POOLING_METHODS = ('mean', 'max')
+WINDOW_KEY_PREFIX = '\0window\0'  # 推論キャッシュで文単位の結果とキーを分けるための接頭辞
+# キーの文と文の区切り（キーの正規化で空白は取り除かれるので、正規化で消えない文字で区切る）
+WINDOW_SENTENCE_SEPARATOR = '\0'
+
+def window_cache_key(sentences):
+    """ウィンドウ内の文のリストから推論キャッシュのキーを返す関数（文の分け方が違えば別のキーになる）"""
+    return WINDOW_KEY_PREFIX + WINDOW_SENTENCE_SEPARATOR.join(sentences)
+
+def make_sentence_windows(lengths, max_tokens, overlap=DEFAULT_WINDOW_OVERLAP):
+    """
+    文ごとのトークン数から、連続する文を max_tokens 以内に詰めたウィンドウ (開始, 終了) のリストを返す関数。
+    次のウィンドウは、直前のウィンドウの末尾 overlap トークン以内に収まる文から始める。
+    """
+    windows = []
+    start = 0
+    while start < len(lengths):
+        end = start
+        total = 0
+        while end < len(lengths) and total + lengths[end] <= max_tokens:
+            total += lengths[end]
+            end += 1
+        end = max(end, start + 1)  # 1文で上限を超える場合もそのウィンドウに入れる
+        windows.append((start, end))
+        if end >= len(lengths):
+            break
+        # 末尾の文を overlap トークンまで次のウィンドウに持ち越す（必ず1文以上は進める）
+        next_start = end
+        carried = 0
+        while next_start - 1 > start and carried + lengths[next_start - 1] <= overlap:
+            next_start -= 1
+            carried += lengths[next_start]
+        start = next_start
+    return windows
+
+def _article_segments(sentences, max_tokens):
+    """文を (キー用のテキスト, 特殊トークンなしのトークン ID) に変換する（上限を超える文はトークン単位で分割）"""
+    encodings = tokenizer(sentences, add_special_tokens=False, return_token_type_ids=False,
+                          return_attention_mask=False)
+    segments = []
+    for sentence, ids in zip(sentences, encodings['input_ids']):
+        if len(ids) <= max_tokens:
+            segments.append((sentence, ids))
+            continue
+        # 切り捨てずに、上限ごとに区切って別の断片として扱う
+        for start in range(0, len(ids), max_tokens):
+            segments.append((f"{sentence}\0{start}", ids[start:start + max_tokens]))
+    return segments
+
+def pool_probabilities(probabilities, weights, pooling='mean'):
+    """ウィンドウごとの確率ベクトルを1つにまとめる関数（mean: トークン数で重み付けした平均, max: 最大値を正規化）"""
+    stacked = np.stack(probabilities)
+    if pooling == 'max':
+        pooled = stacked.max(axis=0)
+        return (pooled / pooled.sum()).astype(np.float32)
+    return np.average(stacked, axis=0, weights=weights).astype(np.float32)
+
+def classify_article(sentences, batch_size=DEFAULT_BATCH_SIZE, max_tokens_per_batch=DEFAULT_MAX_TOKENS_PER_BATCH,
+                     overlap=DEFAULT_WINDOW_OVERLAP, pooling='mean'):
+    """
+    記事全体を感情分析する関数。連続する文をモデルの上限（MAX_LENGTH）までウィンドウに詰め、
+    ウィンドウごとの確率を pooling で1つにまとめる。文ごとに推論するより順伝播の回数が大幅に少ない。
+    結果は classify_emotions と同じ形式の辞書（'windows' にウィンドウ数を追加）で、失敗時は None。
+    """
+    load_model()
+    sentences = list(sentences)
+    if not sentences:
+        return None
+
+    body_tokens = MAX_LENGTH - tokenizer.num_special_tokens_to_add(pair=False)
+    try:
+        with metrics.timed('tokenize'):
+            segments = _article_segments(sentences, body_tokens)
+    except Exception as e:
+        print(f"トークナイズ中にエラーが発生しました（{len(sentences)}文）")
+        traceback.print_exc()
+        return None
+
+    windows = make_sentence_windows([len(ids) for _, ids in segments], body_tokens, overlap)
+    window_sentences = [[text for text, _ in segments[start:end]] for start, end in windows]
+    keys = [window_cache_key(texts) for texts in window_sentences]
+    input_ids = [tokenizer.build_inputs_with_special_tokens([token for _, ids in segments[start:end] for token in ids])
+                 for start, end in windows]
+    metrics.increment('windows', len(windows))
+
+    probabilities = inference_cache.get_many(keys) if inference_cache is not None else [None] * len(keys)
+    missing = [i for i, probs in enumerate(probabilities) if probs is None]
+    if missing:
+        computed = _infer_encoded(
+            ['\n'.join(window_sentences[i]) for i in missing], [input_ids[i] for i in missing],
+            [[1] * len(input_ids[i]) for i in missing], batch_size, max_tokens_per_batch, pipeline)
+        for i, probs in zip(missing, computed):
+            probabilities[i] = probs
+        if inference_cache is not None:
+            inference_cache.put_many((keys[i], probs) for i, probs in zip(missing, computed) if probs is not None)
+
+    valid = [(probs, len(ids)) for probs, ids in zip(probabilities, input_ids) if probs is not None]
+    if not valid:
+        return None
+    pooled = pool_probabilities([probs for probs, _ in valid], [length for _, length in valid], pooling)
+    result = _result_from_probabilities(pooled)
+    result['windows'] = len(windows)
+    return result
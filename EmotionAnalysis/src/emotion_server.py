@@ -0,0 +1,327 @@
+# emotion_server.py
+
+import argparse
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from emotion_model import (
+    DEFAULT_MAX_TOKENS_PER_BATCH, classify_emotions, close_inference_cache, configure_backend,
+    configure_inference_cache, configure_model_snapshot, load_model, model_name,
+)
+from inference_backends import BACKENDS, DEFAULT_BACKEND, add_compile_arguments, compile_options_from_args
+from model_snapshot import add_snapshot_arguments, snapshot_from_args
+from inference_cache import DEFAULT_CACHE_PATH as DEFAULT_INFERENCE_CACHE_PATH
+
+# 共通モジュール（リポジトリ直下の Common/）を読み込めるようにする
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from instrumentation import Histogram, metrics
+
+# サーバーの既定値
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BATCH_SIZE = 64   # 1回の推論にまとめる最大文数
+DEFAULT_MAX_WAIT_MS = 10      # 最初のリクエストが届いてから次のリクエストを待つ最大時間
+DEFAULT_MAX_QUEUE = 1024      # 受け付けて待たせておけるリクエスト数の上限
+MAX_TEXTS_PER_REQUEST = 4096
+REQUEST_TIMEOUT_SECONDS = 300
+
+
+class ScoreRequest:
+    """1件のリクエスト（文のリスト）と、その結果を待つためのイベント"""
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.results = None
+        self.error = None
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    リクエストをキューに溜め、最大文数（max_batch_size）か最大待ち時間（max_wait_ms）の
+    どちらかに達した時点でまとめて1回推論するスレッド。モデルを触るのはこのスレッドだけ。
+    """
+
+    def __init__(self, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS,
+                 max_queue=DEFAULT_MAX_QUEUE, max_tokens_per_batch=DEFAULT_MAX_TOKENS_PER_BATCH):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.queue = queue.Queue(max_queue)
+        self.started = time.time()
+        self.requests = 0
+        self.sentences = 0
+        self.batches = 0
+        self.errors = 0
+        self.latency = Histogram()     # リクエストを受け付けてから結果が出るまで
+        self.queue_wait = Histogram()  # キューで待っていた時間
+        self._lock = threading.Lock()
+        self._pending = None  # 前のバッチに入りきらなかったリクエスト
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, texts, timeout=REQUEST_TIMEOUT_SECONDS):
+        """文のリストを推論キューに入れ、結果（文ごとの辞書のリスト）が出るまで待つ"""
+        request = ScoreRequest(texts)
+        try:
+            self.queue.put_nowait(request)
+        except queue.Full:
+            raise RuntimeError('推論キューが一杯です。しばらく待ってから再送してください。')
+        if not request.done.wait(timeout):
+            raise TimeoutError('推論がタイムアウトしました。')
+        if request.error is not None:
+            raise RuntimeError(request.error)
+        return request.results
+
+    def _next_batch(self):
+        """最初のリクエストを待ち、上限まで後続のリクエストをまとめて返す"""
+        first = self._pending or self.queue.get()
+        self._pending = None
+        batch = [first]
+        size = len(first.texts)
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if size + len(request.texts) > self.max_batch_size:
+                # 上限を超える場合は次のバッチの先頭に回す
+                self._pending = request
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.perf_counter()
+            texts = [text for request in batch for text in request.texts]
+            try:
+                results = classify_emotions(texts, self.max_batch_size, self.max_tokens_per_batch)
+                error = None
+            except Exception as e:
+                print(f"サーバーでの感情分析中にエラーが発生しました（{len(texts)}文）")
+                traceback.print_exc()
+                results, error = None, str(e)
+
+            finished = time.perf_counter()
+            offset = 0
+            with self._lock:
+                self.batches += 1
+                for request in batch:
+                    count = len(request.texts)
+                    if error is None:
+                        request.results = [_json_result(res) for res in results[offset:offset + count]]
+                    else:
+                        request.error = error
+                        self.errors += 1
+                    offset += count
+                    self.requests += 1
+                    self.sentences += count
+                    self.queue_wait.observe(started - request.enqueued)
+                    self.latency.observe(finished - request.enqueued)
+            for request in batch:
+                request.done.set()
+
+    def stats(self):
+        """処理件数・スループット・キューの深さ・レイテンシのパーセンタイルを辞書で返す"""
+        with self._lock:
+            uptime = time.time() - self.started
+            latency = self.latency.to_dict()
+            queue_wait = self.queue_wait.to_dict()
+            return {
+                'uptime_seconds': uptime,
+                'requests': self.requests,
+                'sentences': self.sentences,
+                'batches': self.batches,
+                'errors': self.errors,
+                'queue_depth': self.queue.qsize() + (1 if self._pending is not None else 0),
+                'requests_per_second': self.requests / uptime if uptime > 0 else 0.0,
+                'sentences_per_second': self.sentences / uptime if uptime > 0 else 0.0,
+                'mean_batch_size': self.sentences / self.batches if self.batches else 0.0,
+                'latency_ms': {key: latency[key] for key in ('mean_ms', 'p50_ms', 'p95_ms', 'p99_ms')},
+                'queue_wait_ms': {key: queue_wait[key] for key in ('mean_ms', 'p50_ms', 'p95_ms', 'p99_ms')},
+                'stages': metrics.to_dict(),
+            }
+
+
+def _json_result(result):
+    """classify_emotions の結果を JSON にできる辞書に変換する（失敗した文は None）"""
+    if result is None:
+        return None
+    return {'label': result['label'], 'label_id': result['label_id'], 'score': result['score'],
+            'probabilities': [float(p) for p in result['probabilities']]}
+
+
+def _handler_for(batcher):
+    class EmotionRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive を有効にする
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._send_json(200, {'status': 'ok'})
+            elif self.path == '/metrics':
+                self._send_json(200, batcher.stats())
+            else:
+                self._send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/classify':
+                self._send_json(404, {'error': 'not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                texts = payload['texts'] if isinstance(payload, dict) else None
+                if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                    raise ValueError("'texts' には文字列のリストを指定してください。")
+                if len(texts) > MAX_TEXTS_PER_REQUEST:
+                    raise ValueError(f"1リクエストの文は {MAX_TEXTS_PER_REQUEST} 件までです。")
+            except (KeyError, ValueError) as e:
+                self._send_json(400, {'error': str(e)})
+                return
+
+            try:
+                results = batcher.submit(texts) if texts else []
+            except TimeoutError as e:
+                self._send_json(504, {'error': str(e)})
+                return
+            except RuntimeError as e:
+                self._send_json(503, {'error': str(e)})
+                return
+            self._send_json(200, {'results': results})
+
+        def _send_json(self, status, data):
+            payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def address_string(self):
+            # Unix ソケットでは client_address が空になる
+            return self.client_address[0] if self.client_address else 'unix'
+
+        def log_message(self, format, *args):
+            pass  # アクセスログは出さない
+
+    return EmotionRequestHandler
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix ソケットで HTTP を受け付けるサーバー"""
+
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def create_server(batcher, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None):
+    """HTTP（localhost）または Unix ソケットのサーバーを生成する関数"""
+    handler = _handler_for(batcher)
+    if unix_socket:
+        return UnixHTTPServer(unix_socket, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """Unix ソケットに接続する HTTPConnection"""
+
+    def __init__(self, path, timeout=REQUEST_TIMEOUT_SECONDS):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def score_texts(texts, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None, timeout=REQUEST_TIMEOUT_SECONDS):
+    """
+    起動中のサーバーに文のリストを送り、文ごとの結果（label, label_id, score, probabilities）を返す関数。
+    他のスクリプトからはモデルをロードせずにこの関数だけで感情分析できる。
+    """
+    if unix_socket:
+        connection = UnixHTTPConnection(unix_socket, timeout)
+    else:
+        connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        body = json.dumps({'texts': list(texts)}, ensure_ascii=False).encode('utf-8')
+        connection.request('POST', '/classify', body, {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        data = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(f"感情分析サーバーがエラーを返しました（{response.status}）: {data.get('error')}")
+        return data['results']
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='感情分析モデルを常駐させ、ローカルの HTTP / Unix ソケットで文を受け付けます。')
+    parser.add_argument('--host', type=str, default=DEFAULT_HOST, help='待ち受けるアドレス（既定: localhost のみ）')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='待ち受けるポート')
+    parser.add_argument('--unix-socket', type=str, default=None, help='TCP の代わりに待ち受ける Unix ソケットのパス')
+    parser.add_argument('--max-batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE,
+                        help='複数のリクエストを1回の推論にまとめるときの最大文数')
+    parser.add_argument('--max-wait-ms', type=float, default=DEFAULT_MAX_WAIT_MS,
+                        help='バッチをまとめるために後続のリクエストを待つ最大時間（ミリ秒）')
+    parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE, help='待たせておけるリクエスト数の上限')
+    parser.add_argument('--max-tokens-per-batch', type=int, default=DEFAULT_MAX_TOKENS_PER_BATCH,
+                        help='1バッチあたりのパディング込みトークン数の上限')
+    parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND, help='推論バックエンド')
+    parser.add_argument('--onnx-path', type=str, default=None, help='ONNX バックエンドで使うモデルファイル')
+    add_compile_arguments(parser)
+    add_snapshot_arguments(parser)
+    parser.add_argument('--inference-cache', type=str, default=DEFAULT_INFERENCE_CACHE_PATH,
+                        help='文ごとの推論結果を保存する SQLite ファイル')
+    parser.add_argument('--no-inference-cache', action='store_true', help='推論キャッシュを使わない')
+    args = parser.parse_args()
+
+    # 段ごとの処理時間（トークナイズ・推論など）も /metrics で返す
+    metrics.enabled = True
+    configure_backend(args.backend, args.onnx_path, **compile_options_from_args(args))
+    configure_inference_cache(None if args.no_inference_cache else args.inference_cache)
+    configure_model_snapshot(snapshot_from_args(args, model_name))
+    load_model()
+
+    batcher = MicroBatcher(args.max_batch_size, args.max_wait_ms, args.max_queue, args.max_tokens_per_batch)
+    batcher.start()
+    server = create_server(batcher, args.host, args.port, args.unix_socket)
+    address = args.unix_socket or f"http://{args.host}:{server.server_address[1]}"
+    print(f"感情分析サーバーを起動しました: {address}（POST /classify, GET /metrics, GET /health、Ctrl+C で終了）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nサーバーを停止します。")
+    finally:
+        server.server_close()
+        if args.unix_socket and os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+        close_inference_cache()
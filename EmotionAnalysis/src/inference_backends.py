@@ -0,0 +1,329 @@
+# inference_backends.py
+
+import os
+import time
+from collections import deque
+
+# 利用できる推論バックエンド
+#   torch      : これまでどおりの fp32 PyTorch（基準）
+#   quantized  : Linear 層を動的 int8 量子化した PyTorch
+#   onnx       : ONNX にエクスポートしたモデルを ONNX Runtime で実行
+#   compiled   : 系列長をいくつかの長さに揃え、長さごとに torch.compile / TorchScript でコンパイルして実行
+BACKENDS = ('torch', 'quantized', 'onnx', 'compiled')
+DEFAULT_BACKEND = 'torch'
+
+# compiled バックエンドの既定値
+COMPILE_ENGINES = ('compile', 'torchscript')
+DEFAULT_COMPILE_ENGINE = 'compile'
+DEFAULT_LENGTH_BUCKETS = (32, 64, 128, 256, 512)  # 入力をパディングする系列長（この長さごとにコンパイルする）
+BUCKET_LATENCY_SAMPLES = 10_000
+
+# ONNX モデルの既定の保存先（リポジトリ直下の .cache/onnx/）
+DEFAULT_ONNX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '.cache', 'onnx')
+
+# モデルに渡す入力（token_type_ids はどのバックエンドにも渡さない）
+MODEL_INPUT_NAMES = ('input_ids', 'attention_mask')
+
+
+def default_onnx_path(model_name, revision):
+    """モデル名とリビジョンごとの ONNX ファイルの保存先を返す関数"""
+    return os.path.join(DEFAULT_ONNX_DIR, f"{model_name.replace('/', '--')}-{revision}.onnx")
+
+
+class TorchBackend:
+    """eager モードの PyTorch で推論するバックエンド"""
+
+    name = 'torch'
+
+    def __init__(self, model, device):
+        self.model = model
+        self.device = device
+
+    def __call__(self, inputs):
+        """パディング済みの入力（torch.Tensor の辞書）から確率ベクトル（ndarray）を返す"""
+        import torch
+
+        inputs = {k: inputs[k].to(self.device) for k in MODEL_INPUT_NAMES}
+        with torch.no_grad():
+            logits = self.model(**inputs).logits
+            return torch.softmax(logits, dim=1).float().cpu().numpy()
+
+
+class QuantizedTorchBackend(TorchBackend):
+    """Linear 層を動的 int8 量子化したモデルで推論するバックエンド（CPU 専用）"""
+
+    name = 'quantized'
+
+    def __init__(self, model, device):
+        import torch
+
+        if device.type != 'cpu':
+            raise ValueError('動的量子化バックエンドは CPU でのみ利用できます。')
+        # 元のモデル（fp32 の基準）は変更せず、量子化したコピーを作る
+        quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        super().__init__(quantized, device)
+
+
+class OnnxBackend:
+    """ONNX にエクスポートしたモデルを ONNX Runtime（CPU）で推論するバックエンド"""
+
+    name = 'onnx'
+
+    def __init__(self, model, onnx_path, num_threads=None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("ONNX バックエンドには onnxruntime が必要です: pip install onnxruntime onnx")
+
+        if not os.path.exists(onnx_path):
+            export_onnx(model, onnx_path)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+
+    def __call__(self, inputs):
+        import numpy as np
+
+        feeds = {k: inputs[k].cpu().numpy().astype(np.int64) for k in MODEL_INPUT_NAMES}
+        logits = self.session.run(['logits'], feeds)[0]
+        # softmax（オーバーフローしないよう最大値を引いてから exp を取る）
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return (exp / exp.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+def _logits_module(model):
+    """(input_ids, attention_mask) を受け取りロジットだけを返すモジュールで包む（トレース・コンパイル用）"""
+    import torch
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self, wrapped):
+            super().__init__()
+            self.wrapped = wrapped
+
+        def forward(self, input_ids, attention_mask):
+            return self.wrapped(input_ids=input_ids, attention_mask=attention_mask).logits
+
+    return LogitsOnly(model).eval()
+
+
+class CompiledTorchBackend:
+    """
+    系列長を length_buckets のいずれかにパディングし、長さごとにコンパイルしたモデルで推論するバックエンド。
+    engine='compile' は torch.compile、'torchscript' は torch.jit.trace + freeze を使う。
+    系列長は固定されるのでカーネルを特殊化でき、起動時に全ての長さをウォームアップしてコンパイルを済ませておく。
+    torch.compile ではバッチの大きさだけを動的な次元にし、長さごとに1つのグラフでどのバッチサイズも扱う。
+    長さごとのコンパイル時間と推論時間は report() で確認できる。
+    """
+
+    name = 'compiled'
+
+    def __init__(self, model, device, engine=DEFAULT_COMPILE_ENGINE, length_buckets=DEFAULT_LENGTH_BUCKETS,
+                 warmup=True):
+        if engine not in COMPILE_ENGINES:
+            raise ValueError(f"未対応のコンパイル方式です: {engine}（{', '.join(COMPILE_ENGINES)} のいずれか）")
+        self.device = device
+        self.engine = engine
+        self.pad_token_id = model.config.pad_token_id or 0
+        max_positions = getattr(model.config, 'max_position_embeddings', max(length_buckets))
+        self.length_buckets = sorted({min(length, max_positions) for length in length_buckets})
+        self.module = _logits_module(model)
+        self.stats = {length: {'compile_seconds': 0.0, 'batches': 0, 'sentences': 0, 'padded_tokens': 0,
+                               'tokens': 0, 'seconds': 0.0, 'samples': deque(maxlen=BUCKET_LATENCY_SAMPLES)}
+                      for length in self.length_buckets}
+        self._compiled = {}
+
+        if engine == 'compile':
+            import torch
+            import torch._dynamo
+            # 長さごと・バッチサイズ 1 とそれ以外で別のグラフになるので、その分だけ再コンパイルを許す
+            torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit,
+                                                        2 * len(self.length_buckets) + 2)
+            # dynamic=None では mark_dynamic / mark_static で指定した次元の扱いに従う（_build を参照）
+            self._compiled_module = torch.compile(self.module, dynamic=None)
+        if warmup:
+            self.warmup()
+
+    def _dummy(self, batch_size, length):
+        import torch
+
+        input_ids = torch.full((batch_size, length), self.pad_token_id, dtype=torch.long, device=self.device)
+        attention_mask = torch.ones((batch_size, length), dtype=torch.long, device=self.device)
+        return input_ids, attention_mask
+
+    def _build(self, length):
+        """長さ length 用のモデルを用意し、ウォームアップ（コンパイル）を済ませる"""
+        import torch
+
+        start = time.perf_counter()
+        if self.engine == 'torchscript':
+            # トレースでは系列長が定数として埋め込まれるので、長さごとに別々にトレースする
+            with torch.no_grad():
+                traced = torch.jit.trace(self.module, self._dummy(2, length), strict=False, check_trace=False)
+                compiled = torch.jit.freeze(traced)
+        else:
+            compiled = self._compiled_module
+        for batch_size in (2, 1):
+            # 推論時と同じく inference_mode の外で作った入力で呼び、入力の種類の違いで再コンパイルされないようにする
+            input_ids, attention_mask = self._dummy(batch_size, length)
+            if self.engine == 'compile':
+                for tensor in (input_ids, attention_mask):
+                    # 系列長は固定（別の長さを見ても動的な次元にしない）、バッチの大きさは動的にする
+                    # （バッチサイズ 1 は特殊化されるので別のグラフになる）
+                    torch._dynamo.mark_static(tensor, 1)
+                    if batch_size > 1:
+                        torch._dynamo.mark_dynamic(tensor, 0)
+            with torch.inference_mode():
+                compiled(input_ids, attention_mask)
+        self.stats[length]['compile_seconds'] = time.perf_counter() - start
+        self._compiled[length] = compiled
+        return compiled
+
+    def warmup(self):
+        """全ての長さをコンパイルしておく（初回の推論でコンパイル待ちが起きないようにする）"""
+        for length in self.length_buckets:
+            if length not in self._compiled:
+                self._build(length)
+                print(f"  系列長 {length} をコンパイルしました（{self.stats[length]['compile_seconds']:.2f} 秒）")
+
+    def _bucket_for(self, length):
+        for bucket in self.length_buckets:
+            if length <= bucket:
+                return bucket
+        return None
+
+    def __call__(self, inputs):
+        """パディング済みの入力（torch.Tensor の辞書）から確率ベクトル（ndarray）を返す"""
+        import torch
+
+        input_ids = inputs['input_ids'].to(self.device)
+        attention_mask = inputs['attention_mask'].to(self.device)
+        batch_size, length = input_ids.shape
+        bucket = self._bucket_for(length)
+        start = time.perf_counter()
+        if bucket is not None and bucket > length:
+            # パディングは inference_mode の外で行い、パディングの有無でコンパイル済みのグラフが変わらないようにする
+            input_ids = torch.nn.functional.pad(input_ids, (0, bucket - length), value=self.pad_token_id)
+            attention_mask = torch.nn.functional.pad(attention_mask, (0, bucket - length), value=0)
+        if bucket is not None:
+            # コンパイル済みのモジュールは真偽値にできない（len() を持たない）ので None と比べる
+            compiled = self._compiled.get(bucket)
+            if compiled is None:
+                compiled = self._build(bucket)
+        with torch.inference_mode():
+            if bucket is None:
+                # どの長さにも収まらない入力はコンパイルせずに実行する
+                logits = self.module(input_ids, attention_mask)
+            else:
+                logits = compiled(input_ids, attention_mask)
+            probabilities = torch.softmax(logits, dim=1).float().cpu().numpy()
+        if bucket is not None:
+            elapsed = time.perf_counter() - start
+            stats = self.stats[bucket]
+            stats['batches'] += 1
+            stats['sentences'] += batch_size
+            stats['tokens'] += int(inputs['attention_mask'].sum())
+            stats['padded_tokens'] += batch_size * bucket
+            stats['seconds'] += elapsed
+            stats['samples'].append(elapsed)
+        return probabilities
+
+    def report(self):
+        """系列長ごとのコンパイル時間・バッチ数・平均/p50/p95 の推論時間・文/秒・パディングの割合を表で返す"""
+        from stage_pipeline import percentile  # Common/ は emotion_model が読み込めるようにしている
+
+        lines = [f"{'系列長':>6}{'コンパイル(秒)':>14}{'バッチ数':>9}{'文数':>9}{'平均(ms)':>10}{'p50(ms)':>9}"
+                 f"{'p95(ms)':>9}{'文/秒':>10}{'パディング':>10}"]
+        for length, stats in self.stats.items():
+            samples = list(stats['samples'])
+            mean = stats['seconds'] / stats['batches'] * 1000 if stats['batches'] else 0.0
+            p50 = percentile(samples, 50) * 1000
+            p95 = percentile(samples, 95) * 1000
+            speed = stats['sentences'] / stats['seconds'] if stats['seconds'] else 0.0
+            padding = 1 - stats['tokens'] / stats['padded_tokens'] if stats['padded_tokens'] else 0.0
+            lines.append(f"{length:>6}{stats['compile_seconds']:>14.2f}{stats['batches']:>9}{stats['sentences']:>9}"
+                         f"{mean:>10.1f}{p50:>9.1f}{p95:>9.1f}{speed:>10.1f}{padding * 100:>9.1f}%")
+        return '\n'.join(lines)
+
+
+def export_onnx(model, onnx_path):
+    """モデルを input_ids / attention_mask の2入力で ONNX にエクスポートする関数"""
+    import torch
+
+    print(f"モデルを ONNX にエクスポート中: {onnx_path}")
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    cpu_model = model.to('cpu')
+    dummy = {
+        'input_ids': torch.ones((1, 8), dtype=torch.long),
+        'attention_mask': torch.ones((1, 8), dtype=torch.long),
+    }
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in MODEL_INPUT_NAMES}
+    dynamic_axes['logits'] = {0: 'batch'}
+    try:
+        torch.onnx.export(
+            cpu_model, (dummy,), onnx_path,
+            input_names=list(MODEL_INPUT_NAMES), output_names=['logits'],
+            dynamic_axes=dynamic_axes, opset_version=17)
+    except Exception:
+        # 書きかけのファイルが残ると次回以降に読み込まれてしまうため削除する
+        if os.path.exists(onnx_path):
+            os.remove(onnx_path)
+        raise
+
+
+def load_model_for_backend(model_name, backend_name, loader=None):
+    """
+    バックエンドに合わせてモデルをロードする関数。compiled バックエンドでは注意機構に
+    SDPA（torch.nn.functional.scaled_dot_product_attention）を使う（対応していないモデルは従来の実装）。
+    loader は (モデル名, **kwargs) からモデルを返す関数で、既定は from_pretrained。
+    """
+    if loader is None:
+        from transformers import AutoModelForSequenceClassification
+        loader = AutoModelForSequenceClassification.from_pretrained
+
+    if backend_name == 'compiled':
+        try:
+            return loader(model_name, attn_implementation='sdpa')
+        except (ValueError, ImportError) as e:
+            print(f"このモデルは SDPA に対応していないため、従来の注意機構を使います: {e}")
+    return loader(model_name)
+
+
+def add_compile_arguments(parser):
+    """compiled バックエンドのオプションを argparse に追加する関数"""
+    parser.add_argument('--compile-engine', choices=COMPILE_ENGINES, default=DEFAULT_COMPILE_ENGINE,
+                        help="compiled バックエンドのコンパイル方式（'compile': torch.compile, 'torchscript': TorchScript）")
+    parser.add_argument('--length-buckets', type=str, default=','.join(map(str, DEFAULT_LENGTH_BUCKETS)),
+                        help='compiled バックエンドで入力をパディングする系列長（カンマ区切り、長さごとにコンパイルする）')
+    parser.add_argument('--torch-threads', type=int, default=None,
+                        help='推論に使う CPU スレッド数（どのバックエンドにも適用、--all-members ではワーカーごとの数）')
+
+
+def compile_options_from_args(args):
+    """argparse の結果から create_backend に渡す設定（スレッド数と compiled バックエンドの設定）を返す関数"""
+    buckets = tuple(int(length) for length in args.length_buckets.split(',') if length.strip())
+    return {'engine': args.compile_engine, 'length_buckets': buckets, 'num_threads': args.torch_threads}
+
+
+def create_backend(name, model, device, onnx_path=None, num_threads=None, **options):
+    """
+    バックエンド名から推論バックエンドを生成する関数（options は compiled バックエンドの設定）。
+    num_threads を指定すると、どのバックエンドでも推論に使う CPU スレッド数をその数にする。
+    """
+    if num_threads:
+        import torch
+
+        torch.set_num_threads(num_threads)
+    if name == 'compiled':
+        return CompiledTorchBackend(model, device, **options)
+    if name == 'torch':
+        return TorchBackend(model, device)
+    if name == 'quantized':
+        return QuantizedTorchBackend(model, device)
+    if name == 'onnx':
+        if onnx_path is None:
+            raise ValueError('ONNX バックエンドには onnx_path の指定が必要です。')
+        return OnnxBackend(model, onnx_path, num_threads)
+    raise ValueError(f"未対応の推論バックエンドです: {name}（{', '.join(BACKENDS)} のいずれか）")
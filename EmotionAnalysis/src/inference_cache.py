@@ -0,0 +1,128 @@
+# inference_cache.py
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+# 推論キャッシュの既定の保存先（リポジトリ直下の .cache/）
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '.cache', 'inference_cache.sqlite3')
+DEFAULT_MEMORY_CAPACITY = 100_000  # メモリ上に保持する文の数
+
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_sentence(sentence):
+    """キャッシュのキーに使う正規化（NFKC と空白の除去）"""
+    return _WHITESPACE_PATTERN.sub('', unicodedata.normalize('NFKC', sentence))
+
+
+class InferenceCache:
+    """
+    文ごとの確率ベクトルをキャッシュする2階層の推論キャッシュ。
+    キーは正規化した文・モデル名・リビジョンの SHA-256 で、メモリ上の LRU と SQLite の永続層を持つ。
+    argmax ではなく確率ベクトル全体を保存するので、集計し直す際にモデルは不要。
+    """
+
+    def __init__(self, model_name, revision, path=DEFAULT_CACHE_PATH, capacity=DEFAULT_MEMORY_CAPACITY):
+        self.model_name = model_name
+        self.revision = revision
+        self.path = path
+        self.capacity = capacity
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sentence_probabilities (
+                    key TEXT PRIMARY KEY,
+                    model_name TEXT NOT NULL,
+                    revision TEXT NOT NULL,
+                    sentence TEXT NOT NULL,
+                    probabilities BLOB NOT NULL
+                )
+            """)
+            self._conn.commit()
+
+    def key_for(self, sentence):
+        payload = f"{self.model_name}\0{self.revision}\0{normalize_sentence(sentence)}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _remember(self, key, probabilities):
+        self._memory[key] = probabilities
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def get_many(self, sentences):
+        """文ごとの確率ベクトル（float32 の ndarray、未登録なら None）のリストを返す"""
+        keys = [self.key_for(sentence) for sentence in sentences]
+        results = [None] * len(keys)
+        with self._lock:
+            on_disk = []
+            for i, key in enumerate(keys):
+                probabilities = self._memory.get(key)
+                if probabilities is not None:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    results[i] = probabilities
+                else:
+                    on_disk.append(i)
+
+            if on_disk and self._conn is not None:
+                wanted = list({keys[i] for i in on_disk})
+                found = {}
+                # SQLite のパラメータ数上限を超えないように分割して問い合わせる
+                for start in range(0, len(wanted), 500):
+                    chunk = wanted[start:start + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    rows = self._conn.execute(
+                        f'SELECT key, probabilities FROM sentence_probabilities WHERE key IN ({placeholders})', chunk)
+                    for key, blob in rows:
+                        found[key] = np.frombuffer(blob, dtype=np.float32)
+                for i in on_disk:
+                    probabilities = found.get(keys[i])
+                    if probabilities is not None:
+                        self.disk_hits += 1
+                        self._remember(keys[i], probabilities)
+                        results[i] = probabilities
+
+            self.misses += sum(1 for probabilities in results if probabilities is None)
+        return results
+
+    def put_many(self, items):
+        """(文, 確率ベクトル) の組をまとめて保存する"""
+        rows = []
+        with self._lock:
+            for sentence, probabilities in items:
+                key = self.key_for(sentence)
+                probabilities = np.asarray(probabilities, dtype=np.float32)
+                self._remember(key, probabilities)
+                rows.append((key, self.model_name, self.revision, normalize_sentence(sentence), probabilities.tobytes()))
+            if rows and self._conn is not None:
+                self._conn.executemany('INSERT OR REPLACE INTO sentence_probabilities VALUES (?, ?, ?, ?, ?)', rows)
+                self._conn.commit()
+
+    def summary(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hit_rate = (self.memory_hits + self.disk_hits) / lookups * 100 if lookups else 0.0
+        return (f"推論キャッシュ: メモリヒット {self.memory_hits} 件, ディスクヒット {self.disk_hits} 件, "
+                f"ミス {self.misses} 件（ヒット率 {hit_rate:.1f}%）")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,293 @@
+# model_snapshot.py
+
+import argparse
+import contextlib
+import io
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import time
+import traceback
+from datetime import datetime, timezone
+
+from inference_backends import BACKENDS, DEFAULT_BACKEND
+
+# モデルのスナップショットの既定の保存先（リポジトリ直下の .cache/models/）
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '.cache', 'models')
+MANIFEST_FILE = 'snapshot.json'
+LABEL_MAP_FILE = 'label_map.json'
+WEIGHTS_INDEX_FILE = 'model.safetensors.index.json'
+WEIGHTS_FILE = 'model.safetensors'
+
+# safetensors の dtype 名 -> torch の dtype の属性名
+_SAFETENSORS_DTYPES = {
+    'F64': 'float64', 'F32': 'float32', 'F16': 'float16', 'BF16': 'bfloat16',
+    'I64': 'int64', 'I32': 'int32', 'I16': 'int16', 'I8': 'int8', 'U8': 'uint8', 'BOOL': 'bool',
+}
+
+# report で各ワーカーに1回だけ推論させる文（重みのページを実際に読み込ませてからメモリを測る）
+_WARMUP_SENTENCES = ['今日はとても楽しかったです。', '明日のライブが待ち遠しいです。']
+
+
+def default_snapshot_path(model_name, snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+    """モデル名ごとのスナップショットの保存先を返す関数"""
+    safe_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in model_name)
+    return os.path.join(snapshot_dir, safe_name)
+
+
+def is_snapshot(path):
+    """path が保存済みのスナップショットかを返す関数"""
+    return bool(path) and os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+
+def read_manifest(path):
+    """スナップショットの情報（モデル名・リビジョン・重みファイルの一覧など）を返す関数"""
+    with open(os.path.join(path, MANIFEST_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def read_label_map(path):
+    """スナップショットに保存したラベルの対応（id2label と各ラベルの意味）を返す関数"""
+    with open(os.path.join(path, LABEL_MAP_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _weight_files(path):
+    """保存された safetensors ファイルの一覧（分割されている場合は全ファイル）を返す"""
+    index_path = os.path.join(path, WEIGHTS_INDEX_FILE)
+    if os.path.exists(index_path):
+        with open(index_path, encoding='utf-8') as f:
+            return sorted(set(json.load(f)['weight_map'].values()))
+    return [WEIGHTS_FILE]
+
+
+def save_snapshot(model_name, path, label_meanings):
+    """
+    Hugging Face Hub（またはローカル）のモデルを、safetensors の重み・トークナイザー・ラベルの対応を
+    まとめたディレクトリに保存する関数。書きかけを読まないよう、一時ディレクトリに保存してから置き換える。
+    """
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    revision = getattr(model.config, '_commit_hash', None) or 'main'
+
+    staging_path = f"{path}.tmp"
+    shutil.rmtree(staging_path, ignore_errors=True)
+    model.save_pretrained(staging_path, safe_serialization=True)
+    tokenizer.save_pretrained(staging_path)
+    with open(os.path.join(staging_path, LABEL_MAP_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'id2label': {str(i): label for i, label in model.config.id2label.items()},
+                   'label_meanings': label_meanings}, f, ensure_ascii=False, indent=2)
+    manifest = {
+        'model_name': model_name,
+        'revision': revision,  # 推論キャッシュのキーが Hub からロードした場合と変わらないようにする
+        'format': 'safetensors',
+        'weights': _weight_files(staging_path),
+        'created': datetime.now(timezone.utc).isoformat(),
+    }
+    # マニフェストを最後に書くので、マニフェストのあるディレクトリは完成している
+    with open(os.path.join(staging_path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    os.replace(staging_path, path)
+    return manifest
+
+
+def mmap_safetensors(filename):
+    """
+    safetensors ファイルをメモリマップし、ファイルのページをそのまま指すテンソルの辞書を返す関数。
+    プライベートな写像（ACCESS_COPY）なので、書き込まない限り同じホストのプロセスはページキャッシュを共有する。
+    """
+    import torch
+
+    with open(filename, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    header_size = struct.unpack('<Q', mapped[:8])[0]
+    header = json.loads(mapped[8:8 + header_size])
+    header.pop('__metadata__', None)
+    data_start = 8 + header_size
+
+    tensors = {}
+    for name, info in header.items():
+        dtype = getattr(torch, _SAFETENSORS_DTYPES[info['dtype']])
+        begin, end = info['data_offsets']
+        if begin == end:
+            tensors[name] = torch.empty(info['shape'], dtype=dtype)
+            continue
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        # frombuffer はコピーせず、mapped への参照を持ち続ける
+        tensors[name] = torch.frombuffer(mapped, dtype=dtype, count=count, offset=data_start + begin).view(info['shape'])
+    return tensors
+
+
+def load_snapshot_model(path, **kwargs):
+    """
+    スナップショットからモデルを組み立てる関数（kwargs は from_config に渡す、例えば attn_implementation）。
+    パラメータは確保・初期化せず、メモリマップした重みをそのまま割り当てる。
+    """
+    from transformers import AutoConfig, AutoModelForSequenceClassification
+    try:
+        from transformers.modeling_utils import no_init_weights
+    except ImportError:
+        no_init_weights = contextlib.nullcontext  # 乱数での初期化が省けないだけで、結果は変わらない
+
+    manifest = read_manifest(path)
+    config = AutoConfig.from_pretrained(path)
+    with no_init_weights():
+        model = AutoModelForSequenceClassification.from_config(config, **kwargs)
+
+    state_dict = {}
+    for filename in manifest['weights']:
+        state_dict.update(mmap_safetensors(os.path.join(path, filename)))
+    result = model.load_state_dict(state_dict, strict=False, assign=True)
+    # safetensors には共有（tie）された重みが1つしか保存されないので、結び直す
+    model.tie_weights()
+    tied_keys = set(getattr(model, '_tied_weights_keys', None) or [])
+    missing_keys = [key for key in result.missing_keys if key not in tied_keys]
+    if missing_keys or result.unexpected_keys:
+        raise RuntimeError(f"スナップショットの重みがモデルと一致しません: {path}"
+                           f"（不足: {missing_keys}, 不要: {result.unexpected_keys}）")
+    return model
+
+
+def add_snapshot_arguments(parser):
+    """モデルのスナップショット関連のオプションを argparse に追加する関数"""
+    parser.add_argument('--model-snapshot', type=str, default=None,
+                        help='モデルのスナップショット（model_snapshot.py snapshot で作成、既定は .cache/models/<モデル名>）')
+    parser.add_argument('--no-model-snapshot', action='store_true', help='スナップショットを使わず Hub からロードする')
+
+
+def snapshot_from_args(args, model_name):
+    """argparse の結果からスナップショットのパスを返す関数（--no-model-snapshot なら None）"""
+    if args.no_model_snapshot:
+        return None
+    return args.model_snapshot or default_snapshot_path(model_name)
+
+
+def memory_usage_mb():
+    """このプロセスの常駐メモリ（RSS とその内訳、PSS）を MB で返す関数（Linux 以外では空の辞書）"""
+    usage = {}
+    for filename, keys in (('/proc/self/status', ('VmRSS', 'RssAnon', 'RssFile')),
+                           ('/proc/self/smaps_rollup', ('Pss',))):
+        try:
+            with open(filename, encoding='utf-8') as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key in keys:
+                        usage[key] = int(value.split()[0]) / 1024  # kB -> MB
+        except OSError:
+            pass
+    return usage
+
+
+def _measure_worker(model_name, snapshot_path, backend_name, loaded_barrier, done_barrier, results):
+    """1つのワーカーとしてモデルをロードし、起動時間とメモリ使用量を results に入れる"""
+    result = {'snapshot': bool(snapshot_path)}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            os.environ['EMOTION_MODEL_NAME'] = model_name  # emotion_model の import 前に指定する
+            import emotion_model
+            emotion_model.configure_backend(backend_name)
+            emotion_model.configure_inference_cache(None)
+            emotion_model.configure_model_snapshot(snapshot_path)
+            emotion_model.load_model()
+            result['load_seconds'] = time.perf_counter() - start
+            emotion_model.classify_emotions(_WARMUP_SENTENCES)
+    except BaseException as e:  # load_model は失敗すると sys.exit する
+        result['error'] = repr(e)
+        loaded_barrier.abort()
+    try:
+        # 全ワーカーがロードし終えてから測る（共有されているページは PSS で頭割りになる）
+        loaded_barrier.wait()
+        result.update(memory_usage_mb())
+    except Exception:
+        pass
+    results.put(result)
+    try:
+        done_barrier.wait()
+    except Exception:
+        pass
+
+
+def measure_startup(model_name, snapshot_path, workers, backend_name):
+    """workers 個のプロセスで同時にモデルをロードし、ワーカーごとの起動時間とメモリ使用量のリストを返す関数"""
+    import multiprocessing
+
+    context = multiprocessing.get_context('spawn')
+    loaded_barrier = context.Barrier(workers, timeout=600)
+    done_barrier = context.Barrier(workers, timeout=600)
+    results = context.Queue()
+    processes = [context.Process(target=_measure_worker,
+                                 args=(model_name, snapshot_path, backend_name, loaded_barrier, done_barrier, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    measurements = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return measurements
+
+
+def print_startup_report(model_name, snapshot_path, workers, backend_name):
+    """Hub からのロードとスナップショットからのロードで、ワーカーごとの起動時間と RSS を比較して表示する関数"""
+    print(f"{workers} 個のワーカーで同時にロードして比較します（モデル: {model_name}, バックエンド: {backend_name}）")
+    header = (f"{'ロード元':<12}{'起動(秒)':>10}{'RSS(MB)':>10}{'匿名(MB)':>10}{'ファイル(MB)':>13}"
+              f"{'PSS(MB)':>10}{'PSS合計(MB)':>13}")
+    rows = []
+    for label, path in (('hub', None), ('snapshot', snapshot_path)):
+        measurements = measure_startup(model_name, path, workers, backend_name)
+        errors = [m['error'] for m in measurements if 'error' in m]
+        if errors:
+            rows.append(f"{label:<12}失敗しました: {errors[0]}")
+            continue
+
+        def mean(key):
+            values = [m[key] for m in measurements if key in m]
+            return sum(values) / len(values) if values else float('nan')
+
+        total_pss = sum(m.get('Pss', float('nan')) for m in measurements)
+        rows.append(f"{label:<12}{mean('load_seconds'):>10.2f}{mean('VmRSS'):>10.1f}{mean('RssAnon'):>10.1f}"
+                    f"{mean('RssFile'):>13.1f}{mean('Pss'):>10.1f}{total_pss:>13.1f}")
+    print(header)
+    print('\n'.join(rows))
+    print("RSS・PSS は各ワーカーの平均。スナップショットの重みはファイルのページ（RssFile）として共有されるため、"
+          "PSS 合計がワーカー数に比例して増えにくくなります。")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='感情分析モデルのローカルスナップショットを作成・比較します。')
+    parser.add_argument('command', choices=('snapshot', 'report'),
+                        help="'snapshot': safetensors の重み・トークナイザー・ラベルの対応を保存, "
+                             "'report': Hub とスナップショットからのロードで起動時間と RSS を比較")
+    parser.add_argument('--model', type=str, default=None, help='モデル名（既定は emotion_model の model_name）')
+    parser.add_argument('--output', type=str, default=None, help='スナップショットの保存先（既定は .cache/models/<モデル名>）')
+    parser.add_argument('--workers', type=int, default=4, help='report で同時に起動するワーカー数')
+    parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND, help='report で使う推論バックエンド')
+    args = parser.parse_args()
+
+    import emotion_model
+
+    model_name = args.model or emotion_model.model_name
+    snapshot_path = args.output or default_snapshot_path(model_name)
+    if args.command == 'snapshot':
+        try:
+            print(f"スナップショットを作成中: {model_name}")
+            manifest = save_snapshot(model_name, snapshot_path, emotion_model.label_meanings)
+        except Exception as e:
+            print("スナップショットの作成に失敗しました。")
+            traceback.print_exc()
+            sys.exit(1)
+        size = sum(os.path.getsize(os.path.join(snapshot_path, name)) for name in manifest['weights'])
+        print(f"スナップショットを保存しました: {snapshot_path}（リビジョン {manifest['revision']}, 重み {size / 1e6:.1f} MB）")
+    else:
+        if not is_snapshot(snapshot_path):
+            print(f"スナップショットがありません: {snapshot_path}（先に 'snapshot' を実行してください）")
+            sys.exit(1)
+        print_startup_report(model_name, snapshot_path, args.workers, args.backend)
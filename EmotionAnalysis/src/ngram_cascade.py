@@ -0,0 +1,357 @@
+# ngram_cascade.py
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import traceback
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from inference_cache import DEFAULT_CACHE_PATH, normalize_sentence
+
+# n-gram モデルの既定の保存先（リポジトリ直下の .cache/cascade/）
+DEFAULT_CASCADE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '.cache', 'cascade')
+DEFAULT_NUM_BUCKETS = 2 ** 18   # 文字 n-gram をハッシュで割り当てる特徴量の数
+DEFAULT_MAX_ORDER = 3           # 1〜3文字の n-gram を使う
+DEFAULT_TARGET_AGREEMENT = 0.97  # n-gram モデルに任せる文でのモデルとの一致率の目標（しきい値の選択に使う）
+HOLDOUT_BUCKETS = 10            # 文のハッシュで 1/10 を評価用に取り分ける
+THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98, 0.99)
+
+_TEXT_START = '\x02'
+_TEXT_END = '\x03'
+
+
+def default_cascade_path(model_name, cascade_dir=DEFAULT_CASCADE_DIR):
+    """モデル名ごとの n-gram モデルの保存先を返す関数"""
+    safe_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in model_name)
+    return os.path.join(cascade_dir, f"{safe_name}.npz")
+
+
+def hashed_ngrams(text, num_buckets=DEFAULT_NUM_BUCKETS, max_order=DEFAULT_MAX_ORDER):
+    """正規化済みの文の 1〜max_order 文字の n-gram を、ハッシュした特徴量の番号の配列にする関数"""
+    padded = f"{_TEXT_START}{text}{_TEXT_END}"
+    grams = {padded[i:i + n] for n in range(1, max_order + 1) for i in range(len(padded) - n + 1)}
+    return np.array(sorted({zlib.crc32(gram.encode('utf-8')) % num_buckets for gram in grams}), dtype=np.int64)
+
+
+def _softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class HashedNgramClassifier:
+    """
+    文字 n-gram をハッシュした特徴量の線形（softmax）分類器。
+    推論キャッシュに保存されたモデルの確率ベクトルを教師として蒸留し、1文あたり数十マイクロ秒で確率を返す。
+    特徴量は文ごとに 1/sqrt(n-gram 数) で重み付けし、長い文でもロジットの大きさが揃うようにする。
+    """
+
+    def __init__(self, num_labels, num_buckets=DEFAULT_NUM_BUCKETS, max_order=DEFAULT_MAX_ORDER, meta=None):
+        self.num_labels = num_labels
+        self.num_buckets = num_buckets
+        self.max_order = max_order
+        self.weights = np.zeros((num_buckets, num_labels), dtype=np.float32)
+        self.bias = np.zeros(num_labels, dtype=np.float32)
+        self.meta = dict(meta or {})
+
+    def features(self, sentence):
+        return hashed_ngrams(normalize_sentence(sentence), self.num_buckets, self.max_order)
+
+    @staticmethod
+    def _batch(rows):
+        lengths = np.array([len(row) for row in rows], dtype=np.int64)
+        indices = np.concatenate(rows)
+        values = np.repeat(1 / np.sqrt(lengths), lengths).astype(np.float32)
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        return indices, values, offsets, lengths
+
+    def _logits(self, indices, values, offsets):
+        # 全ての文に先頭・末尾の記号の n-gram があるので、空の行はできない
+        return np.add.reduceat(self.weights[indices] * values[:, None], offsets, axis=0) + self.bias
+
+    def predict_features(self, rows):
+        """特徴量の配列のリストから確率ベクトル（文数 × ラベル数）を返す"""
+        if not rows:
+            return np.zeros((0, self.num_labels), dtype=np.float32)
+        indices, values, offsets, _ = self._batch(rows)
+        return _softmax(self._logits(indices, values, offsets)).astype(np.float32)
+
+    def predict_proba(self, sentences):
+        """文のリストから確率ベクトル（文数 × ラベル数）を返す"""
+        return self.predict_features([self.features(sentence) for sentence in sentences])
+
+    def fit(self, rows, targets, epochs=5, batch_size=256, learning_rate=0.5, l2=1e-6, seed=0):
+        """特徴量の配列のリストと教師の確率ベクトルから、交差エントロピーを AdaGrad で最小化する"""
+        rng = np.random.default_rng(seed)
+        weight_accumulator = np.zeros_like(self.weights)
+        bias_accumulator = np.zeros_like(self.bias)
+        for epoch in range(epochs):
+            total_loss = 0.0
+            order = rng.permutation(len(rows))
+            for start in range(0, len(rows), batch_size):
+                batch = order[start:start + batch_size]
+                indices, values, offsets, lengths = self._batch([rows[i] for i in batch])
+                probabilities = _softmax(self._logits(indices, values, offsets))
+                target = targets[batch]
+                total_loss -= float((target * np.log(probabilities + 1e-9)).sum())
+
+                delta = (probabilities - target) / len(batch)
+                touched, inverse = np.unique(indices, return_inverse=True)
+                gradient = np.zeros((len(touched), self.num_labels), dtype=np.float32)
+                np.add.at(gradient, inverse, values[:, None] * np.repeat(delta, lengths, axis=0))
+                gradient += l2 * self.weights[touched]
+                weight_accumulator[touched] += gradient ** 2
+                self.weights[touched] -= learning_rate * gradient / (np.sqrt(weight_accumulator[touched]) + 1e-8)
+
+                bias_gradient = delta.sum(axis=0)
+                bias_accumulator += bias_gradient ** 2
+                self.bias -= learning_rate * bias_gradient / (np.sqrt(bias_accumulator) + 1e-8)
+            print(f"  エポック {epoch + 1}/{epochs}: 交差エントロピー {total_loss / max(1, len(rows)):.4f}")
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        meta = {**self.meta, 'num_labels': self.num_labels, 'num_buckets': self.num_buckets,
+                'max_order': self.max_order}
+        # 書きかけのファイルを読まないよう、一時ファイルに保存してから置き換える
+        staging_path = f"{path}.tmp.npz"
+        np.savez_compressed(staging_path, weights=self.weights, bias=self.bias,
+                            meta=np.array(json.dumps(meta, ensure_ascii=False)))
+        os.replace(staging_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            classifier = cls(meta['num_labels'], meta['num_buckets'], meta['max_order'], meta)
+            classifier.weights = data['weights']
+            classifier.bias = data['bias']
+        return classifier
+
+
+def agreement_table(student, teacher, thresholds=THRESHOLDS):
+    """
+    しきい値ごとに、n-gram モデルに任せる文の割合と、任せた文・全体でのモデルとのラベル一致率を返す関数。
+    しきい値未満の文はモデルで推論するので、全体の一致率ではその分は一致として数える。
+    """
+    confidence = student.max(axis=1)
+    agrees = student.argmax(axis=1) == teacher.argmax(axis=1)
+    rows = []
+    for threshold in thresholds:
+        routed = confidence >= threshold
+        coverage = float(routed.mean()) if len(routed) else 0.0
+        routed_agreement = float(agrees[routed].mean()) if routed.any() else 1.0
+        overall = float((agrees | ~routed).mean()) if len(routed) else 1.0
+        rows.append({'threshold': threshold, 'coverage': coverage, 'routed_agreement': routed_agreement,
+                     'overall_agreement': overall})
+    return rows
+
+
+def format_agreement_table(rows):
+    lines = [f"{'しきい値':>8}{'n-gram の割合':>14}{'n-gram の一致率':>16}{'全体の一致率':>14}"]
+    for row in rows:
+        lines.append(f"{row['threshold']:>8.2f}{row['coverage'] * 100:>13.1f}%{row['routed_agreement'] * 100:>15.1f}%"
+                     f"{row['overall_agreement'] * 100:>13.1f}%")
+    return '\n'.join(lines)
+
+
+def choose_threshold(rows, target_agreement=DEFAULT_TARGET_AGREEMENT):
+    """任せた文での一致率が目標を満たす最も低いしきい値を返す関数（満たすものが無ければ 1.0、つまりほぼすべての文をモデルに回す）"""
+    for row in rows:
+        if row['coverage'] > 0 and row['routed_agreement'] >= target_agreement:
+            return row['threshold']
+    return 1.0
+
+
+def most_common_revision(cache_path, model_name):
+    """推論キャッシュで最も多くの文が保存されている fp32 のリビジョンを返す関数（無ければ None）"""
+    with contextlib.closing(sqlite3.connect(cache_path)) as conn:
+        rows = conn.execute('SELECT revision, COUNT(*) FROM sentence_probabilities WHERE model_name = ? '
+                            'GROUP BY revision ORDER BY COUNT(*) DESC', (model_name,)).fetchall()
+    # '+quantized' などの付いたリビジョンは fp32 以外のバックエンドの結果
+    return next((revision for revision, _ in rows if '+' not in revision), None)
+
+
+def load_distillation_data(cache_path, model_name, revision, exclude_prefix=None):
+    """推論キャッシュから (正規化済みの文のリスト, 確率ベクトルの配列) を読み出す関数（記事単位のウィンドウは除く）"""
+    texts = []
+    targets = []
+    with contextlib.closing(sqlite3.connect(cache_path)) as conn:
+        rows = conn.execute('SELECT sentence, probabilities FROM sentence_probabilities '
+                            'WHERE model_name = ? AND revision = ?', (model_name, revision))
+        for sentence, blob in rows:
+            if exclude_prefix and sentence.startswith(exclude_prefix):
+                continue
+            texts.append(sentence)
+            targets.append(np.frombuffer(blob, dtype=np.float32))
+    return texts, np.array(targets, dtype=np.float32)
+
+
+def train_cascade(cache_path, model_name, revision, output_path, num_buckets=DEFAULT_NUM_BUCKETS,
+                  max_order=DEFAULT_MAX_ORDER, epochs=5, target_agreement=DEFAULT_TARGET_AGREEMENT,
+                  exclude_prefix=None):
+    """推論キャッシュから n-gram モデルを蒸留し、評価用の文でしきい値ごとの一致率を求めて保存する関数"""
+    texts, targets = load_distillation_data(cache_path, model_name, revision, exclude_prefix)
+    if not texts:
+        raise ValueError(f"推論キャッシュに {model_name}（{revision}）の文がありません: {cache_path}")
+
+    # 文のハッシュで評価用を取り分ける（学習し直しても同じ文が評価用になる）
+    holdout = np.array([zlib.crc32(text.encode('utf-8')) % HOLDOUT_BUCKETS == 0 for text in texts])
+    if holdout.all() or not holdout.any():
+        holdout[:] = False
+        holdout[::HOLDOUT_BUCKETS] = True
+    classifier = HashedNgramClassifier(targets.shape[1], num_buckets, max_order)
+    rows = [hashed_ngrams(text, num_buckets, max_order) for text in texts]
+    train_rows = [row for row, held in zip(rows, holdout) if not held]
+    print(f"{len(train_rows)} 文で学習し、{int(holdout.sum())} 文で評価します（{model_name}, リビジョン {revision}）")
+    classifier.fit(train_rows, targets[~holdout], epochs=epochs)
+
+    table = agreement_table(classifier.predict_features([row for row, held in zip(rows, holdout) if held]),
+                            targets[holdout])
+    threshold = choose_threshold(table, target_agreement)
+    label_counts = Counter(int(label) for label in targets.argmax(axis=1))
+    classifier.meta = {'model_name': model_name, 'revision': revision, 'threshold': threshold,
+                       'target_agreement': target_agreement, 'sentences': len(texts),
+                       'label_counts': dict(sorted(label_counts.items())), 'holdout': table}
+    classifier.save(output_path)
+    return classifier
+
+
+class CascadeRouter:
+    """
+    n-gram モデルの確率の最大値が threshold 以上の文はその結果を使い、それ以外をモデルに回すためのクラス。
+    audit_rate の割合で、n-gram モデルに任せられる文もモデルに回し、ラベルの一致率を数える。
+    """
+
+    def __init__(self, classifier, threshold, audit_rate=0.0, seed=0):
+        self.classifier = classifier
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.shallow = 0       # n-gram モデルで済ませた文の数
+        self.deep = 0          # モデルで推論した文の数（監査した文を含む）
+        self.audited = 0
+        self.audit_agreed = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def route(self, sentences):
+        """(n-gram モデルの確率ベクトルのリスト, モデルに回す文の番号のリスト) を返す"""
+        probabilities = list(self.classifier.predict_proba(sentences))
+        uncertain = [i for i, probs in enumerate(probabilities)
+                     if probs.max() < self.threshold or (self.audit_rate and self._random.random() < self.audit_rate)]
+        with self._lock:
+            self.shallow += len(sentences) - len(uncertain)
+            self.deep += len(uncertain)
+        return probabilities, uncertain
+
+    def audit(self, shallow_probabilities, model_probabilities):
+        """モデルに回した文のうち、n-gram モデルでも自信のあった文（監査した文）のラベルの一致を数える"""
+        with self._lock:
+            for shallow, deep in zip(shallow_probabilities, model_probabilities):
+                if deep is None or shallow.max() < self.threshold:
+                    continue
+                self.audited += 1
+                self.audit_agreed += int(shallow.argmax() == deep.argmax())
+
+    def to_dict(self):
+        with self._lock:
+            total = self.shallow + self.deep
+            return {
+                'threshold': self.threshold,
+                'ngram_sentences': self.shallow,
+                'model_sentences': self.deep,
+                'ngram_fraction': self.shallow / total if total else 0.0,
+                'audited': self.audited,
+                'audit_agreement': self.audit_agreed / self.audited if self.audited else None,
+            }
+
+    def summary(self):
+        stats = self.to_dict()
+        total = stats['ngram_sentences'] + stats['model_sentences']
+        text = (f"カスケード（しきい値 {stats['threshold']:.2f}）: n-gram モデル {stats['ngram_sentences']} 文, "
+                f"感情分析モデル {stats['model_sentences']} 文（n-gram の割合 {stats['ngram_fraction'] * 100:.1f}%, "
+                f"キャッシュに無かった {total} 文のうち）")
+        if stats['audited']:
+            text += f"、監査した {stats['audited']} 文での一致率 {stats['audit_agreement'] * 100:.1f}%"
+        return text
+
+
+def load_cascade(path, model_name, revision, threshold=None, audit_rate=0.0):
+    """保存済みの n-gram モデルから CascadeRouter を作る関数（使えない場合は理由を表示して None）"""
+    try:
+        classifier = HashedNgramClassifier.load(path)
+    except Exception as e:
+        print(f"カスケードの n-gram モデルを読み込めないため、すべての文をモデルで推論します: {path}")
+        traceback.print_exc()
+        return None
+    meta = classifier.meta
+    if (meta.get('model_name'), meta.get('revision')) != (model_name, revision):
+        print(f"カスケードの n-gram モデルは {meta.get('model_name')}（{meta.get('revision')}）から学習したものなので使いません。"
+              f"ngram_cascade.py train で学習し直してください。")
+        return None
+    threshold = meta['threshold'] if threshold is None else threshold
+    print(f"カスケード: n-gram モデルの確率が {threshold:.2f} 以上の文は感情分析モデルに渡しません")
+    return CascadeRouter(classifier, threshold, audit_rate)
+
+
+def add_cascade_arguments(parser):
+    """カスケード関連のオプションを argparse に追加する関数"""
+    parser.add_argument('--cascade', action='store_true',
+                        help='n-gram モデルが十分に自信のある文は感情分析モデルに渡さない（ngram_cascade.py train で学習）')
+    parser.add_argument('--cascade-model', type=str, default=None,
+                        help='カスケードの n-gram モデル（既定は .cache/cascade/<モデル名>.npz）')
+    parser.add_argument('--cascade-threshold', type=float, default=None,
+                        help='n-gram モデルに任せる確率の下限（既定は学習時に選んだ値）')
+    parser.add_argument('--cascade-audit-rate', type=float, default=0.0,
+                        help='n-gram モデルに任せられる文のうち、一致率の確認のためにモデルでも推論する割合')
+
+
+def cascade_from_args(args, model_name):
+    """argparse の結果から configure_cascade に渡す (パス, しきい値, 監査の割合) を返す関数（無効なら None）"""
+    if not args.cascade:
+        return None
+    return args.cascade_model or default_cascade_path(model_name), args.cascade_threshold, args.cascade_audit_rate
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='推論キャッシュから、カスケードの1段目に使う n-gram モデルを蒸留します。')
+    parser.add_argument('--inference-cache', type=str, default=DEFAULT_CACHE_PATH, help='教師にする推論キャッシュ')
+    parser.add_argument('--model', type=str, default=None, help='モデル名（既定は emotion_model の model_name）')
+    parser.add_argument('--revision', type=str, default=None, help='モデルのリビジョン（既定はキャッシュで最も多いもの）')
+    parser.add_argument('--output', type=str, default=None, help='保存先（既定は .cache/cascade/<モデル名>.npz）')
+    parser.add_argument('--num-buckets', type=int, default=DEFAULT_NUM_BUCKETS, help='ハッシュする特徴量の数')
+    parser.add_argument('--max-order', type=int, default=DEFAULT_MAX_ORDER, help='使う n-gram の最大の文字数')
+    parser.add_argument('--epochs', type=int, default=5, help='学習のエポック数')
+    parser.add_argument('--target-agreement', type=float, default=DEFAULT_TARGET_AGREEMENT,
+                        help='n-gram モデルに任せる文でのモデルとの一致率の目標（既定のしきい値の選択に使う）')
+    args = parser.parse_args()
+
+    import emotion_model
+
+    model_name = args.model or emotion_model.model_name
+    output_path = args.output or default_cascade_path(model_name)
+    if not os.path.exists(args.inference_cache):
+        print(f"推論キャッシュがありません: {args.inference_cache}")
+        sys.exit(1)
+    revision = args.revision or most_common_revision(args.inference_cache, model_name)
+    if revision is None:
+        print(f"推論キャッシュに {model_name} の結果がありません: {args.inference_cache}")
+        sys.exit(1)
+
+    try:
+        classifier = train_cascade(args.inference_cache, model_name, revision, output_path, args.num_buckets,
+                                   args.max_order, args.epochs, args.target_agreement,
+                                   exclude_prefix=emotion_model.WINDOW_KEY_PREFIX)
+    except Exception as e:
+        print("n-gram モデルの学習に失敗しました。")
+        traceback.print_exc()
+        sys.exit(1)
+    print(f"\n評価用の文でのしきい値ごとの結果:\n{format_agreement_table(classifier.meta['holdout'])}")
+    print(f"\n一致率 {args.target_agreement * 100:.0f}% 以上になる既定のしきい値: {classifier.meta['threshold']:.2f}")
+    print(f"n-gram モデルを保存しました: {output_path}")
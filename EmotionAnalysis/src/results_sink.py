@@ -0,0 +1,329 @@
+# results_sink.py
+
+import glob
+import json
+import os
+
+# 出力形式
+#   jsonl   : 1行1文の JSON（既定）
+#   parquet : 列指向の Parquet（ディレクトリ内に一定の行数ごとのパートファイルを作る）
+#   text    : これまでどおりの人が読むためのテキスト（再集計には使えない）
+OUTPUT_FORMATS = ('jsonl', 'parquet', 'text')
+DEFAULT_OUTPUT_FORMAT = 'jsonl'
+OUTPUT_EXTENSIONS = {'jsonl': '.jsonl', 'parquet': '.parquet', 'text': '.txt'}
+
+# 1行（1文）の列
+COLUMNS = ('member', 'article_id', 'url', 'date', 'sentence_index', 'text', 'label', 'label_id', 'score',
+           'probabilities')
+
+DEFAULT_FLUSH_ROWS = 1000           # JSONL をまとめて書き出す行数
+DEFAULT_ROW_GROUP_SIZE = 50_000     # Parquet の1行グループあたりの行数
+
+
+def output_path_for(member_name, output_format):
+    """メンバー名と出力形式から出力先のパスを返す関数"""
+    return f"{member_name.replace(' ', '')}_EmotionAnalysis{OUTPUT_EXTENSIONS[output_format]}"
+
+
+def sentence_rows(member_name, article_id, blog_url, date, sentences, emotions):
+    """記事内の文と感情分析の結果から、出力する行（辞書）を1文ずつ返すジェネレータ"""
+    for index, (sentence, res) in enumerate(zip(sentences, emotions)):
+        if not res:
+            continue
+        yield {
+            'member': member_name,
+            'article_id': article_id,
+            'url': blog_url,
+            'date': date,
+            'sentence_index': index,
+            'text': sentence,
+            'label': res['label'],
+            'label_id': res['label_id'],
+            'score': res['score'],
+            'probabilities': [float(p) for p in res['probabilities']],
+        }
+
+
+class JsonlSink:
+    """1行1文の JSONL に書き出すシンク。flush_rows 行ごとにまとめて書き込む"""
+
+    def __init__(self, path, append=False, flush_rows=DEFAULT_FLUSH_ROWS):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.rows_written = 0
+        self._buffer = []
+        self._file = open(path, 'a' if append else 'w', encoding='utf-8', buffering=1024 * 1024)
+
+    def write_rows(self, rows):
+        for row in rows:
+            self._buffer.append(json.dumps(row, ensure_ascii=False))
+        if len(self._buffer) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write('\n'.join(self._buffer) + '\n')
+            self.rows_written += len(self._buffer)
+            self._buffer = []
+        self._file.flush()
+
+    def checkpoint(self):
+        """バッファの行をディスクまで書き出し、ファイルのバイト数を返す（rollback_sink で戻せる位置）"""
+        self.flush()
+        return _sync_file(self._file)
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+
+class ParquetSink:
+    """
+    Parquet に書き出すシンク。path はディレクトリで、その中に part-NNNNN.parquet を作る。
+    行はまず次のパートになる _pending-NNNNN.jsonl（Parquet として読み込むときは無視される）に追記し、
+    part_rows 行たまるごと（と close() のとき）にまとめて1つのパートファイルに変換する。
+    パートファイルの中は row_group_size 行ごとの行グループになる。
+    checkpoint() は _pending-NNNNN.jsonl を fsync するだけなので、ジャーナルのチェックポイントが頻繁でも
+    小さなパートは増えない。変換済みの _pending は、新しいパートの数が次のチェックポイントで記録されるまで残し、
+    rollback_sink がチェックポイントより後に作られたパートを作り直せるようにする。
+    """
+
+    def __init__(self, path, append=False, row_group_size=DEFAULT_ROW_GROUP_SIZE, part_rows=None):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet 形式の出力には pyarrow が必要です: pip install pyarrow")
+
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = path
+        self.row_group_size = row_group_size
+        self.part_rows = part_rows or row_group_size
+        self.rows_written = 0
+        self.part_path = None
+        self._buffer = []
+        self._converted = []  # 前回のチェックポイントより後にパートに変換した _pending
+        self._stale = []      # その前のチェックポイントまでに変換した _pending（次のチェックポイントで消せる）
+
+        os.makedirs(path, exist_ok=True)
+        if not append:
+            for part in _parquet_parts(path) + _pending_files(path):
+                os.remove(part)
+        # パートに変換済みの _pending は消し、変換されずに残った行（再開時は rollback_sink で切り詰めた後の行）は引き継ぐ
+        self._index = len(_parquet_parts(path))
+        for pending_path in _pending_files(path):
+            if pending_path != _pending_path(path, self._index):
+                os.remove(pending_path)
+        self._open_pending()
+
+    def _open_pending(self):
+        self.pending_path = _pending_path(self.path, self._index)
+        self._pending_rows = 0
+        if os.path.exists(self.pending_path):
+            with open(self.pending_path, 'rb') as f:
+                self._pending_rows = sum(1 for line in f if line.strip())
+        self._pending = open(self.pending_path, 'a', encoding='utf-8')
+
+    def write_rows(self, rows):
+        for row in rows:
+            self._buffer.append(json.dumps(row, ensure_ascii=False))
+        if len(self._buffer) >= DEFAULT_FLUSH_ROWS or self._pending_rows + len(self._buffer) >= self.part_rows:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._pending.write('\n'.join(self._buffer) + '\n')
+            self._pending_rows += len(self._buffer)
+            self.rows_written += len(self._buffer)
+            self._buffer = []
+        self._pending.flush()
+        if self._pending_rows >= self.part_rows:
+            self._write_part()
+
+    def _write_part(self):
+        """_pending の行を新しいパートファイルに書き出し、次のパートの _pending に切り替える"""
+        self._pending.close()
+        table = self._pa.Table.from_pylist(_read_jsonl_rows(self.pending_path), schema=_parquet_schema(self._pa))
+        self.part_path = os.path.join(self.path, f"part-{self._index:05d}.parquet")
+        # 書きかけのパートを読まないよう、読み込み時に無視される _ で始まる名前で書いて fsync してから置き換える
+        partial_path = os.path.join(self.path, f"_part-{self._index:05d}.parquet.tmp")
+        self._pq.write_table(table, partial_path, row_group_size=self.row_group_size)
+        with open(partial_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(partial_path, self.part_path)
+        self._converted.append(self.pending_path)
+        self._index += 1
+        self._open_pending()
+
+    def checkpoint(self):
+        """
+        バッファの行を _pending に書き出して fsync し、rollback_sink で戻せる位置
+        （確定したパートファイルの数と _pending のバイト数）を返す
+        """
+        self.flush()
+        state = {'parts': self._index, 'pending_bytes': _sync_file(self._pending)}
+        # 前回のチェックポイントはジャーナルに記録済みなので、それより前に変換した _pending はもう要らない
+        for pending_path in self._stale:
+            os.remove(pending_path)
+        self._stale, self._converted = self._converted, []
+        return state
+
+    def close(self):
+        if self._pending is None:
+            return
+        self.flush()
+        if self._pending_rows:
+            self._write_part()
+        self._pending.close()
+        self._pending = None
+        for pending_path in self._stale + self._converted + [self.pending_path]:
+            os.remove(pending_path)
+        self._stale, self._converted = [], []
+
+
+class TextSink:
+    """これまでの形式（文と感情を2行ずつ）のテキストに書き出すシンク"""
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.rows_written = 0
+        self._file = open(path, 'a' if append else 'w', encoding='utf-8', buffering=1024 * 1024)
+
+    def write_rows(self, rows):
+        lines = []
+        for row in rows:
+            lines.append(f"文: {row['text']}\n感情: {row['label']}, スコア: {row['score']}\n\n")
+        self._file.write(''.join(lines))
+        self.rows_written += len(lines)
+
+    def flush(self):
+        self._file.flush()
+
+    def checkpoint(self):
+        return _sync_file(self._file)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _parquet_parts(path):
+    return sorted(glob.glob(os.path.join(path, 'part-*.parquet')))
+
+
+def _parquet_schema(pa):
+    # パートごとに型がぶれない（投稿日がすべて欠けたパートが null 型にならない）よう、列の型を固定する
+    return pa.schema([
+        ('member', pa.string()), ('article_id', pa.int64()), ('url', pa.string()), ('date', pa.string()),
+        ('sentence_index', pa.int64()), ('text', pa.string()), ('label', pa.string()),
+        ('label_id', pa.int64()), ('score', pa.float64()), ('probabilities', pa.list_(pa.float64())),
+    ])
+
+
+def _pending_path(path, index):
+    # Parquet のパートファイルに変換する前の行（先頭が _ のファイルは Parquet の読み込み時に無視される）
+    return os.path.join(path, f"_pending-{index:05d}.jsonl")
+
+
+def _pending_files(path):
+    return sorted(glob.glob(os.path.join(path, '_pending-*.jsonl')))
+
+
+def _unconverted_rows_path(path):
+    """パートファイルに変換されていない行のある _pending のパスを返す（無ければ None）"""
+    pending_path = _pending_path(path, len(_parquet_parts(path)))
+    return pending_path if os.path.exists(pending_path) and os.path.getsize(pending_path) > 0 else None
+
+
+def _read_jsonl_rows(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _sync_file(f):
+    f.flush()
+    os.fsync(f.fileno())
+    return os.fstat(f.fileno()).st_size
+
+
+def rollback_sink(path, output_format, state):
+    """
+    出力を checkpoint() が返した時点の状態に戻す関数（中断した実行を再開する前に呼ぶ）。
+    チェックポイントより後に書かれた行（ジャーナルに完了が記録されていない記事の行）を取り除き、
+    再開後に同じ記事の行が重複しないようにする。
+    """
+    if state is None or not os.path.exists(path):
+        return
+    if output_format == 'parquet':
+        if isinstance(state, int):
+            state = {'parts': state, 'pending_bytes': 0}  # パートファイルの数だけを記録していた以前の形式
+        for index, part in enumerate(_parquet_parts(path)):
+            # チェックポイントより後に作られたパートは、元の行が _pending に残っていれば消して作り直す
+            # （_pending が無いのは close() まで終わった実行のパート）
+            if index >= state['parts'] and os.path.exists(_pending_path(path, index)):
+                os.remove(part)
+        for pending_path in _pending_files(path):
+            index = int(os.path.basename(pending_path)[len('_pending-'):-len('.jsonl')])
+            if index > state['parts']:
+                os.remove(pending_path)
+            elif index == state['parts'] and os.path.getsize(pending_path) > state['pending_bytes']:
+                os.truncate(pending_path, state['pending_bytes'])
+    elif os.path.getsize(path) > state:
+        os.truncate(path, state)
+
+
+def open_sink(path, output_format=DEFAULT_OUTPUT_FORMAT, append=False):
+    """出力形式に応じたシンクを開く関数"""
+    if output_format == 'jsonl':
+        return JsonlSink(path, append)
+    if output_format == 'parquet':
+        return ParquetSink(path, append)
+    if output_format == 'text':
+        return TextSink(path, append)
+    raise ValueError(f"未対応の出力形式です: {output_format}（{', '.join(OUTPUT_FORMATS)} のいずれか）")
+
+
+def has_results(path, output_format):
+    """再集計できる結果（JSONL の行か Parquet のパートファイル）が path にあるかを返す関数"""
+    if output_format == 'parquet':
+        return os.path.isdir(path) and (bool(_parquet_parts(path)) or _unconverted_rows_path(path) is not None)
+    return output_format == 'jsonl' and os.path.exists(path) and os.path.getsize(path) > 0
+
+
+def load_results(path):
+    """JSONL または Parquet の出力を pandas の DataFrame として読み込む関数"""
+    import pandas as pd
+
+    if os.path.isdir(path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # パートファイルに変換される前の行（中断した実行の _pending）も含める
+        schema = _parquet_schema(pa)
+        tables = [pq.read_table(part, schema=schema) for part in _parquet_parts(path)]
+        pending_path = _unconverted_rows_path(path)
+        if pending_path is not None:
+            tables.append(pa.Table.from_pylist(_read_jsonl_rows(pending_path), schema=schema))
+        frame = pa.concat_tables(tables).to_pandas() if tables else pd.DataFrame(columns=list(COLUMNS))
+    elif path.endswith('.parquet'):
+        frame = pd.read_parquet(path)
+    elif path.endswith('.jsonl'):
+        # pd.read_json は 'date' 列を日付として解釈してしまう（'2024/11/03' や null の値が変わる）ので、
+        # 書き込んだときの値のまま1行ずつ読み込む
+        frame = pd.DataFrame(_read_jsonl_rows(path), columns=list(COLUMNS))
+    else:
+        raise ValueError(f"再集計できない出力ファイルです（JSONL か Parquet を指定してください）: {path}")
+    # 欠損値の表し方（None / nan）は pandas のバージョンで変わるので、投稿日の無い行は None にそろえる
+    dates = frame['date'].astype(object)
+    frame['date'] = dates.where(dates.notna(), None)
+    return frame
+
+
+def add_output_arguments(parser):
+    """出力形式のオプションを argparse に追加する関数"""
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT_FORMAT,
+                        help="文ごとの結果の出力形式（'jsonl': 1行1文の JSON, 'parquet': 列指向, 'text': 従来のテキスト）")
@@ -0,0 +1,63 @@
+# sentence_splitter.py
+
+import os
+import re
+
+# 文末とみなす記号
+SENTENCE_END_CHARS = '。！？'
+
+# 文末記号の連続までを1文とし、末尾に残った部分も1文として扱う
+_SENTENCE_PATTERN = re.compile(f'[^{SENTENCE_END_CHARS}]*[{SENTENCE_END_CHARS}]+|[^{SENTENCE_END_CHARS}]+')
+# MeCab は空白・改行を形態素に含めないため、正規表現モードでも取り除いて結果を揃える
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+MODES = ('regex', 'morph')
+
+# fugashi の Tagger はプロセスごとに1回だけ生成して使い回す
+_tagger = None
+_tagger_pid = None
+
+def get_tagger():
+    """プロセス内で共有する fugashi の Tagger を返す関数（初回呼び出し時に辞書をロード）"""
+    global _tagger, _tagger_pid
+    if _tagger is None or _tagger_pid != os.getpid():
+        from fugashi import Tagger  # 形態素解析モードでのみ必要なので遅延インポート
+        _tagger = Tagger()
+        _tagger_pid = os.getpid()
+    return _tagger
+
+def iter_sentences_regex(text):
+    """正規表現だけで文末記号ごとに文を切り出すジェネレータ"""
+    text = _WHITESPACE_PATTERN.sub('', text)
+    for match in _SENTENCE_PATTERN.finditer(text):
+        yield match.group()
+
+def iter_sentences_morph(text):
+    """fugashi の形態素解析結果をもとに文を切り出すジェネレータ"""
+    buffer = []
+    for word in get_tagger()(text):
+        buffer.append(word.surface)
+        if word.surface in SENTENCE_END_CHARS:  # 句点、感嘆符、疑問符で文を分割
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+class SentenceSplitter:
+    """
+    文分割エンジン。
+    既定の 'regex' モードは形態素解析を行わずに文末記号で分割する。
+    'morph' モードでは共有の Tagger を使って形態素単位で分割する。
+    """
+
+    def __init__(self, mode='regex'):
+        if mode not in MODES:
+            raise ValueError(f"未対応の文分割モードです: {mode}（{', '.join(MODES)} のいずれか）")
+        self.mode = mode
+        self._split = iter_sentences_morph if mode == 'morph' else iter_sentences_regex
+
+    def split(self, text):
+        """文を1つずつ返すジェネレータ"""
+        return self._split(text)
+
+    __call__ = split
@@ -0,0 +1,81 @@
+# test_emotion_detection.py
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import EmotionDetection_FromText as emotion_app
+from results_sink import load_results
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'benchmarks'))
+from fixture_server import FixtureSite, serve  # noqa: E402
+
+import extract  # noqa: E402
+from article_index import ArticleIndex  # noqa: E402
+from crawler import Crawler  # noqa: E402
+from pagination import member_query  # noqa: E402
+
+
+def _fake_classify(blog_url, sentences, *args, **kwargs):
+    # モデルを使わず、文の長さから決まる確率ベクトルを返す
+    results = []
+    for sentence in sentences:
+        probabilities = np.full(8, 0.05)
+        probabilities[len(sentence) % 8] = 0.65
+        results.append({'label': '喜び', 'label_id': int(probabilities.argmax()), 'score': 0.65,
+                        'probabilities': probabilities})
+    return results
+
+
+def _args(tmp_path, *argv):
+    parser = argparse.ArgumentParser()
+    emotion_app.add_pipeline_arguments(parser)
+    emotion_app.add_journal_arguments(parser)
+    emotion_app.add_output_arguments(parser)
+    args = parser.parse_args(['--journal-dir', str(tmp_path / 'journal'), *argv])
+    args.batch_size = emotion_app.DEFAULT_BATCH_SIZE
+    args.max_tokens_per_batch = emotion_app.DEFAULT_MAX_TOKENS_PER_BATCH
+    args.split_mode = 'regex'
+    args.granularity = 'sentence'
+    args.window_overlap = emotion_app.DEFAULT_WINDOW_OVERLAP
+    args.window_pooling = 'mean'
+    return args
+
+
+@pytest.mark.parametrize('output_format', ['jsonl', 'parquet'])
+def test_incremental_run_after_normal_run_does_not_duplicate(tmp_path, monkeypatch, output_format):
+    if output_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    site = FixtureSite(members=1, pages_per_member=2, articles_per_page=4, sentences_per_article=5)
+    server, root = serve(site)
+    monkeypatch.setattr(extract, 'SITE_ROOT', root)
+    monkeypatch.setattr(emotion_app, 'classify_blog_sentences', _fake_classify)
+    monkeypatch.chdir(tmp_path)
+    crawler = Crawler(rate=1000, burst=100, max_in_flight=4, cache=None)
+    extractor = extract.get_extractor('html.parser')
+    member_name, member_url = emotion_app.get_member_list(
+        extract.absolute_url('/s/s46/diary/blog/list?ima=0000'), crawler, extractor)[0]
+    args = _args(tmp_path, '--output-format', output_format)
+
+    # 通常の実行（インデックスなし）
+    output_filename, normal_totals = emotion_app.analyze_member(member_name, member_url, crawler, extractor, None,
+                                                                args)
+    rows = len(load_results(output_filename))
+    assert rows == 8 * 5
+
+    # 初めてのインクリメンタル実行では、出力にある記事を処理し直さずに同じ集計になる
+    article_index = ArticleIndex('emotion', str(tmp_path / 'index.sqlite3'))
+    requests_before = site.snapshot().get('detail', 0)
+    _, incremental_totals = emotion_app.analyze_member(member_name, member_url, crawler, extractor, article_index,
+                                                       args)
+    assert site.snapshot().get('detail', 0) == requests_before
+    assert len(load_results(output_filename)) == rows
+    np.testing.assert_allclose(incremental_totals, normal_totals)
+    assert len(article_index.known_ids(member_query(member_url)[0])) == 8
+
+    article_index.close()
+    crawler.close()
+    server.shutdown()
@@ -0,0 +1,37 @@
+# test_emotion_model.py
+
+import json
+
+import emotion_model
+from emotion_model import window_cache_key
+from inference_cache import normalize_sentence
+from model_snapshot import LABEL_MAP_FILE, MANIFEST_FILE
+
+
+def test_window_keys_depend_on_sentence_boundaries():
+    # 同じ文字列でも文の分け方が違えばトークン列が変わるので、キャッシュのキーも分ける
+    keys = {normalize_sentence(window_cache_key(sentences))
+            for sentences in (['今日は晴れ。', '楽しかった。'], ['今日は晴れ。楽しかった。'], ['今日は', '晴れ。楽しかった。'])}
+    assert len(keys) == 3
+    # 空白だけの違いは、文単位のキャッシュと同じく同じキーにまとめる
+    assert normalize_sentence(window_cache_key(['今日は 晴れ。'])) == normalize_sentence(window_cache_key(['今日は晴れ。']))
+
+
+def _write_snapshot(path, model_name, label_meanings):
+    path.mkdir()
+    (path / MANIFEST_FILE).write_text(json.dumps({'model_name': model_name, 'revision': 'main'}), encoding='utf-8')
+    (path / LABEL_MAP_FILE).write_text(json.dumps({'id2label': {}, 'label_meanings': label_meanings}),
+                                       encoding='utf-8')
+    return str(path)
+
+
+def test_snapshot_with_other_label_map_is_not_used(tmp_path, monkeypatch):
+    usable = _write_snapshot(tmp_path / 'usable', emotion_model.model_name, emotion_model.label_meanings)
+    monkeypatch.setattr(emotion_model, '_snapshot_path', usable)
+    assert emotion_model._usable_snapshot() == usable
+
+    # ラベルの対応が変わったスナップショットは使わず、Hub からロードする
+    stale = _write_snapshot(tmp_path / 'stale', emotion_model.model_name,
+                            dict(emotion_model.label_meanings, LABEL_7='不明'))
+    monkeypatch.setattr(emotion_model, '_snapshot_path', stale)
+    assert emotion_model._usable_snapshot() is None
@@ -0,0 +1,111 @@
+# test_results_sink.py
+
+import os
+
+import numpy as np
+import pytest
+
+from emotion_aggregator import EMOTION_LABELS, EmotionAggregator, aggregate_results
+from results_sink import ParquetSink, has_results, load_results, open_sink, rollback_sink, sentence_rows
+
+pytest.importorskip('pandas')
+
+# (記事 ID, 投稿日, 文ごとの確率ベクトル)
+ARTICLES = [
+    (101, '2024/11/03', [[0.7, 0.1, 0.1, 0.02, 0.02, 0.02, 0.02, 0.02], [0.1, 0.1, 0.6, 0.04, 0.04, 0.04, 0.04, 0.04]]),
+    (102, '2024/11/28', [[0.1, 0.1, 0.1, 0.1, 0.5, 0.04, 0.03, 0.03]]),
+    (103, '2024/12/24', [[0.2, 0.5, 0.1, 0.04, 0.04, 0.04, 0.04, 0.04], [0.9, 0.05, 0.01, 0.01, 0.01, 0.01, 0.005, 0.005]]),
+    (104, None, [[0.3, 0.3, 0.1, 0.1, 0.05, 0.05, 0.05, 0.05]]),
+]
+
+
+def _write_and_aggregate(path, output_format):
+    live = EmotionAggregator()
+    sink = open_sink(path, output_format)
+    for article_id, date, probabilities in ARTICLES:
+        emotions = [{'label': EMOTION_LABELS[int(np.argmax(p))], 'label_id': int(np.argmax(p)), 'score': max(p),
+                     'probabilities': p} for p in probabilities]
+        sentences = [f"文{i}" for i in range(len(probabilities))]
+        sink.write_rows(sentence_rows('井上 梨名', article_id, f"https://example/{article_id}", date, sentences,
+                                      emotions))
+        live.add_results('井上 梨名', article_id, date, emotions)
+    sink.close()
+    return live
+
+
+def _assert_same_aggregate(live, reaggregated):
+    assert reaggregated.articles == live.articles
+    assert [(member, month) for member, month, _ in reaggregated.monthly()] == \
+        [('井上 梨名', '2024/11'), ('井上 梨名', '2024/12'), ('井上 梨名', 'unknown')]
+    for (_, _, expected), (_, _, actual) in zip(live.monthly(), reaggregated.monthly()):
+        assert actual.sentences == expected.sentences
+        np.testing.assert_allclose(actual.probabilities, expected.probabilities)
+        np.testing.assert_allclose(actual.polarity_scores, expected.polarity_scores)
+    np.testing.assert_allclose(reaggregated.totals(), live.totals())
+
+
+def test_jsonl_reaggregation_keeps_months(tmp_path):
+    path = str(tmp_path / 'results.jsonl')
+    live = _write_and_aggregate(path, 'jsonl')
+
+    assert has_results(path, 'jsonl')
+    assert list(load_results(path)['date'].iloc[[0, -1]]) == ['2024/11/03', None]
+    _assert_same_aggregate(live, aggregate_results([path]))
+
+
+def test_parquet_reaggregation_keeps_months(tmp_path):
+    pytest.importorskip('pyarrow')
+    path = str(tmp_path / 'results.parquet')
+    live = _write_and_aggregate(path, 'parquet')
+
+    assert has_results(path, 'parquet')
+    assert list(load_results(path)['date'].iloc[[0, -1]]) == ['2024/11/03', None]
+    _assert_same_aggregate(live, aggregate_results([path]))
+
+
+def _rows(article_id, count):
+    emotions = [{'label': '喜び', 'label_id': 0, 'score': 0.9, 'probabilities': [0.9] + [0.1 / 7] * 7}] * count
+    return list(sentence_rows('井上 梨名', article_id, f"https://example/{article_id}", '2024/12/01',
+                              [f"文{i}" for i in range(count)], emotions))
+
+
+def test_parquet_checkpoints_do_not_rotate_parts(tmp_path):
+    pytest.importorskip('pyarrow')
+    path = str(tmp_path / 'results.parquet')
+    sink = open_sink(path, 'parquet')
+    # ジャーナルは記事ごとにチェックポイントを取ることがあるが、パートファイルは行数のしきい値までまとめる
+    for article_id in range(20):
+        sink.write_rows(_rows(article_id, 30))
+        sink.checkpoint()
+    sink.close()
+
+    assert sorted(os.listdir(path)) == ['part-00000.parquet']
+    assert len(load_results(path)) == 20 * 30
+
+
+def test_parquet_rollback_restores_checkpoint(tmp_path):
+    pytest.importorskip('pyarrow')
+    path = str(tmp_path / 'results.parquet')
+    sink = ParquetSink(path, part_rows=50)
+    sink.write_rows(_rows(1, 40))
+    sink.write_rows(_rows(2, 40))  # part_rows を超えたのでパートファイルになる
+    state = sink.checkpoint()
+    sink.write_rows(_rows(3, 20))
+    checkpointed = sink.checkpoint()
+    sink.write_rows(_rows(4, 60))  # チェックポイントの後に書かれ、中断で失われる行（パートファイルにもなっている）
+    sink.flush()
+    assert state['parts'] == 1 and checkpointed == {'parts': 1, 'pending_bytes': checkpointed['pending_bytes']}
+
+    # 中断した実行を再開する：チェックポイントの時点まで戻してから追記する
+    rollback_sink(path, 'parquet', checkpointed)
+    assert has_results(path, 'parquet')
+    assert list(load_results(path).groupby('article_id').size().items()) == [(1, 40), (2, 40), (3, 20)]
+    resumed = ParquetSink(path, append=True, part_rows=50)
+    resumed.write_rows(_rows(4, 60))
+    resumed.close()
+    assert list(load_results(path).groupby('article_id').size().items()) == [(1, 40), (2, 40), (3, 20), (4, 60)]
+    assert all(name.startswith('part-') for name in os.listdir(path))
+
+    # 最後まで終わった実行を再開しても、チェックポイントより後に作られたパートは消さない
+    rollback_sink(path, 'parquet', checkpointed)
+    assert len(load_results(path)) == 160
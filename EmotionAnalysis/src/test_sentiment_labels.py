@@ -1,59 +1,25 @@
 # test_sentiment_labels.py
 
 import os
-import traceback
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
-from dotenv import load_dotenv
-import torch
+import argparse
+import time
+
+# モデルのロード・推論は emotion_model に集約している
+import emotion_model
+from inference_backends import BACKENDS, DEFAULT_BACKEND, create_backend, default_onnx_path
 
 # TensorFlow のログを抑制
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
-# .envファイルを読み込む
-load_dotenv()
-
-# 環境変数からアクセストークンを取得（必要な場合）
-access_token = os.getenv('HF_ACCESS_TOKEN')
-
-# 使用する感情分析モデル
-model_name = "koshin2001/Japanese-to-emotions"
-
-# モデルとトークナイザーをロード
-try:
-    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
-    model = AutoModelForSequenceClassification.from_pretrained(model_name)
-    model.eval()  # 評価モードに設定
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model.to(device)
-except Exception as e:
-    print("感情分析モデルのロードに失敗しました。環境・ネットワーク状態を確認してください。")
-    traceback.print_exc()
-    exit(1)
-
-# モデルのラベル一覧を表示
-labels = model.config.id2label
-print("モデルのラベル一覧:")
-for idx, label in labels.items():
-    print(f"{idx}: {label}")
-
-def classify_emotion(sentence):
+def classify_sentences(sentences, batch_size=emotion_model.DEFAULT_BATCH_SIZE, num_workers=0, inference_backend=None):
+    """文をパイプラインでまとめて感情分析し、(文, 結果) のリストを返す関数（失敗時の結果は None）"""
+    sentences = list(sentences)
     try:
-        # トークナイズ（token_type_ids を生成しない）
-        inputs = tokenizer(sentence, return_tensors="pt", truncation=True, max_length=512, padding=True)
-        inputs = {k: v.to(device) for k, v in inputs.items() if k != 'token_type_ids'}
-
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits = outputs.logits
-            probabilities = torch.softmax(logits, dim=1)
-            scores, predicted = torch.max(probabilities, dim=1)
-            label = labels[predicted.item()]
-            score = scores.item()
-            return {'label': label, 'score': score}
+        results = list(emotion_model.stream_emotions(sentences, batch_size, num_workers, inference_backend))
     except Exception as e:
-        print(f"感情分析中にエラーが発生しました: 文: {sentence}")
-        traceback.print_exc()
-        return None
+        print(f"感情分析中にエラーが発生しました（{len(sentences)}文）: {e}")
+        results = [None] * len(sentences)
+    return list(zip(sentences, results))
 
 # テスト文の定義
 test_sentences = [
@@ -67,12 +33,59 @@ test_sentences = [
     "少し疲れました。",                        # 疲労
 ]
 
-# 感情分析の実行と結果の表示
-for sentence in test_sentences:
-    res = classify_emotion(sentence)
-    if res:
-        print(f"文: {sentence}")
-        print(f"感情: {res}\n")
+def measure_backend(inference_backend, repeat, batch_size, num_workers=0):
+    """テスト文を repeat 回繰り返して推論し、予測ラベルと1秒あたりの文数を返す関数"""
+    sentences = test_sentences * repeat
+    # 1回目は初期化コストを含むので計測から除く
+    list(emotion_model.stream_emotions(test_sentences, batch_size, num_workers, inference_backend))
+    start = time.perf_counter()
+    results = list(emotion_model.stream_emotions(sentences, batch_size, num_workers, inference_backend))
+    elapsed = time.perf_counter() - start
+    predictions = [res['label_id'] for res in results[:len(test_sentences)]]
+    return predictions, len(sentences) / elapsed
+
+def compare_backends(backend_names, repeat, batch_size, num_workers=0):
+    """各バックエンドのラベル一致率と速度を fp32 PyTorch（基準）と比較して表示する関数"""
+    emotion_model.load_model()
+    onnx_path = default_onnx_path(emotion_model.model_name, emotion_model.model_revision)
+    reference = create_backend(DEFAULT_BACKEND, emotion_model.model, emotion_model.device)
+    reference_predictions, reference_speed = measure_backend(reference, repeat, batch_size, num_workers)
+
+    print(f"\n{'バックエンド':<12}{'ラベル一致率':>12}{'文/秒':>12}{'速度比':>10}")
+    for name in backend_names:
+        try:
+            inference_backend = create_backend(name, emotion_model.model, emotion_model.device, onnx_path)
+            predictions, speed = measure_backend(inference_backend, repeat, batch_size, num_workers)
+        except Exception as e:
+            print(f"{name:<12}利用できません: {e}")
+            continue
+        agreement = sum(p == r for p, r in zip(predictions, reference_predictions)) / len(reference_predictions)
+        print(f"{name:<12}{agreement * 100:>11.1f}%{speed:>12.1f}{speed / reference_speed:>9.2f}x")
+        if hasattr(inference_backend, 'report'):
+            print(inference_backend.report())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='テスト文で感情分析モデルのラベルを確認します。')
+    parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND, help='使用する推論バックエンド')
+    parser.add_argument('--compare-backends', action='store_true',
+                        help='全バックエンドのラベル一致率と速度を fp32 PyTorch と比較します。')
+    parser.add_argument('--repeat', type=int, default=20, help='速度計測でテスト文を繰り返す回数')
+    parser.add_argument('--batch-size', type=int, default=emotion_model.DEFAULT_BATCH_SIZE, help='推論のバッチサイズ')
+    parser.add_argument('--num-workers', type=int, default=0,
+                        help='トークナイズを先行して行う DataLoader のワーカー数（0 ならメインプロセスで行う）')
+    args = parser.parse_args()
+
+    if args.compare_backends:
+        compare_backends(BACKENDS, args.repeat, args.batch_size, args.num_workers)
     else:
-        print(f"文: {sentence}")
-        print("感情分析に失敗しました。\n")
+        emotion_model.configure_backend(args.backend)
+
+        # 感情分析の実行と結果の表示（全テスト文を1回のバッチ推論で処理する）
+        for sentence, res in classify_sentences(test_sentences, args.batch_size, args.num_workers):
+            if res:
+                print(f"文: {sentence}")
+                print(f"感情: {res['meaning']}（{res['label']}, スコア: {res['score']:.4f}）")
+                print(f"全スコア: {res['scores']}\n")
+            else:
+                print(f"文: {sentence}")
+                print("感情分析に失敗しました。\n")
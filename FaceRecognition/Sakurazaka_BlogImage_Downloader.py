@@ -1,159 +1,393 @@
 import os
-import requests
-from bs4 import BeautifulSoup
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from urllib.parse import urlparse
 from pykakasi import kakasi
 from PIL import Image
-from io import BytesIO
-import time
-import random
 import argparse
-from urllib.parse import urlparse, parse_qs
+
+# 共通モジュール（リポジトリ直下の Common/）を読み込めるようにする
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from crawler import add_crawler_arguments, crawler_from_args
+from article_index import add_incremental_arguments, article_id_from_url, index_from_args
+from extract import absolute_url, add_extract_arguments, extractor_from_args
+from pagination import iter_all_article_links, list_page_url, member_query
+from crawl_journal import add_journal_arguments, journal_from_args
+from instrumentation import add_profile_arguments, metrics, profiler_from_args
+from image_store import ImageStore, add_store_arguments, store_from_args
 
 # pykakasiの設定
 kks = kakasi()
 conv = kks.getConverter()
 
-# メンバー名とそのブログトップページのURLを取得する関数
-def get_member_list(base_url):
-    headers = {'User-Agent': 'Mozilla/5.0'}
-    response = requests.get(base_url, headers=headers)
-    response.raise_for_status()
+# 拡大した PNG の保存先（メンバー名のフォルダを作る、face_crop などの入力）
+# ダウンロードしたままの元画像は画像ストア（image_store/）に内容の SHA-256 をキーにして保存する
+OUTPUT_DIR = 'data'
+RESIZE_SCALE = 2
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+def upscale_to_png(original_path, png_path, scale=RESIZE_SCALE):
+    """元画像を LANCZOS で scale 倍に拡大し、PNG で保存する関数（プロセスプールで実行し、処理時間を返す）"""
+    start = time.perf_counter()
+    with Image.open(original_path) as img_data:
+        if img_data.mode == "RGBA":
+            img_data = img_data.convert("RGB")
+        new_size = (img_data.width * scale, img_data.height * scale)
+        img_resized = img_data.resize(new_size, Image.LANCZOS)
+    partial_path = f"{png_path}.part"
+    img_resized.save(partial_path, format="PNG")
+    os.replace(partial_path, png_path)
+    return time.perf_counter() - start
+
+class ImageResizer:
+    """
+    元画像の拡大と PNG への変換をプロセスプールで行うクラス。
+    CPU を使う処理をダウンロードとは別のプロセスに回し、次のダウンロードを待たせない。
+    プロセスを起動できない環境（デーモンプロセスの中など）やプールが壊れた場合は、このプロセスの中で変換する。
+    """
+
+    def __init__(self, workers=None):
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+        self._in_process = False  # プロセスプールを使えず、このプロセスの中で変換しているか
+        self._submitted = set()
+        self._lock = threading.Lock()
+
+    def submit(self, original_path, png_path):
+        """変換を投入する（同じ PNG への変換を2回は投入しない）"""
+        with self._lock:
+            if png_path in self._submitted:
+                return
+            self._submitted.add(png_path)
+        if not self._in_process:
+            try:
+                future = self._executor.submit(upscale_to_png, original_path, png_path)
+            except Exception:
+                self._fall_back()
+            else:
+                future.add_done_callback(partial(self._done, original_path, png_path))
+                return
+        self._resize_in_process(original_path, png_path)
+
+    def _fall_back(self):
+        """プロセスプールを使えないときに、以降の変換をこのプロセスの中で行うよう切り替える（例外の処理中に呼ぶ）"""
+        with self._lock:
+            if self._in_process:
+                return
+            self._in_process = True
+        print("画像の変換用のプロセスを使えないため、このプロセスの中で変換します。")
+        traceback.print_exc()
+
+    def _resize_in_process(self, original_path, png_path):
+        try:
+            seconds = upscale_to_png(original_path, png_path)
+        except Exception as e:
+            print(f"画像の変換中にエラーが発生しました: {png_path}, エラー: {e}")
+            return
+        self._record(png_path, seconds)
+
+    def _done(self, original_path, png_path, future):
+        try:
+            seconds = future.result()
+        except BrokenProcessPool:
+            # 変換中にプールが壊れた場合は、このプロセスの中で変換し直す
+            self._fall_back()
+            self._resize_in_process(original_path, png_path)
+            return
+        except Exception as e:
+            print(f"画像の変換中にエラーが発生しました: {png_path}, エラー: {e}")
+            return
+        self._record(png_path, seconds)
+
+    def _record(self, png_path, seconds):
+        metrics.observe('image_resize', seconds)
+        metrics.increment('images_resized')
+        print(f"拡大した画像を保存: {png_path}")
+
+    def close(self):
+        """投入した変換がすべて終わるまで待つ（プールが壊れた後に変換し直している分も含む）"""
+        self._executor.shutdown(wait=True)
+
+def png_path_for(name, output_dir):
+    """画像の名前（拡張子なし）に対応する拡大済み PNG のパスを返す関数"""
+    return os.path.join(output_dir, name + '.png')
+
+def resize_missing(store, member_name, output_dir, resizer):
+    """
+    画像ストアにあるメンバーの重複でない元画像のうち、拡大済みの PNG が無いものをすべて変換に回し、
+    その件数を返す関数（ネットワークは使わない）
+    """
+    images = store.unique_images(member_name)
+    if not images:
+        return 0
+    os.makedirs(output_dir, exist_ok=True)
+    count = 0
+    for name, original_path in images:
+        png_path = png_path_for(name, output_dir)
+        if not os.path.exists(png_path):
+            resizer.submit(original_path, png_path)
+            count += 1
+    return count
+
+class ImageSaver:
+    """
+    記事の画像を、デコードせずに元のバイト列のままストリーミングで並列に画像ストアへ保存するクラス。
+    取得済みかどうかはファイルの有無ではなく画像ストアのマニフェストで判定し、
+    同じ内容の画像（別の記事に再掲された写真など）は1つだけ保存する。
+    resizer（ImageResizer）を渡すと、新しく保存した重複でない元画像の拡大・PNG 変換をプロセスプールに回す。
+    同時実行数とアクセス間隔は crawler が制御する。
+    """
+
+    def __init__(self, crawler, store, member_name, output_dir, resizer=None, journal=None, ct_value=None):
+        self.crawler = crawler
+        self.store = store
+        self.member_name = member_name
+        self.output_dir = output_dir
+        self.resizer = resizer
+        self.journal = journal
+        self.ct_value = ct_value
+        if resizer is not None:
+            os.makedirs(output_dir, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=crawler.max_in_flight)
 
-    soup = BeautifulSoup(response.text, 'html.parser')
-    members = soup.select('ul.com-blog-circle li a')
+    def _save(self, img_url, name, article_id, date):
+        if self.store.has_source(img_url):
+            metrics.increment('images_skipped')
+            print(f"取得済みのためスキップ: {img_url}")
+            return
 
-    member_links = []
-    for member in members:
-        member_name = member.select_one('p.name').get_text().strip()
-        member_url = f"https://sakurazaka46.com{member['href']}"
-        member_links.append((member_name, member_url))
+        extension = os.path.splitext(urlparse(img_url).path)[1].lower()
+        if extension not in IMAGE_EXTENSIONS:
+            extension = '.img'  # 拡張子が分からなくても PIL は中身から形式を判別する
+        temp_path = self.store.temp_path(extension)
+        with metrics.timed('image_download'):
+            status_code, size = self.crawler.download(img_url, temp_path)
+        if status_code != 200:
+            print(f"画像のダウンロードに失敗: {img_url}")
+            return
+        stored = self.store.add(temp_path, img_url, self.member_name, article_id, date, name)
+        if self.journal is not None:
+            self.journal.record('image', self.ct_value, img_url, sha256=stored.sha256)
+        if not stored.new:
+            metrics.increment('images_exact_duplicates')
+            print(f"同じ内容の画像が保存済みです: {img_url}（{stored.name}）")
+            return
+        if stored.duplicate_of is not None:
+            metrics.increment('images_near_duplicates')
+            print(f"似た画像が保存済みのため、拡大しません: {img_url}")
+            return
+        metrics.increment('images_saved')
+        print(f"画像を保存: {name}（{size / 1024:.0f} KB）")
 
-    return member_links
+        if self.resizer is not None:
+            self.resizer.submit(stored.path, png_path_for(name, self.output_dir))
 
-# 各ブログページをスクレイピングして画像を保存する関数
-def scrape_blog_page(blog_url, member_name_rome, save_dir):
+    def save_all(self, images):
+        """(画像の URL, 拡張子なしの名前, 記事 ID, 日付) のリストを並列に保存し、すべて終わるまで待つ"""
+        futures = [self._pool.submit(self._save, *image) for image in images]
+        for future in futures:
+            future.result()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+# メンバー名とそのブログトップページのURLを取得する関数
+@metrics.instrument('get_member_list')
+def get_member_list(base_url, crawler, extractor):
+    response = crawler.get(base_url)
+    response.raise_for_status()
+
+    return [(member_name, absolute_url(href)) for member_name, href in extractor.member_links(response.text)]
+
+# 各ブログページをスクレイピングして画像を保存する関数（記事を処理できたら True を返す）
+@metrics.instrument('scrape_blog_page')
+def scrape_blog_page(blog_url, member_name_rome, saver, crawler, extractor):
     try:
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(blog_url, headers=headers)
+        response = crawler.get(blog_url)
         response.raise_for_status()
 
-        bs4_blog = BeautifulSoup(response.text, 'html.parser')
-        articles = bs4_blog.select('article.post')
+        # 同じ日付の記事が複数あっても名前が重ならないよう、名前に記事 ID を入れる
+        article_id = article_id_from_url(blog_url)
+        prefix = member_name_rome if article_id is None else f"{member_name_rome}_{article_id}"
 
-        for article in articles:
+        images = []
+        for article in extractor.articles(response.text):
             # 日付の取得
-            year_element = article.find('span', {'class': 'ym-year'})
-            month_element = article.find('span', {'class': 'ym-month'})
-            day_element = article.find('p', {'class': 'date wf-a'})
-
-            if year_element and month_element and day_element:
-                year = year_element.get_text().strip()
-                month = month_element.get_text().strip().zfill(2)
-                day = day_element.get_text().strip().zfill(2)
-                date = f"{year}/{month}/{day}"
-            else:
-                date = "unknown_date"
+            date = article['date'] or "unknown_date"
 
             # 画像の取得
-            img_elements = article.select('div.box-article img')
-            if img_elements:
-                img_counter = 1
-                for img in img_elements:
-                    src = img.get('src')
-                    if not src:
-                        continue
-                    img_url = f'https://sakurazaka46.com{src}'
-                    img_name = f"{member_name_rome}_{date.replace('/', '_')}_{img_counter}.png"
-                    img_path = os.path.join(save_dir, img_name)
-
-                    # ファイルが既に存在する場合はスキップ
-                    if os.path.exists(img_path):
-                        print(f"既に存在するためスキップ: {img_path}")
-                    else:
-                        img_response = requests.get(img_url)
-                        if img_response.status_code == 200:
-                            img_data = Image.open(BytesIO(img_response.content))
-                            if img_data.mode == "RGBA":
-                                img_data = img_data.convert("RGB")
-                            new_size = (img_data.width * 2, img_data.height * 2)
-                            img_resized = img_data.resize(new_size, Image.LANCZOS)
-                            img_resized.save(img_path, format="PNG")
-                            print(f"画像を保存: {img_path}")
-                        else:
-                            print(f"画像のダウンロードに失敗: {img_url}")
-
-                    img_counter += 1
-                    time.sleep(random.uniform(2, 5))
+            if article['images']:
+                for src in article['images']:
+                    name = f"{prefix}_{date.replace('/', '_')}_{len(images) + 1}"
+                    images.append((absolute_url(src), name, article_id, date))
             else:
                 print(f"画像が見つかりませんでした: {blog_url}")
 
+        # 記事の画像をまとめて並列に保存する（記事の完了を記録する前に保存し終える）
+        saver.save_all(images)
+        return True
+
     except Exception as e:
-        print(f"エラーが発生しました: {e}")
+        print(f"ブログ記事の処理中にエラーが発生しました: {blog_url}")
+        traceback.print_exc()
+        return False
 
 # メンバーごとの全ブログをスクレイピング
-def scrape_all_blogs(member_url, member_name_rome, member_name_kanji):
+# journal（CrawlJournal）を渡すと完了した一覧ページ・記事・画像を記録し、記録済みの記事は処理しない
+# resize=False なら元画像だけを保存し、拡大・PNG 変換は行わない（後から --resize-only で作れる）
+# store（ImageStore）を渡さなければ既定の image_store/ を開き、終わったら閉じる
+def scrape_all_blogs(member_url, member_name_rome, member_name_kanji, crawler, extractor, article_index=None,
+                     journal=None, resize=True, resize_workers=None, store=None):
     # メンバーのct値を取得
-    parsed_url = urlparse(member_url)
-    query_params = parse_qs(parsed_url.query)
-    ct_value = query_params.get('ct', [''])[0]
-    ima_value = query_params.get('ima', ['0000'])[0]
+    ct_value, ima_value = member_query(member_url)
+
+    own_store = store is None
+    if own_store:
+        store = ImageStore()
+    output_dir = os.path.join(OUTPUT_DIR, member_name_kanji)
+    resizer = ImageResizer(resize_workers) if resize else None
+    saver = ImageSaver(crawler, store, member_name_kanji, output_dir, resizer, journal, ct_value)
+    try:
+        if resizer is not None:
+            # 中断した実行などで変換されずに残った元画像も変換する
+            pending = resize_missing(store, member_name_kanji, output_dir, resizer)
+            if pending:
+                print(f"変換されていない元画像 {pending} 件を変換します。")
+        _scrape_member(member_url, member_name_rome, crawler, extractor, article_index, journal, saver,
+                       ct_value, ima_value)
+    finally:
+        saver.close()
+        if resizer is not None:
+            resizer.close()
+        print(store.summary())
+        if own_store:
+            store.close()
+
+def _scrape_member(member_url, member_name_rome, crawler, extractor, article_index, journal, saver, ct_value,
+                   ima_value):
+    # 各ブログ記事を並列にスクレイピング（同時実行数とアクセス間隔は crawler が制御）
+    def scrape(blog_url):
+        print(f"ブログをスクレイピング中: {blog_url}")
+        if not scrape_blog_page(blog_url, member_name_rome, saver, crawler, extractor):
+            return
+        article_id = article_id_from_url(blog_url)
+        if article_id is None:
+            return
+        if article_index is not None:
+            article_index.mark_processed(ct_value, article_id)
+        if journal is not None:
+            journal.record('article', ct_value, article_id)
+            journal.commit()
 
-    save_dir = os.path.join('data', member_name_kanji)
-    if not os.path.exists(save_dir):
-        os.makedirs(save_dir)
+    # 通常は最後の一覧ページを調べてから全ページを並列に取得し、記事の処理もすぐに始める
+    if article_index is None:
+        blog_links = iter_all_article_links(crawler, extractor, ima_value, ct_value, journal)
+        done_ids = journal.done('article', ct_value) if journal is not None else set()
+        if done_ids:
+            print(f"ジャーナルに記録済みの {len(done_ids)} 記事はスキップします。")
+            blog_links = (blog_url for blog_url in blog_links if article_id_from_url(blog_url) not in done_ids)
+        for _ in crawler.map(scrape, blog_links):
+            pass
+        return
 
+    # インクリメンタルモードでは、処理済みの記事に当たった時点で止められるよう1ページずつたどる
     page_num = 0
     while True:
         # ページURLを構築
-        page_url = f"https://sakurazaka46.com/s/s46/diary/blog/list?ima={ima_value}&page={page_num}&ct={ct_value}"
+        page_url = list_page_url(ima_value, ct_value, page_num)
         print(f"ページをスクレイピング中: {page_url}")
 
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(page_url, headers=headers)
+        response = crawler.get(page_url)
         if response.status_code != 200:
             print(f"ページが存在しませんでした: {page_url}")
             break
 
-        soup = BeautifulSoup(response.text, 'html.parser')
-
         # ブログ記事のURLを取得
-        blog_links = []
-        articles = soup.select('ul.com-blog-part li.box a')
-        for article in articles:
-            blog_link = f"https://sakurazaka46.com{article['href']}"
-            blog_links.append(blog_link)
+        blog_links = [absolute_url(href) for href in extractor.article_links(response.text)]
 
         if not blog_links:
             print(f"ブログ記事が見つかりませんでした: {page_url}")
             break
 
-        # 各ブログ記事をスクレイピング
-        for blog_url in blog_links:
-            print(f"ブログをスクレイピング中: {blog_url}")
-            scrape_blog_page(blog_url, member_name_rome, save_dir)
-            time.sleep(random.uniform(2, 5))
+        # 処理済みの記事を除き、1ページすべて処理済みなら巡回を終える
+        known_ids = article_index.known_ids(ct_value)
+        blog_links = [blog_url for blog_url in blog_links if article_id_from_url(blog_url) not in known_ids]
+        if not blog_links:
+            print(f"このページの記事はすべて処理済みのため、巡回を終了します: {page_url}")
+            break
+
+        for _ in crawler.map(scrape, blog_links):
+            pass
 
         # 次のページへ
         page_num += 1
-        time.sleep(random.uniform(2, 5))
 
 # メイン処理
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='指定されたメンバーのブログから写真を収集します。')
     parser.add_argument('--member', type=str, help='メンバーの名前（漢字）を指定してください。')
+    parser.add_argument('--no-resize', action='store_true',
+                        help='元画像だけを保存し、2倍への拡大と PNG への変換を行わない')
+    parser.add_argument('--resize-workers', type=int, default=None,
+                        help='拡大・PNG 変換を行うプロセス数（既定は CPU コア数）')
+    parser.add_argument('--resize-only', action='store_true',
+                        help='ネットワークにアクセスせず、画像ストアの元画像から拡大した PNG を作って終了します')
+    add_store_arguments(parser)
+    add_crawler_arguments(parser)
+    add_incremental_arguments(parser)
+    add_journal_arguments(parser)
+    add_extract_arguments(parser)
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    profiler = profiler_from_args(args)
+    store = store_from_args(args)
+
+    if args.resize_only:
+        # 元画像を残しているので、変換はいつでも同じ結果で作り直せる
+        members = [args.member] if args.member else store.members()
+        resizer = ImageResizer(args.resize_workers)
+        for member_name in members:
+            count = resize_missing(store, member_name, os.path.join(OUTPUT_DIR, member_name), resizer)
+            print(f"{member_name}: {count} 件の元画像を変換します。")
+        resizer.close()
+        store.close()
+        if profiler is not None:
+            profiler.stop()
+        sys.exit(0)
 
-    base_url = 'https://sakurazaka46.com/s/s46/diary/blog/list?ima=0000'
-    member_list = get_member_list(base_url)
+    crawler = crawler_from_args(args)
+    article_index = index_from_args(args, 'images')
+    extractor = extractor_from_args(args)
+
+    base_url = absolute_url('/s/s46/diary/blog/list?ima=0000')
+    member_list = get_member_list(base_url, crawler, extractor)
 
     # メンバーが指定されている場合
     if args.member:
         for member_name, member_url in member_list:
             if member_name == args.member:
                 member_name_rome = conv.do(member_name)  # ローマ字に変換
-                scrape_all_blogs(member_url, member_name_rome, member_name)
+                journal = journal_from_args(args, 'images', member_query(member_url)[0])
+                try:
+                    scrape_all_blogs(member_url, member_name_rome, member_name, crawler, extractor, article_index,
+                                     journal, resize=not args.no_resize, resize_workers=args.resize_workers,
+                                     store=store)
+                finally:
+                    if journal is not None:
+                        journal.close()
                 break
         else:
             print(f"指定されたメンバー名 '{args.member}' が見つかりませんでした。")
     else:
         print("メンバー名が指定されていません。--member 引数を使用してください。")
+
+    crawler.close()
+    store.close()
+    if article_index is not None:
+        article_index.close()
+    if profiler is not None:
+        profiler.stop()
@@ -1,5 +1,11 @@
 from PIL import Image, ImageEnhance, ImageFilter
 import os
+import sys
+import argparse
+
+# 共通モジュール（リポジトリ直下の Common/）を読み込めるようにする
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from image_store import open_store, unique_image_names
 
 
 def create_directory(path):
@@ -45,8 +51,11 @@ def augment_image(image_path, output_dir):
         print(f"画像処理中にエラーが発生しました: {image_path}, エラー: {e}")
 
 
-def augment_dataset(input_dir, output_dir):
-    """ディレクトリ全体に対してデータ拡張を行う関数"""
+def augment_dataset(input_dir, output_dir, store=None):
+    """
+    ディレクトリ全体に対してデータ拡張を行う関数。
+    内容が同じ画像と、store（ImageStore）で似た画像として記録された写真から切り抜いた顔は処理しない。
+    """
     for member_name in os.listdir(input_dir):
         member_input_dir = os.path.join(input_dir, member_name)
         member_output_dir = os.path.join(output_dir, member_name)
@@ -56,7 +65,7 @@ def augment_dataset(input_dir, output_dir):
 
         create_directory(member_output_dir)
 
-        for image_name in os.listdir(member_input_dir):
+        for image_name in unique_image_names(member_input_dir, store):
             image_path = os.path.join(member_input_dir, image_name)
             augment_image(image_path, member_output_dir)
 
@@ -68,5 +77,16 @@ if __name__ == "__main__":
     # 出力データのディレクトリ（拡張後の画像を保存）
     output_directory = r"C:\Users\n-nakagawa_d1\Desktop\Python\Sakurazaka\FaceRecognition\data\AugmentedFaceData"
 
+    parser = argparse.ArgumentParser(description='切り抜いた顔画像のデータ拡張を行います。')
+    parser.add_argument('--input', type=str, default=input_directory, help='入力画像のディレクトリ（メンバーごとのフォルダを含む）')
+    parser.add_argument('--output', type=str, default=output_directory, help='拡張後の画像を保存するディレクトリ')
+    parser.add_argument('--image-store', type=str, default=None,
+                        help='画像ダウンローダーの画像ストアのディレクトリ（指定すると似た画像として記録された写真の顔を処理しない）')
+    args = parser.parse_args()
+    store = open_store(args.image_store)
+
     # データ拡張を実行
-    augment_dataset(input_directory, output_directory)
+    augment_dataset(args.input, args.output, store)
+
+    if store is not None:
+        store.close()
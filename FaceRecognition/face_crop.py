@@ -1,8 +1,15 @@
 from PIL import Image
 import numpy as np
 import os
+import sys
+import argparse
 from mtcnn import MTCNN
 
+# 共通モジュール（リポジトリ直下の Common/）を読み込めるようにする
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from instrumentation import add_profile_arguments, metrics, profiler_from_args
+from image_store import open_store, unique_image_names
+
 def create_directory(path):
     """ディレクトリが存在しなければ作成する関数"""
     if not os.path.exists(path):
@@ -21,23 +28,29 @@ def read_image_pil(image_path):
         print(f"Pillowで画像を読み込めませんでした: {image_path}, エラー: {e}")
         return None
 
-def detect_and_crop_faces_mtcnn(input_dir, output_dir):
-    """MTCNNを使用して顔を検出し、切り抜いた顔画像を保存する関数"""
+@metrics.instrument('detect_and_crop_faces_mtcnn')
+def detect_and_crop_faces_mtcnn(input_dir, output_dir, store=None):
+    """
+    MTCNNを使用して顔を検出し、切り抜いた顔画像を保存する関数。
+    内容が同じ画像と、store（ImageStore）で似た画像として記録された画像は処理しない。
+    """
     detector = MTCNN()
     member_name = os.path.basename(os.path.normpath(input_dir))  # メンバー名を取得
     member_output_dir = os.path.join(output_dir, member_name)  # メンバーごとのフォルダ作成
     create_directory(member_output_dir)
 
-    for image_name in os.listdir(input_dir):
+    for image_name in unique_image_names(input_dir, store):
         image_path = os.path.join(input_dir, image_name)
         print(f"処理中の画像: {image_path}")
 
-        img = read_image_pil(image_path)
+        with metrics.timed('image_read'):
+            img = read_image_pil(image_path)
         if img is None:
             continue
 
         try:
-            faces = detector.detect_faces(img)
+            with metrics.timed('mtcnn_detect'):
+                faces = detector.detect_faces(img)
         except Exception as e:
             print(f"顔検出中にエラーが発生しました: {image_path}, エラー: {e}")
             continue
@@ -59,8 +72,10 @@ def detect_and_crop_faces_mtcnn(input_dir, output_dir):
             try:
                 if face_img is not None and face_img.size > 0:
                     # PILを使用して画像を保存 (色を保持)
-                    face_image = Image.fromarray(face_img)
-                    face_image.save(output_path)
+                    with metrics.timed('face_save'):
+                        face_image = Image.fromarray(face_img)
+                        face_image.save(output_path)
+                    metrics.increment('faces')
                     print(f"顔を切り抜いて保存しました: {output_path}")
                 else:
                     print(f"切り抜き画像が不正です: {output_filename}")
@@ -75,5 +90,21 @@ if __name__ == "__main__":
     # 出力データのディレクトリ
     output_directory = r"C:\Users\n-nakagawa_d1\Desktop\Python\Sakurazaka\FaceRecognition\data\FaceCropData"  # 切り抜いた顔画像を保存する場所
 
+    parser = argparse.ArgumentParser(description='画像から顔を検出して切り抜きます。')
+    parser.add_argument('--input', type=str, default=input_directory, help='入力画像のディレクトリ（単一のメンバーのフォルダ）')
+    parser.add_argument('--output', type=str, default=output_directory, help='切り抜いた顔画像を保存するディレクトリ')
+    parser.add_argument('--image-store', type=str, default=None,
+                        help='画像ダウンローダーの画像ストアのディレクトリ（指定すると似た画像として記録された画像を処理しない）')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    profiler = profiler_from_args(args)
+    store = open_store(args.image_store)
+
     # 顔検出と切り抜きを実行
-    detect_and_crop_faces_mtcnn(input_directory, output_directory)
+    detect_and_crop_faces_mtcnn(args.input, args.output, store)
+
+    if store is not None:
+        store.close()
+
+    if profiler is not None:
+        profiler.stop()
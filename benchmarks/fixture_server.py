@@ -0,0 +1,280 @@
+# fixture_server.py
+
+import argparse
+import io
+import os
+import random
+import re
+import threading
+from collections import Counter
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# サイトと同じ URL 構成
+MEMBER_LIST_PATH = '/s/s46/diary/blog/list'
+DETAIL_PATTERN = re.compile(r'^/s/s46/diary/detail/(\d+)$')
+IMAGE_PREFIX = '/files/14/diary/s46/blog/moblog/'
+
+FIRST_ARTICLE_ID = 50000
+ARTICLE_ID_STRIDE = 10000  # メンバーごとの記事 ID の間隔
+LATEST_DATE = date(2024, 12, 31)
+DAYS_BETWEEN_ARTICLES = 3
+
+# 記事本文に使う文（ブログらしい長さ・記号の混ざり方をまねたもの）
+SENTENCES = [
+    'こんにちは！',
+    '今日はとても楽しい一日でした。',
+    'ライブに来てくださった皆さん、本当にありがとうございました！！',
+    '少し疲れたけど、また明日から頑張ります。',
+    'リハーサルが長引いてしまって、お昼ご飯を食べ損ねてしまいました。',
+    '新しい衣装がとってもかわいくて、早く皆さんに見てほしいです。',
+    '昨日は雨が降っていたので、家でゆっくり映画を見ていました。',
+    '久しぶりにメンバーと一緒にご飯に行けて嬉しかったです。',
+    '悔しい気持ちもあるけれど、次こそはもっと良いパフォーマンスを届けたいです。',
+    '最近寒くなってきたので、皆さんも体調には気をつけてくださいね。',
+    'え、もうこんな時間？',
+    '握手会で話しかけてくれた方、覚えていますよ。',
+    'ずっと練習してきたダンスがやっと形になってきました。',
+    '正直に言うと、今回はすごく緊張していて不安でした。',
+    '写真をたくさん撮ったので、少しずつ載せていきます。',
+    'では、また明日！',
+]
+
+MEMBER_NAMES = ['井上 梨名', '齋藤 冬優花', '田村 保乃', '藤吉 夏鈴', '森田 ひかる', '山﨑 天']
+
+
+class FixtureSite:
+    """
+    メンバー一覧・ブログ一覧・記事・画像をその場で組み立てる架空のサイト。
+    同じ設定なら何度呼んでも同じページを返すので、コミット間で結果を比べられる。
+    画像は URL ごとに内容の違う画像を生成し、duplicate_rate の割合の URL では再掲した写真として
+    メンバーの最新記事の1枚目と同じ画像を返す。
+    image_dir を指定すると、画像はそのディレクトリの写真（顔の写った実写真など）を順に返す。
+    """
+
+    def __init__(self, members=2, pages_per_member=3, articles_per_page=10, sentences_per_article=30,
+                 images_per_article=3, image_dir=None, duplicate_rate=0.0):
+        self.members = members
+        self.pages_per_member = pages_per_member
+        self.articles_per_page = articles_per_page
+        self.sentences_per_article = sentences_per_article
+        self.images_per_article = images_per_article
+        self.duplicate_rate = duplicate_rate
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._photos = self._load_photos(image_dir)
+        self._background = None if self._photos else _gradient_image()
+
+    @staticmethod
+    def _load_photos(image_dir):
+        if not image_dir:
+            return []
+        names = sorted(name for name in os.listdir(image_dir) if name.lower().endswith(('.jpg', '.jpeg', '.png')))
+        photos = []
+        for name in names:
+            with open(os.path.join(image_dir, name), 'rb') as f:
+                photos.append(f.read())
+        if not photos:
+            print(f"画像が見つからないため、生成した画像を使います: {image_dir}")
+        return photos
+
+    def count(self, kind):
+        with self._lock:
+            self.counts[kind] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def member_code(self, member_index):
+        return f"{member_index + 1:02d}"
+
+    def member_name(self, member_index):
+        if member_index < len(MEMBER_NAMES):
+            return MEMBER_NAMES[member_index]
+        return f"メンバー {member_index + 1:02d}"
+
+    def article_id(self, member_index, position):
+        return FIRST_ARTICLE_ID + member_index * ARTICLE_ID_STRIDE + position
+
+    def member_list_html(self):
+        items = []
+        for member_index in range(self.members):
+            items.append(
+                f'<li><a href="{MEMBER_LIST_PATH}?ima=0000&ct={self.member_code(member_index)}">'
+                f'<div class="img"><img src="/images/14/member/{member_index}.jpg" alt=""></div>'
+                f'<p class="name">{self.member_name(member_index)}</p></a></li>')
+        return _page('公式ブログ', f'<ul class="com-blog-circle fxpc">{"".join(items)}</ul>')
+
+    def blog_list_html(self, ct, page):
+        member_index = int(ct) - 1 if ct.isdigit() else -1
+        if not 0 <= member_index < self.members:
+            return None
+        items = []
+        if 0 <= page < self.pages_per_member:
+            for i in range(self.articles_per_page):
+                position = page * self.articles_per_page + i
+                article_id = self.article_id(member_index, position)
+                posted = self.article_date(position)
+                items.append(
+                    f'<li class="box"><a href="/s/s46/diary/detail/{article_id}?ima=0000&cd=blog">'
+                    f'<div class="date wf-a">{posted.year}/{posted.month}/{posted.day}</div>'
+                    f'<p class="title">記事 {article_id}</p></a></li>')
+        pager = ''.join(f'<li><a href="?ima=0000&page={p}&ct={ct}">{p + 1}</a></li>'
+                        for p in range(self.pages_per_member))
+        body = (f'<ul class="com-blog-part box3 fxpc">{"".join(items)}</ul>'
+                f'<div class="com-pager"><ul>{pager}</ul></div>')
+        return _page(f'{self.member_name(member_index)} 公式ブログ', body)
+
+    def article_date(self, position):
+        return LATEST_DATE - timedelta(days=position * DAYS_BETWEEN_ARTICLES)
+
+    def article_html(self, article_id):
+        member_index, position = divmod(article_id - FIRST_ARTICLE_ID, ARTICLE_ID_STRIDE)
+        if not 0 <= member_index < self.members or position >= self.pages_per_member * self.articles_per_page:
+            return None
+        rng = random.Random(article_id)
+        lines = [f'<div>{rng.choice(SENTENCES)}</div>' for _ in range(self.sentences_per_article)]
+        # 画像は本文の途中に散らして入れる
+        for n in range(self.images_per_article):
+            image = f'<div><img src="{IMAGE_PREFIX}{article_id}_{n + 1}.jpg" alt=""></div>'
+            lines.insert(rng.randrange(len(lines) + 1), image)
+        posted = self.article_date(position)
+        body = (
+            '<article class="post"><div class="blog-title"><div class="ym-box">'
+            f'<span class="ym-year">{posted.year}</span><span class="ym-month">{posted.month}</span></div>'
+            f'<p class="date wf-a">{posted.day}</p><h1 class="title">記事 {article_id}</h1></div>'
+            f'<div class="box-article">{"".join(lines)}</div>'
+            f'<div class="blog-foot"><p class="name">{self.member_name(member_index)}</p></div></article>')
+        return _page(f'記事 {article_id}', body)
+
+    def image_key(self, article_id, number):
+        """
+        画像の内容を決める (記事 ID, 番号) を返す関数。
+        duplicate_rate の割合で、メンバーの最新記事の1枚目（再掲した写真）と同じものにする。
+        """
+        member_index = (article_id - FIRST_ARTICLE_ID) // ARTICLE_ID_STRIDE
+        original = (self.article_id(member_index, 0), 1)
+        if (article_id, number) != original and \
+                random.Random(f"duplicate:{article_id}_{number}").random() < self.duplicate_rate:
+            return original
+        return article_id, number
+
+    def image_bytes(self, name):
+        match = re.match(r'^(\d+)_(\d+)\.jpg$', name)
+        if not match:
+            return None
+        article_id, number = self.image_key(int(match.group(1)), int(match.group(2)))
+        if self._photos:
+            return self._photos[(article_id + number) % len(self._photos)]
+
+        # URL（記事 ID と番号）から決まる図形を背景に重ね、URL ごとに内容の違う画像にする
+        from PIL import ImageDraw
+
+        rng = random.Random(f"{article_id}_{number}")
+        image = self._background.copy()
+        draw = ImageDraw.Draw(image)
+        width, height = image.size
+        for _ in range(16):
+            x, y = rng.randrange(width), rng.randrange(height)
+            box = (x, y, x + rng.randrange(40, width // 2), y + rng.randrange(40, height // 2))
+            color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+            (draw.ellipse if rng.random() < 0.5 else draw.rectangle)(box, fill=color)
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=85)
+        return buffer.getvalue()
+
+
+def _gradient_image(width=640, height=480):
+    from PIL import Image
+
+    image = Image.new('RGB', (width, height))
+    image.putdata([((x * 255) // width, (y * 255) // height, 128) for y in range(height) for x in range(width)])
+    return image
+
+
+def _page(title, body):
+    return (f'<!DOCTYPE html><html lang="ja"><head><meta charset="utf-8"><title>{title} | 櫻坂46公式サイト</title>'
+            f'</head><body><main>{body}</main></body></html>')
+
+
+def _handler_for(site):
+    class FixtureHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive を有効にする
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            query = parse_qs(parsed.query)
+            detail = DETAIL_PATTERN.match(parsed.path)
+
+            if parsed.path == MEMBER_LIST_PATH and 'ct' not in query:
+                kind, body = 'member_list', site.member_list_html()
+            elif parsed.path == MEMBER_LIST_PATH:
+                page = query.get('page', ['0'])[0]
+                kind, body = 'list', site.blog_list_html(query['ct'][0], int(page) if page.isdigit() else 0)
+            elif detail:
+                kind, body = 'detail', site.article_html(int(detail.group(1)))
+            elif parsed.path.startswith(IMAGE_PREFIX):
+                kind, body = 'image', site.image_bytes(parsed.path[len(IMAGE_PREFIX):])
+            else:
+                kind, body = 'other', None
+
+            site.count(kind)
+            if body is None:
+                self.send_error(404)
+                return
+            if kind == 'image':
+                payload, content_type = body, 'image/jpeg'
+            else:
+                payload, content_type = body.encode('utf-8'), 'text/html; charset=utf-8'
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass  # アクセスログは出さない
+
+    return FixtureHandler
+
+
+def serve(site, host='127.0.0.1', port=0):
+    """site を別スレッドで配信し、(server, ルート URL) を返す関数（port=0 なら空いているポートを使う）"""
+    server = ThreadingHTTPServer((host, port), _handler_for(site))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def add_site_arguments(parser):
+    """架空サイトの規模のオプションを argparse に追加する関数"""
+    parser.add_argument('--members', type=int, default=2, help='メンバー数')
+    parser.add_argument('--pages', type=int, default=3, help='メンバーごとのブログ一覧のページ数')
+    parser.add_argument('--articles-per-page', type=int, default=10, help='一覧1ページあたりの記事数')
+    parser.add_argument('--sentences', type=int, default=30, help='1記事あたりの文の数')
+    parser.add_argument('--images', type=int, default=3, help='1記事あたりの画像の数')
+    parser.add_argument('--image-dir', type=str, default=None,
+                        help='配信する画像（顔の写った写真など）のディレクトリ（省略時は生成した画像）')
+    parser.add_argument('--duplicate-rate', type=float, default=0.0,
+                        help='再掲した写真として、ほかの記事と同じ画像を返す画像 URL の割合（0〜1）')
+
+
+def site_from_args(args):
+    return FixtureSite(args.members, args.pages, args.articles_per_page, args.sentences, args.images, args.image_dir,
+                       args.duplicate_rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ベンチマーク用の架空のブログサイトを配信します。')
+    parser.add_argument('--port', type=int, default=8046)
+    add_site_arguments(parser)
+    args = parser.parse_args()
+
+    server, root = serve(site_from_args(args), port=args.port)
+    print(f"{root} で配信中です（Ctrl+C で終了）。スクレイパーは SAKURAZAKA_SITE_ROOT={root} を指定して実行してください。")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
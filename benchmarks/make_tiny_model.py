@@ -0,0 +1,57 @@
+# make_tiny_model.py
+
+import argparse
+import os
+
+from fixture_server import SENTENCES
+
+# 小さなモデルの既定の保存先（リポジトリ直下の .cache/tiny_emotion_model/）
+DEFAULT_TINY_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache', 'tiny_emotion_model')
+NUM_LABELS = 8  # 本番のモデル（koshin2001/Japanese-to-emotions）と同じラベル数
+SPECIAL_TOKENS = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+
+
+def build_tiny_model(path=DEFAULT_TINY_MODEL_DIR, hidden_size=64, num_layers=2, seed=0):
+    """
+    ネットワークなしでベンチマークを回すための、ランダムな重みの小さな BERT 分類モデルを保存する関数。
+    トークナイザーは1文字1トークンなので、系列長は本番のモデルと同程度になる。推論結果そのものに意味はない。
+    """
+    import torch
+    from tokenizers import Regex, Tokenizer, models, pre_tokenizers, processors
+    from transformers import BertConfig, BertForSequenceClassification, PreTrainedTokenizerFast
+
+    characters = set(''.join(SENTENCES))
+    characters |= {chr(code) for code in range(0x3041, 0x3100)}  # ひらがな・カタカナ
+    characters |= {chr(code) for code in range(0x21, 0x7f)}      # ASCII
+    vocab = {token: i for i, token in enumerate(SPECIAL_TOKENS + sorted(characters - set(SPECIAL_TOKENS)))}
+
+    backend = Tokenizer(models.WordLevel(vocab, unk_token='[UNK]'))
+    backend.pre_tokenizer = pre_tokenizers.Split(Regex('.'), behavior='isolated')
+    backend.post_processor = processors.TemplateProcessing(
+        single='[CLS] $A [SEP]', special_tokens=[('[CLS]', vocab['[CLS]']), ('[SEP]', vocab['[SEP]'])])
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend, unk_token='[UNK]', pad_token='[PAD]', cls_token='[CLS]', sep_token='[SEP]',
+        mask_token='[MASK]', model_max_length=512)
+
+    torch.manual_seed(seed)
+    config = BertConfig(
+        vocab_size=len(vocab), hidden_size=hidden_size, num_hidden_layers=num_layers, num_attention_heads=2,
+        intermediate_size=hidden_size * 4, max_position_embeddings=512, num_labels=NUM_LABELS,
+        id2label={i: f'LABEL_{i}' for i in range(NUM_LABELS)}, label2id={f'LABEL_{i}': i for i in range(NUM_LABELS)})
+    model = BertForSequenceClassification(config)
+    model.eval()
+
+    os.makedirs(path, exist_ok=True)
+    model.save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    print(f"小さな感情分析モデルを保存しました: {os.path.abspath(path)}")
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ベンチマーク用の小さな感情分析モデルを作成します。')
+    parser.add_argument('--output', type=str, default=DEFAULT_TINY_MODEL_DIR, help='保存先のディレクトリ')
+    parser.add_argument('--hidden-size', type=int, default=64)
+    parser.add_argument('--layers', type=int, default=2)
+    args = parser.parse_args()
+    build_tiny_model(args.output, args.hidden_size, args.layers)
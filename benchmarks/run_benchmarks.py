@@ -0,0 +1,363 @@
+# run_benchmarks.py
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from datetime import datetime, timezone
+
+from fixture_server import MEMBER_LIST_PATH, add_site_arguments, serve, site_from_args
+from make_tiny_model import DEFAULT_TINY_MODEL_DIR, build_tiny_model
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.abspath(os.path.join(BENCHMARK_DIR, '..'))
+sys.path.append(os.path.join(REPO_ROOT, 'Common'))
+sys.path.append(os.path.join(REPO_ROOT, 'EmotionAnalysis', 'src'))
+sys.path.append(os.path.join(REPO_ROOT, 'FaceRecognition'))
+
+PHASES = ('emotion', 'images', 'faces')
+
+
+def peak_rss_mb():
+    """このプロセスの最大常駐メモリ（MB）を返す関数（取得できない環境では None）"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def latency_summary(latencies):
+    from stage_pipeline import percentile
+
+    return {'items': len(latencies), 'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000}
+
+
+def bench_crawler(config):
+    """ローカルサーバー向けに、待ち時間なし・キャッシュなしのクローラーを作る関数"""
+    from crawler import Crawler
+
+    return Crawler(rate=config['rate'], burst=config['max_in_flight'], max_in_flight=config['max_in_flight'],
+                   cache=None)
+
+
+def bench_emotion(config):
+    """感情分析のスクレイパー（取得 → 解析 → 文分割 → 推論）を全メンバー分実行して計測する"""
+    os.environ['EMOTION_MODEL_NAME'] = config['model']  # emotion_model の import 前に指定する
+    import emotion_model
+    import EmotionDetection_FromText as emotion_app
+    from emotion_aggregator import EmotionAggregator
+    from extract import absolute_url, get_extractor
+    from results_sink import open_sink
+    from stage_pipeline import StagePipeline
+
+    # scrape_all_blogs の中で作られるパイプラインを記録する
+    pipelines = []
+
+    class RecordingPipeline(StagePipeline):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            pipelines.append(self)
+
+    emotion_app.StagePipeline = RecordingPipeline
+
+    emotion_model.configure_backend(config['backend'])
+    emotion_model.configure_inference_cache(None)  # 2回目以降の計測がキャッシュに当たらないようにする
+    start = time.perf_counter()
+    emotion_model.load_model()
+    model_load_seconds = time.perf_counter() - start
+
+    crawler = bench_crawler(config)
+    extractor = get_extractor(config['html_backend'])
+    members = emotion_app.get_member_list(absolute_url(f"{MEMBER_LIST_PATH}?ima=0000"), crawler, extractor)
+
+    sentences = 0
+    articles = 0
+    start = time.perf_counter()
+    for member_name, member_url in members:
+        sink = open_sink(os.path.join(config['work_dir'], f"{member_name.replace(' ', '')}.jsonl"), 'jsonl')
+        aggregator = EmotionAggregator()
+        try:
+            emotion_app.scrape_all_blogs(
+                member_url, sink, member_name, crawler, extractor, aggregator, config['batch_size'],
+                config['max_tokens_per_batch'], 'regex', None, None, config['parse_workers'], config['queue_size'])
+        finally:
+            sink.close()
+        sentences += sink.rows_written
+        articles += aggregator.articles
+    elapsed = time.perf_counter() - start
+    crawler.close()
+
+    stages = {}
+    for pipeline in pipelines:
+        for stage in pipeline.stages:
+            stages.setdefault(stage.name, []).extend(stage.latencies)
+    return {
+        'elapsed_seconds': elapsed,
+        'model_load_seconds': model_load_seconds,
+        'members': len(members),
+        'articles': articles,
+        'sentences': sentences,
+        'sentences_per_second': sentences / elapsed if elapsed else 0.0,
+        'stages': {name: latency_summary(latencies) for name, latencies in stages.items()},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def bench_images(config):
+    """画像ダウンローダーを全メンバー分実行して計測する（元画像は work_dir/image_store/、PNG は work_dir/data/ に保存）"""
+    import Sakurazaka_BlogImage_Downloader as downloader
+    from extract import absolute_url, get_extractor
+    from image_store import DEFAULT_STORE_DIR, ImageStore
+
+    # 記事ごとの処理時間（取得・解析・画像の保存まで）と、処理に失敗した記事の数を記録する
+    latencies = []
+    failures = []
+    scrape_blog_page = downloader.scrape_blog_page
+
+    def timed_scrape_blog_page(*args):
+        start = time.perf_counter()
+        succeeded = False
+        try:
+            succeeded = scrape_blog_page(*args)
+            return succeeded
+        finally:
+            latencies.append(time.perf_counter() - start)
+            if not succeeded:
+                failures.append(args[0])
+
+    downloader.scrape_blog_page = timed_scrape_blog_page
+
+    crawler = bench_crawler(config)
+    extractor = get_extractor(config['html_backend'])
+    members = downloader.get_member_list(absolute_url(f"{MEMBER_LIST_PATH}?ima=0000"), crawler, extractor)
+
+    start = time.perf_counter()
+    for member_name, member_url in members:
+        downloader.scrape_all_blogs(member_url, downloader.conv.do(member_name), member_name, crawler, extractor)
+    elapsed = time.perf_counter() - start
+    crawler.close()
+
+    # 取得した画像の件数はマニフェストから数える（同じ内容の画像は1つしか保存しないため）
+    store = ImageStore(os.path.join(config['work_dir'], DEFAULT_STORE_DIR))
+    images = store.source_count()
+    unique_images = len(store.unique_images())
+    store.close()
+    return {
+        'elapsed_seconds': elapsed,
+        'members': len(members),
+        'articles': len(latencies),
+        'failed_articles': len(failures),
+        'images': images,
+        'unique_images': unique_images,
+        'images_per_second': images / elapsed if elapsed else 0.0,
+        'stages': {'article': latency_summary(latencies)},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def bench_faces(config):
+    """images で保存した画像から MTCNN で顔を切り抜いて計測する"""
+    try:
+        import face_crop
+    except ImportError as e:
+        return {'skipped': f"face_crop を読み込めませんでした: {e}"}
+    from image_store import DEFAULT_STORE_DIR, open_store
+
+    data_dir = os.path.join(config['work_dir'], 'data')
+    output_dir = os.path.join(config['work_dir'], 'faces')
+    if not os.path.isdir(data_dir):
+        return {'skipped': '画像がありません（images フェーズを先に実行してください）'}
+    member_dirs = [os.path.join(data_dir, name) for name in sorted(os.listdir(data_dir))]
+    images = sum(len(os.listdir(member_dir)) for member_dir in member_dirs)
+
+    store = open_store(os.path.join(config['work_dir'], DEFAULT_STORE_DIR))
+
+    start = time.perf_counter()
+    for member_dir in member_dirs:
+        face_crop.detect_and_crop_faces_mtcnn(member_dir, output_dir, store)
+    elapsed = time.perf_counter() - start
+    if store is not None:
+        store.close()
+
+    faces = sum(len(files) for _, _, files in os.walk(output_dir))
+    return {
+        'elapsed_seconds': elapsed,
+        'images': images,
+        'faces': faces,
+        'images_per_second': images / elapsed if elapsed else 0.0,
+        'faces_per_second': faces / elapsed if elapsed else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+_PHASE_FUNCTIONS = {'emotion': bench_emotion, 'images': bench_images, 'faces': bench_faces}
+
+
+def _run_phase(phase, config):
+    # 各フェーズは別プロセスで実行し、最大メモリをフェーズごとに測る
+    from instrumentation import metrics
+
+    os.chdir(config['work_dir'])
+    metrics.enabled = True  # HTTP・トークナイズ・推論・画像の保存などの内訳も記録する
+    try:
+        if config['verbose']:
+            result = _PHASE_FUNCTIONS[phase](config)
+        else:
+            with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+                result = _PHASE_FUNCTIONS[phase](config)
+    except Exception as e:
+        traceback.print_exc()
+        return {'error': f"{type(e).__name__}: {e}"}
+    result['metrics'] = metrics.to_dict()
+    return result
+
+
+def _phase_process(phase, config, connection):
+    connection.send(_run_phase(phase, config))
+    connection.close()
+
+
+def run_phase_in_process(context, phase, config):
+    """
+    フェーズを別プロセスで実行して結果を返す関数。
+    Pool のワーカーはデーモンプロセスで子プロセスを作れない（画像の変換のプロセスプールが動かない）ので、
+    通常の Process で実行する。
+    """
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_phase_process, args=(phase, config, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        process.join()
+        return {'error': f"フェーズのプロセスが結果を返さずに終了しました（終了コード {process.exitcode}）"}
+    process.join()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_benchmarks(args):
+    model = os.path.abspath(args.model or DEFAULT_TINY_MODEL_DIR)
+    if 'emotion' in args.phases and not args.model and not os.path.exists(os.path.join(model, 'config.json')):
+        build_tiny_model(model)
+
+    site = site_from_args(args)
+    server, root = serve(site)
+    # スクレイパーの接続先をローカルサーバーに向ける（ワーカープロセスにも引き継がれる）
+    os.environ['SAKURAZAKA_SITE_ROOT'] = root
+
+    results = {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'site': {'members': args.members, 'pages': args.pages, 'articles_per_page': args.articles_per_page,
+                 'sentences': args.sentences, 'images': args.images, 'image_dir': args.image_dir,
+                 'duplicate_rate': args.duplicate_rate},
+        'config': {'model': model, 'backend': args.backend, 'batch_size': args.batch_size,
+                   'html_backend': args.html_backend, 'max_in_flight': args.max_in_flight},
+    }
+
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory(prefix='sakurazaka-bench-') as work_dir:
+        config = {
+            'work_dir': work_dir, 'model': model, 'backend': args.backend,
+            'batch_size': args.batch_size, 'max_tokens_per_batch': args.max_tokens_per_batch,
+            'parse_workers': args.parse_workers, 'queue_size': args.queue_size, 'html_backend': args.html_backend,
+            'rate': args.rate, 'max_in_flight': args.max_in_flight, 'verbose': args.verbose,
+        }
+        for phase in PHASES:
+            if phase not in args.phases:
+                continue
+            print(f"計測中: {phase}", file=sys.stderr)
+            before = site.snapshot()
+            result = run_phase_in_process(context, phase, config)
+            after = site.snapshot()
+            requests = {kind: after.get(kind, 0) - before.get(kind, 0) for kind in after}
+            result['requests'] = requests
+            pages = requests.get('list', 0) + requests.get('detail', 0)
+            if result.get('elapsed_seconds'):
+                result['pages_per_second'] = pages / result['elapsed_seconds']
+            results[phase] = result
+
+    server.shutdown()
+    return results
+
+
+def _rates(results):
+    """比較に使う指標（…_per_second と p95）を平坦な辞書にする"""
+    rates = {}
+    for phase in PHASES:
+        result = results.get(phase) or {}
+        for key, value in result.items():
+            if key.endswith('_per_second') or key == 'peak_rss_mb':
+                rates[f"{phase}.{key}"] = value
+        for stage, stats in (result.get('stages') or {}).items():
+            rates[f"{phase}.{stage}.p95_ms"] = stats['p95_ms']
+    return rates
+
+
+def compare_results(baseline, current):
+    """2つの計測結果の指標を並べ、変化率を表にした文字列を返す関数"""
+    old, new = _rates(baseline), _rates(current)
+    lines = [f"比較: {baseline.get('commit')} → {current.get('commit')}",
+             f"{'指標':<36}{'基準':>12}{'今回':>12}{'変化':>9}"]
+    for key in sorted(set(old) | set(new)):
+        before, after = old.get(key), new.get(key)
+        if before is None or after is None:
+            continue
+        change = f"{(after / before - 1) * 100:+.1f}%" if before else '-'
+        lines.append(f"{key:<36}{before:>12.2f}{after:>12.2f}{change:>9}")
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='ローカルの架空サイトと小さなモデルで、ネットワークなしにスクレイパーと推論の性能を計測します。')
+    add_site_arguments(parser)
+    parser.add_argument('--phases', nargs='+', choices=PHASES, default=list(PHASES), help='計測するフェーズ')
+    parser.add_argument('--model', type=str, default=None,
+                        help='感情分析モデル（省略時は make_tiny_model.py の小さなモデルを作成して使用）')
+    parser.add_argument('--backend', type=str, default='torch', help='推論バックエンド')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--max-tokens-per-batch', type=int, default=8192)
+    parser.add_argument('--parse-workers', type=int, default=2)
+    parser.add_argument('--queue-size', type=int, default=8)
+    parser.add_argument('--html-backend', type=str, default='auto')
+    parser.add_argument('--rate', type=float, default=1000.0, help='ローカルサーバーへの1秒あたりのリクエスト数の上限')
+    parser.add_argument('--max-in-flight', type=int, default=8)
+    parser.add_argument('--output', type=str, default=None, help='結果の JSON を保存するファイル')
+    parser.add_argument('--compare', type=str, default=None, metavar='BASELINE_JSON',
+                        help='以前の結果の JSON と比較して変化率を表示する')
+    parser.add_argument('--verbose', action='store_true', help='スクレイパーの出力をそのまま表示する')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        print(f"計測結果を '{args.output}' に保存しました。", file=sys.stderr)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print(compare_results(json.load(f), results), file=sys.stderr)